@@ -1,5 +1,6 @@
 #!/usr/bin/env python
 
+import collections
 import getopt
 import json
 import locale
@@ -7,10 +8,13 @@ import os
 import platform
 import re
 import sys
-from urllib import request, parse
+import threading
+import time
+from urllib import error, request, parse
 
 from .version import __version__
 from .util import log
+from .util.connpool import ConnectionPool
 from .util.strings import get_filename, unescape_html
 
 dry_run = False
@@ -18,6 +22,23 @@ force = False
 player = None
 extractor_proxy = None
 cookies_txt = None
+jobs = 1
+use_asyncio = False
+stream_merge = False
+split_time = None
+split_size = None
+live_retries = 5
+archive = None
+# Off while --batch-jobs downloads run concurrently, as their bars would mix
+show_progress = True
+connection_pool = ConnectionPool()
+# The opener installed by set_proxy() and friends; see urlopen()
+proxy_opener = None
+# Metadata probed by url_meta(), by (url, faker), least recently used first
+url_meta_cache = collections.OrderedDict()
+url_meta_cache_size = 1024
+url_meta_lock = threading.Lock()
+probe_methods = {}
 
 fake_headers = {
     'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
@@ -128,12 +149,26 @@ def undeflate(data):
     decompressobj = zlib.decompressobj(-zlib.MAX_WBITS)
     return decompressobj.decompress(data)+decompressobj.flush()
 
+def urlopen(req):
+    """Opens a URL or a urllib.request.Request, reusing keep-alive
+    connections from connection_pool.
+
+    If an extractor has installed an opener of its own (e.g. with an
+    HTTPCookieProcessor for a login session), requests go through
+    urllib.request instead, so that its handlers still apply.
+    """
+    # urllib.request keeps the installed opener in a private global
+    opener = getattr(request, '_opener', None)
+    if opener is not None and opener is not proxy_opener:
+        return request.urlopen(req)
+    return connection_pool.urlopen(req)
+
 # DEPRECATED in favor of get_content()
 def get_response(url, faker = False):
     if faker:
-        response = request.urlopen(request.Request(url, headers = fake_headers), None)
+        response = urlopen(request.Request(url, headers = fake_headers))
     else:
-        response = request.urlopen(url)
+        response = urlopen(url)
 
     data = response.read()
     if response.info().get('Content-Encoding') == 'gzip':
@@ -174,7 +209,7 @@ def get_content(url, headers={}, decoded=True):
     if cookies_txt:
         cookies_txt.add_cookie_header(req)
         req.headers.update(req.unredirected_hdrs)
-    response = request.urlopen(req)
+    response = urlopen(req)
     data = response.read()
 
     # Handle HTTP compression for gzip and deflate (zlib)
@@ -194,28 +229,97 @@ def get_content(url, headers={}, decoded=True):
 
     return data
 
-def url_size(url, faker = False):
+class HeadRequest(request.Request):
+    # Request() only takes method from Python 3.3
+    def get_method(self):
+        return 'HEAD'
+
+def url_meta(url, faker = False):
+    """Gets the metadata of a URL, probing it only on the first call.
+
+    The URL is probed with a HEAD request. Hosts that reject HEAD, or omit
+    Content-Length from its response, are probed with a one-byte Range
+    request instead; the method that worked is remembered per host in
+    probe_methods, so later URLs on that host go straight to it.
+
+    Probed metadata is kept in url_meta_cache, so that url_size(),
+    url_info(), url_locations() and url_save() never request the same URL
+    twice just to look at its headers. It is keyed by the URL and faker,
+    as the headers sent can change the answer, and holds the
+    url_meta_cache_size most recently used URLs, so that a long batch run
+    does not keep every URL it has seen.
+
+    Returns:
+        A dict of the lower-cased response headers content-type,
+        content-disposition, content-length, transfer-encoding, etag and
+        accept-ranges (None when absent), plus 'location', the URL after
+        redirects. The headers describe the whole entity, even when it was
+        probed with a Range request.
+    """
+
+    key = url, bool(faker)
+    with url_meta_lock:
+        meta = url_meta_cache.get(key)
+        if meta is not None:
+            url_meta_cache.move_to_end(key)
+            return meta
+
     if faker:
-        response = request.urlopen(request.Request(url, headers = fake_headers), None)
+        headers = dict(fake_headers)
     else:
-        response = request.urlopen(url)
+        headers = {}
+    host = parse.urlsplit(url).netloc
 
-    size = response.headers['content-length']
+    response = None
+    if probe_methods.get(host) != 'Range':
+        try:
+            response = urlopen(HeadRequest(url, headers = headers))
+            if response.headers['content-length'] is None and response.headers['transfer-encoding'] != 'chunked':
+                response = None
+        except error.HTTPError:
+            response = None
+        if response is not None:
+            probe_methods[host] = 'HEAD'
+
+    if response is None:
+        headers['Range'] = 'bytes=0-0'
+        response = urlopen(request.Request(url, headers = headers))
+        probe_methods[host] = 'Range'
+
+    meta = {k: response.headers[k] for k in ('content-type', 'content-disposition', 'content-length', 'transfer-encoding', 'etag', 'accept-ranges')}
+    meta['location'] = response.url
+    if response.status == 206:
+        response.read()
+        meta['accept-ranges'] = 'bytes'
+        try:
+            meta['content-length'] = str(int(response.headers['content-range'].split('/')[-1]))
+        except:
+            meta['content-length'] = None
+    response.close()
+
+    with url_meta_lock:
+        url_meta_cache[key] = meta
+        while len(url_meta_cache) > url_meta_cache_size:
+            url_meta_cache.popitem(last = False)
+    return meta
+
+def forget_url_meta(url):
+    """Drops the cached metadata of a URL, to probe it again next time."""
+    with url_meta_lock:
+        for faker in (False, True):
+            url_meta_cache.pop((url, faker), None)
+
+def url_size(url, faker = False):
+    size = url_meta(url, faker)['content-length']
     return int(size) if size!=None else float('inf')
 
-# TO BE DEPRECATED
-# urls_size() does not have a faker
-# also it takes too long time
-def urls_size(urls):
-    return sum(map(url_size, urls))
+def urls_size(urls, faker = False):
+    # Probe concurrently first; the sizes are then read from url_meta_cache
+    urls_info(urls, faker)
+    return sum(url_size(url, faker) for url in urls)
 
 def url_info(url, faker = False):
-    if faker:
-        response = request.urlopen(request.Request(url, headers = fake_headers), None)
-    else:
-        response = request.urlopen(request.Request(url))
-
-    headers = response.headers
+    headers = url_meta(url, faker)
 
     type = headers['content-type']
     mapping = {
@@ -253,16 +357,16 @@ def url_info(url, faker = False):
 
     return type, ext, size
 
-def url_locations(urls, faker = False):
-    locations = []
-    for url in urls:
-        if faker:
-            response = request.urlopen(request.Request(url, headers = fake_headers), None)
-        else:
-            response = request.urlopen(request.Request(url))
+def urls_info(urls, faker = False, workers = 8):
+    """Gets the (type, ext, size) of every URL in a list, as url_info() does,
+    probing up to `workers` of them concurrently.
+    """
+
+    from .util.parallel import imap
+    return list(imap(lambda url: url_info(url, faker), urls, min(workers, len(urls))))
 
-        locations.append(response.url)
-    return locations
+def url_locations(urls, faker = False):
+    return [url_meta(url, faker)['location'] for url in urls]
 
 def url_save(url, filepath, bar, refer = None, is_part = False, faker = False):
     file_size = url_size(url, faker = faker)
@@ -299,15 +403,19 @@ def url_save(url, filepath, bar, refer = None, is_part = False, faker = False):
 
     if received < file_size:
         if faker:
-            headers = fake_headers
+            headers = dict(fake_headers)
         else:
             headers = {}
         if received:
             headers['Range'] = 'bytes=' + str(received) + '-'
+            # Only resume if the file hasn't changed since it was probed
+            etag = url_meta(url, faker)['etag']
+            if etag:
+                headers['If-Range'] = etag
         if refer:
             headers['Referer'] = refer
 
-        response = request.urlopen(request.Request(url, headers = headers), None)
+        response = urlopen(request.Request(url, headers = headers))
         try:
             range_start = int(response.headers['content-range'][6:].split('/')[0].split('-')[0])
             end_length = end = int(response.headers['content-range'][6:].split('/')[1])
@@ -316,21 +424,35 @@ def url_save(url, filepath, bar, refer = None, is_part = False, faker = False):
             content_length = response.headers['content-length']
             range_length = int(content_length) if content_length!=None else float('inf')
 
-        if file_size != received + range_length:
-            received = 0
+        if response.status != 206 and received:
+            # Range ignored, or If-Range found the file changed since it was
+            # probed: the whole file follows, maybe with a new size
+            if range_length != file_size and file_size != float('inf'):
+                forget_url_meta(url)
+                file_size = range_length
+        if response.status != 206 or file_size != received + range_length:
             if bar:
-                bar.received = 0
+                bar.update_received(-received)
+            received = 0
             open_mode = 'wb'
 
         with open(temp_filepath, open_mode) as output:
             while True:
                 buffer = response.read(1024 * 256)
                 if not buffer:
-                    if received == file_size: # Download finished
+                    if received == file_size or file_size == float('inf'): # Download finished
                         break
                     else: # Unexpected termination. Retry request
                         headers['Range'] = 'bytes=' + str(received) + '-'
-                        response = request.urlopen(request.Request(url, headers = headers), None)
+                        response = urlopen(request.Request(url, headers = headers))
+                        if response.status != 206:
+                            # Start over, as above
+                            output.seek(0)
+                            output.truncate()
+                            if bar:
+                                bar.update_received(-received)
+                            received = 0
+                        continue
                 output.write(buffer)
                 received += len(buffer)
                 if bar:
@@ -342,6 +464,157 @@ def url_save(url, filepath, bar, refer = None, is_part = False, faker = False):
         os.remove(filepath) # on Windows rename could fail if destination filepath exists
     os.rename(temp_filepath, filepath)
 
+def url_save_ranged(url, filepath, bar, refer = None, faker = False, segments = 4):
+    """Saves a single URL by fetching byte ranges of it in parallel.
+
+    The file is preallocated as filepath + '.download' and each range is
+    written at its own offset. Progress of every range is kept in a
+    '.ranges' sidecar file, so an interrupted download resumes all of its
+    ranges. Falls back to url_save() if the server does not accept ranges.
+    """
+
+    meta = url_meta(url, faker)
+    if meta['accept-ranges'] is None and meta['content-length']:
+        # Range support not advertised; ask for a single byte to find out
+        probe_headers = dict(fake_headers) if faker else {}
+        probe_headers['Range'] = 'bytes=0-0'
+        response = urlopen(request.Request(url, headers = probe_headers))
+        if response.status == 206:
+            response.read()
+            meta['accept-ranges'] = 'bytes'
+        else:
+            meta['accept-ranges'] = 'none'
+        response.close()
+    if meta['accept-ranges'] != 'bytes' or not meta['content-length']:
+        return url_save(url, filepath, bar, refer = refer, faker = faker)
+    file_size = int(meta['content-length'])
+
+    if faker:
+        headers = dict(fake_headers)
+    else:
+        headers = {}
+    if refer:
+        headers['Referer'] = refer
+    if meta['etag']:
+        headers['If-Range'] = meta['etag']
+
+    if os.path.exists(filepath):
+        if not force and file_size == os.path.getsize(filepath):
+            if bar:
+                bar.done()
+            print('Skipping %s: file already exists' % tr(os.path.basename(filepath)))
+            return
+        else:
+            if bar:
+                bar.done()
+            print('Overwriting %s' % tr(os.path.basename(filepath)), '...')
+    elif not os.path.exists(os.path.dirname(filepath)):
+        os.mkdir(os.path.dirname(filepath))
+
+    temp_filepath = filepath + '.download'
+    state_filepath = temp_filepath + '.ranges'
+
+    ranges = None
+    if not force and os.path.exists(temp_filepath) and os.path.exists(state_filepath):
+        try:
+            with open(state_filepath, 'r') as f:
+                state = json.load(f)
+            if state['size'] == file_size == os.path.getsize(temp_filepath):
+                ranges = state['ranges']
+        except:
+            ranges = None
+
+    if ranges is None:
+        segments = max(1, min(segments, file_size // (1024 * 1024)))
+        step = file_size // segments
+        # [start, end (inclusive), received]
+        ranges = [[i * step, (i + 1) * step - 1 if i < segments - 1 else file_size - 1, 0] for i in range(segments)]
+        with open(temp_filepath, 'wb') as output:
+            output.truncate(file_size)
+    elif bar:
+        bar.update_received(sum(r[2] for r in ranges))
+
+    lock = threading.Lock()
+    saved = [time.time()]
+    # Set when a range comes back whole: the file changed since it was
+    # probed (If-Range) or ranges are ignored after all
+    changed = [False]
+    # Set to make every range stop at its next read, when one has failed,
+    # changed or the caller is interrupted
+    stop = threading.Event()
+    errors = []
+    def save_state():
+        with lock:
+            saved[0] = time.time()
+            with open(state_filepath + '.tmp', 'w') as f:
+                json.dump({'size': file_size, 'ranges': ranges}, f)
+            if os.access(state_filepath, os.W_OK):
+                os.remove(state_filepath) # on Windows rename could fail if destination filepath exists
+            os.rename(state_filepath + '.tmp', state_filepath)
+
+    def fetch(r):
+        try:
+            fetch_range(r)
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+        save_state()
+
+    def fetch_range(r):
+        start, end, _ = r
+        with open(temp_filepath, 'r+b') as output:
+            while r[2] < end - start + 1 and not stop.is_set():
+                range_headers = dict(headers)
+                range_headers['Range'] = 'bytes=%s-%s' % (start + r[2], end)
+                response = urlopen(request.Request(url, headers = range_headers))
+                if response.status != 206:
+                    response.close()
+                    changed[0] = True
+                    stop.set()
+                    break
+                output.seek(start + r[2])
+                while not stop.is_set():
+                    buffer = response.read(min(1024 * 256, end - start + 1 - r[2]))
+                    if not buffer: # Unexpected termination. Retry request
+                        break
+                    output.write(buffer)
+                    with lock:
+                        r[2] += len(buffer)
+                    if bar:
+                        bar.update_received(len(buffer))
+                    if r[2] == end - start + 1:
+                        break
+                    if time.time() - saved[0] > 1:
+                        save_state()
+                response.close()
+
+    from .util.parallel import imap
+    try:
+        # Every range returns, failed or not: this waits for all of them
+        for _ in imap(fetch, [r for r in ranges if r[2] < r[1] - r[0] + 1], len(ranges)):
+            pass
+    finally:
+        stop.set()
+        save_state()
+    if errors:
+        raise errors[0]
+
+    if changed[0]:
+        # Truncate and start over from 0, probing the file again
+        if bar:
+            bar.update_received(-sum(r[2] for r in ranges))
+        os.remove(state_filepath)
+        os.remove(temp_filepath)
+        forget_url_meta(url)
+        return url_save(url, filepath, bar, refer = refer, faker = faker)
+
+    assert sum(r[1] - r[0] + 1 for r in ranges) == sum(r[2] for r in ranges) == os.path.getsize(temp_filepath)
+
+    os.remove(state_filepath)
+    if os.access(filepath, os.W_OK):
+        os.remove(filepath) # on Windows rename could fail if destination filepath exists
+    os.rename(temp_filepath, filepath)
+
 def url_save_chunked(url, filepath, bar, refer = None, is_part = False, faker = False):
     if os.path.exists(filepath):
         if not force:
@@ -374,7 +647,7 @@ def url_save_chunked(url, filepath, bar, refer = None, is_part = False, faker =
         open_mode = 'wb'
 
     if faker:
-        headers = fake_headers
+        headers = dict(fake_headers)
     else:
         headers = {}
     if received:
@@ -382,7 +655,7 @@ def url_save_chunked(url, filepath, bar, refer = None, is_part = False, faker =
     if refer:
         headers['Referer'] = refer
 
-    response = request.urlopen(request.Request(url, headers = headers), None)
+    response = urlopen(request.Request(url, headers = headers))
 
     with open(temp_filepath, open_mode) as output:
         while True:
@@ -400,6 +673,80 @@ def url_save_chunked(url, filepath, bar, refer = None, is_part = False, faker =
         os.remove(filepath) # on Windows rename could fail if destination filepath exists
     os.rename(temp_filepath, filepath)
 
+class UrlStream:
+    """A readable binary stream over the body of a URL, for consumers that
+    parse the data on the fly instead of saving it first.
+
+    read(n) returns exactly n bytes unless the body ends, re-requesting the
+    rest with a Range header if the connection drops early. Bytes read are
+    reported to bar.
+    """
+
+    def __init__(self, url, bar, refer = None, faker = False):
+        self.url = url
+        self.bar = bar
+        self.refer = refer
+        self.faker = faker
+        self.size = None
+        self.received = 0
+        self.response = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def open(self):
+        headers = dict(fake_headers) if self.faker else {}
+        if self.received:
+            headers['Range'] = 'bytes=' + str(self.received) + '-'
+        if self.refer:
+            headers['Referer'] = self.refer
+        # A dropped response would keep its connection until collected
+        self.close()
+        self.response = urlopen(request.Request(self.url, headers = headers))
+        if self.received:
+            if self.response.status != 206:
+                raise IOError('%s: connection lost and the server does not support resuming' % self.url)
+        else:
+            size = self.response.headers['content-length']
+            self.size = int(size) if size is not None else None
+
+    def read(self, n = -1):
+        if self.response is None:
+            self.open()
+        buffers = []
+        while n < 0 or n > 0:
+            buffer = self.response.read(n if n > 0 else 1024 * 256)
+            if not buffer:
+                if self.size is None or self.received >= self.size: # Download finished
+                    break
+                else: # Unexpected termination. Retry request
+                    self.open()
+                    continue
+            buffers.append(buffer)
+            self.received += len(buffer)
+            if self.bar:
+                self.bar.update_received(len(buffer))
+            if n > 0:
+                n -= len(buffer)
+        return b''.join(buffers)
+
+    def close(self):
+        if self.response is not None:
+            self.response.close()
+            self.response = None
+
+def url_stream_parts(urls, bar, refer = None, faker = False):
+    """Yields a UrlStream for each URL of a multi-part video, in order,
+    each one opened only when it is first read.
+    """
+
+    for i, url in enumerate(urls):
+        bar.update_piece(i + 1)
+        yield UrlStream(url, bar, refer = refer, faker = faker)
+
 class SimpleProgressBar:
     def __init__(self, total_size, total_pieces = 1):
         self.displayed = False
@@ -407,6 +754,7 @@ class SimpleProgressBar:
         self.total_pieces = total_pieces
         self.current_piece = 1
         self.received = 0
+        self.lock = threading.Lock()
 
     def update(self):
         self.displayed = True
@@ -428,11 +776,13 @@ class SimpleProgressBar:
         sys.stdout.flush()
 
     def update_received(self, n):
-        self.received += n
-        self.update()
+        with self.lock:
+            self.received += n
+            self.update()
 
     def update_piece(self, n):
-        self.current_piece = n
+        with self.lock:
+            self.current_piece = n
 
     def done(self):
         if self.displayed:
@@ -446,6 +796,7 @@ class PiecesProgressBar:
         self.total_pieces = total_pieces
         self.current_piece = 1
         self.received = 0
+        self.lock = threading.Lock()
 
     def update(self):
         self.displayed = True
@@ -454,11 +805,13 @@ class PiecesProgressBar:
         sys.stdout.flush()
 
     def update_received(self, n):
-        self.received += n
-        self.update()
+        with self.lock:
+            self.received += n
+            self.update()
 
     def update_piece(self, n):
-        self.current_piece = n
+        with self.lock:
+            self.current_piece = n
 
     def done(self):
         if self.displayed:
@@ -475,6 +828,98 @@ class DummyProgressBar:
     def done(self):
         pass
 
+def url_save_aio(urls, filepaths, bar, refer = None, is_part = True, chunked = False, faker = False):
+    """Saves URLs with the asyncio engine (util.aio), up to jobs at a time
+    on a single thread.
+    """
+
+    from .util import aio
+
+    headers = dict(fake_headers) if faker else {}
+    if refer:
+        headers['Referer'] = refer
+    metas = None
+    if not chunked:
+        # Probed by url_meta(), concurrently, unless they already have been
+        urls_info(urls, faker)
+        metas = []
+        for url in urls:
+            meta = url_meta(url, faker)
+            size = meta['content-length']
+            metas.append({'file_size': int(size) if size is not None else float('inf'), 'etag': meta['etag']})
+
+    if is_part:
+        bar.update_piece(0)
+    aio.download(urls, filepaths, bar, headers = headers, is_part = is_part, chunked = chunked, force = force, concurrency = jobs, get_proxy = connection_pool.get_proxy, metas = metas)
+
+def url_save_parts_iter(urls, filepaths, bar, refer = None, faker = False, chunked = False):
+    """Saves each URL of a multi-part video to its part file, with
+    url_save_chunked() if chunked is set or url_save() otherwise, and yields
+    each filepath in order as soon as it (and every part before it) is
+    saved, so that parts can be merged while later ones still download.
+
+    With jobs > 1, up to that many parts are downloaded concurrently, all
+    reporting to the same progress bar; the bar then counts finished parts
+    rather than the part being downloaded. If a part fails, no more parts
+    are started, and the error is raised once the parts in flight are
+    saved (or fail too), so that none is left half-written.
+    """
+
+    if use_asyncio:
+        url_save_aio(urls, filepaths, bar, refer = refer, chunked = chunked, faker = faker)
+        for filepath in filepaths:
+            yield filepath
+        return
+
+    save_part = url_save_chunked if chunked else url_save
+    if jobs <= 1 or len(urls) <= 1:
+        for i, (url, filepath) in enumerate(zip(urls, filepaths)):
+            #print 'Downloading %s [%s/%s]...' % (tr(filename), i + 1, len(urls))
+            bar.update_piece(i + 1)
+            save_part(url, filepath, bar, refer = refer, is_part = True, faker = faker)
+            yield filepath
+        return
+
+    from .util.parallel import imap
+
+    # Parts share a directory; create it once rather than racing in url_save()
+    output_dir = os.path.dirname(filepaths[0])
+    if not os.path.exists(output_dir):
+        os.mkdir(output_dir)
+
+    lock = threading.Lock()
+    finished = [0]
+    errors = []
+    def save(part):
+        if errors:
+            return None
+        url, filepath = part
+        try:
+            save_part(url, filepath, bar, refer = refer, is_part = True, faker = faker)
+        except Exception as e:
+            errors.append(e)
+            return None
+        with lock:
+            finished[0] += 1
+            bar.update_piece(finished[0])
+        return filepath
+
+    bar.update_piece(0)
+    for filepath in imap(save, zip(urls, filepaths), min(jobs, len(urls))):
+        if errors:
+            continue
+        yield filepath
+    if errors:
+        raise errors[0]
+
+def url_save_parts(urls, filepaths, bar, refer = None, faker = False, chunked = False):
+    """Saves each URL of a multi-part video to its part file; see
+    url_save_parts_iter().
+    """
+
+    for _ in url_save_parts_iter(urls, filepaths, bar, refer = refer, faker = faker, chunked = chunked):
+        pass
+
 def download_urls(urls, title, ext, total_size, output_dir='.', refer=None, merge=True, faker=False):
     assert urls
     if dry_run:
@@ -506,11 +951,18 @@ def download_urls(urls, title, ext, total_size, output_dir='.', refer=None, merg
         bar = SimpleProgressBar(total_size, len(urls))
     else:
         bar = PiecesProgressBar(total_size, len(urls))
+    if not show_progress:
+        bar = DummyProgressBar()
 
     if len(urls) == 1:
         url = urls[0]
         print('Downloading %s ...' % tr(filename))
-        url_save(url, filepath, bar, refer = refer, faker = faker)
+        if use_asyncio:
+            url_save_aio([url], [filepath], bar, refer = refer, is_part = False, faker = faker)
+        elif jobs > 1:
+            url_save_ranged(url, filepath, bar, refer = refer, faker = faker, segments = jobs)
+        else:
+            url_save(url, filepath, bar, refer = refer, faker = faker)
         bar.done()
     else:
         parts = []
@@ -519,9 +971,29 @@ def download_urls(urls, title, ext, total_size, output_dir='.', refer=None, merg
             filename = '%s[%02d].%s' % (title, i, ext)
             filepath = os.path.join(output_dir, filename)
             parts.append(filepath)
-            #print 'Downloading %s [%s/%s]...' % (tr(filename), i + 1, len(urls))
-            bar.update_piece(i + 1)
-            url_save(url, filepath, bar, refer = refer, is_part = True, faker = faker)
+
+        if merge and ext in ['flv', 'f4v'] and stream_merge:
+            # Parse each response as it arrives, without part files
+            from .processor.join_flv import concat_flv
+            concat_flv(url_stream_parts(urls, bar, refer = refer, faker = faker), os.path.join(output_dir, title + '.flv'))
+            bar.done()
+            print()
+            return
+
+        if merge and ext in ['flv', 'f4v']:
+            from .processor.ffmpeg import has_ffmpeg_installed
+            if not has_ffmpeg_installed():
+                # Append each part to the output as soon as it is saved. The
+                # parts are only removed once all are merged: if one fails,
+                # the next run picks up the ones already saved
+                from .processor.join_flv import concat_flv
+                saved = url_save_parts_iter(urls, parts, bar, refer = refer, faker = faker)
+                concat_flv(saved, os.path.join(output_dir, title + '.flv'), remove = True)
+                bar.done()
+                print()
+                return
+
+        url_save_parts(urls, parts, bar, refer = refer, faker = faker)
         bar.done()
 
         if not merge:
@@ -533,14 +1005,13 @@ def download_urls(urls, title, ext, total_size, output_dir='.', refer=None, merg
                 if has_ffmpeg_installed():
                     from .processor.ffmpeg import ffmpeg_concat_flv_to_mp4
                     ffmpeg_concat_flv_to_mp4(parts, os.path.join(output_dir, title + '.mp4'))
+                    for part in parts:
+                        os.remove(part)
                 else:
                     from .processor.join_flv import concat_flv
-                    concat_flv(parts, os.path.join(output_dir, title + '.flv'))
+                    concat_flv(parts, os.path.join(output_dir, title + '.flv'), remove = True)
             except:
                 raise
-            else:
-                for part in parts:
-                    os.remove(part)
 
         elif ext == 'mp4':
             try:
@@ -579,13 +1050,17 @@ def download_urls_chunked(urls, title, ext, total_size, output_dir='.', refer=No
     filename = '%s.%s' % (title, 'ts')
     filepath = os.path.join(output_dir, filename)
     if total_size:
-        if not force and os.path.exists(filepath[:-3] + '.mkv'):
-            print('Skipping %s: file already exists' % filepath[:-3] + '.mkv')
-            print()
-            return
+        # Merged into .mkv with ffmpeg, or .ts without it (or for one URL)
+        for output in (filepath[:-3] + '.mkv', filepath):
+            if not force and os.path.exists(output):
+                print('Skipping %s: file already exists' % output)
+                print()
+                return
         bar = SimpleProgressBar(total_size, len(urls))
     else:
         bar = PiecesProgressBar(total_size, len(urls))
+    if not show_progress:
+        bar = DummyProgressBar()
 
     if len(urls) == 1:
         parts = []
@@ -593,7 +1068,10 @@ def download_urls_chunked(urls, title, ext, total_size, output_dir='.', refer=No
         print('Downloading %s ...' % tr(filename))
         filepath = os.path.join(output_dir, filename)
         parts.append(filepath)
-        url_save_chunked(url, filepath, bar, refer = refer, faker = faker)
+        if use_asyncio:
+            url_save_aio([url], [filepath], bar, refer = refer, is_part = False, chunked = True, faker = faker)
+        else:
+            url_save_chunked(url, filepath, bar, refer = refer, faker = faker)
         bar.done()
 
         if not merge:
@@ -619,9 +1097,7 @@ def download_urls_chunked(urls, title, ext, total_size, output_dir='.', refer=No
             filename = '%s[%02d].%s' % (title, i, ext)
             filepath = os.path.join(output_dir, filename)
             parts.append(filepath)
-            #print 'Downloading %s [%s/%s]...' % (tr(filename), i + 1, len(urls))
-            bar.update_piece(i + 1)
-            url_save_chunked(url, filepath, bar, refer = refer, is_part = True, faker = faker)
+        url_save_parts(urls, parts, bar, refer = refer, faker = faker, chunked = True)
         bar.done()
 
         if not merge:
@@ -637,12 +1113,197 @@ def download_urls_chunked(urls, title, ext, total_size, output_dir='.', refer=No
                 else:
                     os.remove(os.path.join(output_dir, title + '.mkv'))
             else:
-                print('No ffmpeg is found. Merging aborted.')
+                from .processor.join_ts import concat_ts
+                concat_ts(parts, os.path.join(output_dir, title + '.ts'), remove = True)
         else:
             print("Can't merge %s files" % ext)
 
     print()
 
+def download_hls(url, title, output_dir='.', refer=None, faker=False, bandwidth=None, content=None, merge=True):
+    """Downloads an HLS stream into a single .ts file, or without merge
+    into a part file per segment, named as download_urls() names parts.
+
+    url is a media playlist, or a master playlist whose variant with the
+    highest bandwidth (or the highest one not above bandwidth, in bits/s)
+    is downloaded; content is the text of the playlist at url, for sites
+    that serve it encoded, and may lack the #EXTM3U header.
+
+    Up to jobs segments are fetched at a time and at most twice as many are
+    held in memory; each is appended to the .download temp file as soon as
+    every segment before it has been. AES-128 segments are decrypted by the
+    workers as they arrive, with their keys fetched once per URI.
+    """
+
+    if dry_run:
+        print('Real URLs:\n%s\n' % [url])
+        return
+
+    if player:
+        launch_player(player, [url])
+        return
+
+    from .util import aes, m3u8
+    from .util.parallel import imap
+
+    headers = dict(fake_headers) if faker else {}
+    if refer:
+        headers['Referer'] = refer
+    if content is None:
+        playlist = m3u8.parse(get_content(url, headers), url)
+    else:
+        playlist = m3u8.parse(content, url, strict = False)
+    if playlist.is_master:
+        variant = m3u8.choose_variant(playlist, bandwidth)
+        playlist = m3u8.parse(get_content(variant.uri, headers), variant.uri)
+    segments = playlist.segments
+    assert segments, 'no segment found in %s' % url
+    for segment in segments:
+        if segment.key and segment.key.get('METHOD') != 'AES-128':
+            raise NotImplementedError('HLS encryption method %s' % segment.key.get('METHOD'))
+
+    title = tr(get_filename(title))
+    filename = '%s.ts' % title
+    filepath = os.path.join(output_dir, filename)
+    if merge and not force and os.path.exists(filepath):
+        print('Skipping %s: file already exists' % tr(filepath))
+        print()
+        return
+    if not os.path.exists(output_dir):
+        os.mkdir(output_dir)
+
+    print('Downloading %s ...' % tr(filename))
+    bar = PiecesProgressBar(0, len(segments)) if show_progress else DummyProgressBar()
+    workers = min(jobs, len(segments))
+    window = threading.Semaphore(2 * workers)
+
+    def pending():
+        # Segments written release the window for the next ones
+        for segment in segments:
+            window.acquire()
+            yield segment
+
+    keys = {}
+    keys_lock = threading.Lock()
+
+    def decryptor(segment):
+        with keys_lock:
+            uri = segment.key['URI']
+            if uri not in keys:
+                keys[uri] = get_content(uri, headers, decoded=False)
+        iv = segment.key.get('IV')
+        if iv:
+            iv = bytes.fromhex(iv[2:].rjust(32, '0'))
+        else:
+            # Without an IV attribute, the IV is the media sequence number
+            iv = segment.sequence.to_bytes(16, 'big')
+        return aes.decryptor(keys[uri], iv)
+
+    def fetch(segment):
+        segment_headers = dict(headers)
+        if segment.byterange:
+            offset, length = segment.byterange
+            segment_headers['Range'] = 'bytes=%d-%d' % (offset, offset + length - 1)
+        response = urlopen(request.Request(segment.uri, headers = segment_headers))
+        if segment.byterange and response.status != 206:
+            chunks = [response.read()[offset:offset + length]]
+        else:
+            chunks = iter(lambda: response.read(1024 * 256), b'')
+        cipher = decryptor(segment) if segment.key else None
+        data = []
+        for chunk in chunks:
+            bar.update_received(len(chunk))
+            data.append(cipher.update(chunk) if cipher else chunk)
+        if cipher:
+            data.append(cipher.finalize())
+        return b''.join(data)
+
+    if not merge:
+        for i, data in enumerate(imap(fetch, pending(), workers)):
+            with open(os.path.join(output_dir, '%s[%02d].ts' % (title, i)), 'wb') as output:
+                output.write(data)
+            window.release()
+            bar.update_piece(i + 1)
+        bar.done()
+        print()
+        return
+
+    temp_filepath = filepath + '.download'
+    with open(temp_filepath, 'wb') as output:
+        for i, data in enumerate(imap(fetch, pending(), workers)):
+            output.write(data)
+            window.release()
+            bar.update_piece(i + 1)
+    bar.done()
+
+    if os.access(filepath, os.W_OK):
+        os.remove(filepath) # on Windows rename could fail if destination filepath exists
+    os.rename(temp_filepath, filepath)
+    print()
+
+def download_live_flv(url, title, output_dir='.', refer=None, faker=False, params={}):
+    """Records a live FLV stream, over HTTP or (through rtmpdump) RTMP,
+    until it ends, reconnecting whenever it drops.
+
+    url may be a function returning the URL, called before each connection,
+    for sites whose stream URLs expire. With --split-time or --split-size,
+    the recording is cut at keyframes into files named after the time each
+    one starts.
+    """
+
+    get_url = url if callable(url) else lambda: url
+    if dry_run:
+        print('Real URLs:\n%s\n' % [get_url()])
+        return
+
+    if player:
+        if get_url().startswith('rtmp'):
+            from .processor.rtmpdump import play_rtmpdump_stream
+            play_rtmpdump_stream(player, get_url(), params)
+        else:
+            launch_player(player, [get_url()])
+        return
+
+    from .processor.record_flv import record_flv
+    from .processor.rtmpdump import RtmpdumpStream, has_rtmpdump_installed
+
+    headers = dict(fake_headers) if faker else {}
+    if refer:
+        headers['Referer'] = refer
+
+    def open_stream():
+        stream_url = get_url()
+        if stream_url.startswith('rtmp'):
+            assert has_rtmpdump_installed(), "RTMPDump not installed."
+            return RtmpdumpStream(stream_url, params)
+        return urlopen(request.Request(stream_url, headers = headers))
+
+    title = tr(get_filename(title))
+    if not os.path.exists(output_dir):
+        os.mkdir(output_dir)
+    if split_time or split_size:
+        def path_for():
+            # Files are named to the second, so a cut (or reconnection) within
+            # the same second gets a numbered name
+            name = '%s %s' % (title, time.strftime('%Y%m%d-%H%M%S'))
+            path = os.path.join(output_dir, name + '.flv')
+            n = 1
+            while os.path.exists(path) or os.path.exists(path + '.download'):
+                n += 1
+                path = os.path.join(output_dir, '%s (%d).flv' % (name, n))
+            return path
+    else:
+        filepath = os.path.join(output_dir, '%s.flv' % title)
+        if not force and os.path.exists(filepath):
+            print('Skipping %s: file already exists' % tr(filepath))
+            print()
+            return
+        path_for = lambda: filepath
+
+    print('Recording %s ... (Ctrl+C to stop)' % tr(title))
+    record_flv(open_stream, path_for, split_time, split_size, live_retries)
+    print()
+
 def download_rtmp_url(url,title, ext,params={}, total_size=0, output_dir='.', refer=None, merge=True, faker=False):
     assert url
     if dry_run:
@@ -660,6 +1321,23 @@ def download_rtmp_url(url,title, ext,params={}, total_size=0, output_dir='.', re
     assert has_rtmpdump_installed(), "RTMPDump not installed."
     download_rtmpdump_stream(url,  title, ext,params, output_dir)
 
+def archived(site, vid):
+    """Returns whether video vid of site is in the --archive index, in which
+    case it is to be skipped (unless --force is given) before extracting
+    anything."""
+    if archive is None or force or dry_run or player or vid is None:
+        return False
+    if (site, vid) in archive:
+        print('Skipping %s %s: already in the archive' % (site, vid))
+        print()
+        return True
+    return False
+
+def archive_video(site, vid, title=None):
+    """Records video vid of site as downloaded in the --archive index."""
+    if archive is not None and vid is not None and not dry_run and not player:
+        archive.add(site, vid, title)
+
 def playlist_not_supported(name):
     def f(*args, **kwargs):
         raise NotImplementedError('Playlist is not supported for ' + name)
@@ -719,7 +1397,10 @@ def print_info(site_info, title, type, size):
     print("Video Site:", site_info)
     print("Title:     ", unescape_html(tr(title)))
     print("Type:      ", type_info)
-    print("Size:      ", round(size / 1048576, 2), "MiB (" + str(size) + " Bytes)")
+    if size is None:
+        print("Size:       Unknown")
+    else:
+        print("Size:      ", round(size / 1048576, 2), "MiB (" + str(size) + " Bytes)")
     print()
 
 def mime_to_container(mime):
@@ -746,29 +1427,50 @@ def parse_host(host):
     port = o.port or 0
     return (hostname, port)
 
+def set_extractor_proxy(proxy):
+    """Sends the requests of the calling thread through proxy (host, port),
+    or back through the usual proxy settings for None. Unlike set_proxy(),
+    this leaves the requests of other threads (--batch-jobs) alone."""
+    if proxy is None:
+        connection_pool.set_thread_proxies(None)
+    else:
+        connection_pool.set_thread_proxies({'http': '%s:%s' % proxy, 'https': '%s:%s' % proxy})
+
+def install_proxy_opener(proxy_handler):
+    """Installs an opener that only sets proxies, which urlopen() leaves
+    to connection_pool."""
+    global proxy_opener
+    proxy_opener = request.build_opener(proxy_handler)
+    request.install_opener(proxy_opener)
+
 def set_proxy(proxy):
     proxy_handler = request.ProxyHandler({
         'http': '%s:%s' % proxy,
         'https': '%s:%s' % proxy,
     })
-    opener = request.build_opener(proxy_handler)
-    request.install_opener(opener)
+    install_proxy_opener(proxy_handler)
+    connection_pool.set_proxies({
+        'http': '%s:%s' % proxy,
+        'https': '%s:%s' % proxy,
+    })
 
 def unset_proxy():
     proxy_handler = request.ProxyHandler({})
-    opener = request.build_opener(proxy_handler)
-    request.install_opener(opener)
+    install_proxy_opener(proxy_handler)
+    connection_pool.set_proxies({})
 
 # DEPRECATED in favor of set_proxy() and unset_proxy()
 def set_http_proxy(proxy):
     if proxy == None: # Use system default setting
         proxy_support = request.ProxyHandler()
+        connection_pool.set_proxies(None)
     elif proxy == '': # Don't use any proxy
         proxy_support = request.ProxyHandler({})
+        connection_pool.set_proxies({})
     else: # Use proxy
         proxy_support = request.ProxyHandler({'http': '%s' % proxy, 'https': '%s' % proxy})
-    opener = request.build_opener(proxy_support)
-    request.install_opener(opener)
+        connection_pool.set_proxies({'http': '%s' % proxy, 'https': '%s' % proxy})
+    install_proxy_opener(proxy_support)
 
 
 
@@ -784,6 +1486,58 @@ def download_main(download, download_playlist, urls, playlist, **kwargs):
         else:
             download(url, **kwargs)
 
+def read_urls(file):
+    """Yields the URLs listed in a file, one per line, skipping blank lines
+    and # comments. Lines are read lazily, so file may be a pipe.
+    """
+
+    for line in file:
+        line = line.strip()
+        if line and not line.startswith('#'):
+            yield line
+
+def download_batch(download, download_playlist, urls, playlist, log_file, workers = 4, **kwargs):
+    """Downloads URLs from an iterable, up to `workers` at a time.
+
+    Every URL gets a JSON record written to log_file as soon as it is done:
+    {"url": ..., "status": "ok" | "error", "error": ..., "elapsed": ...}.
+    A failing URL (including one whose extractor calls sys.exit()) does not
+    stop the others. Returns the number of failed URLs.
+
+    Extractors keep no state between calls, and --extractor-proxy applies
+    to each thread separately, so concurrent downloads don't interfere;
+    progress bars are off unless there is a single worker.
+    """
+
+    global show_progress
+    from .util.parallel import imap
+
+    lock = threading.Lock()
+    failed = [0]
+    def run(url):
+        started = time.time()
+        try:
+            download_main(download, download_playlist, [url], playlist, **kwargs)
+        except (Exception, SystemExit) as e:
+            record = {'url': url, 'status': 'error', 'error': '%s: %s' % (type(e).__name__, e)}
+        else:
+            record = {'url': url, 'status': 'ok', 'error': None}
+        record['elapsed'] = round(time.time() - started, 3)
+        with lock:
+            if record['status'] != 'ok':
+                failed[0] += 1
+            log_file.write(json.dumps(record) + '\n')
+            log_file.flush()
+
+    progress = show_progress
+    show_progress = progress and workers == 1
+    try:
+        for _ in imap(run, urls, workers):
+            pass
+    finally:
+        show_progress = progress
+    return failed[0]
+
 def script_main(script_name, download, download_playlist = None):
     version = 'You-Get %s, a video downloader.' % __version__
     help = 'Usage: %s [OPTION]... [URL]...\n' % script_name
@@ -802,12 +1556,30 @@ def script_main(script_name, download, download_playlist = None):
     -p | --player <PLAYER [options]>         Directly play the video with PLAYER like vlc/smplayer.
     -x | --http-proxy <HOST:PORT>            Use specific HTTP proxy for downloading.
     -y | --extractor-proxy <HOST:PORT>       Use specific HTTP proxy for extracting stream data.
+    -j | --jobs <N>                          Download up to N video parts (byte ranges of a
+                                             single-part video, HLS segments) concurrently.
+         --asyncio                           Download with the asyncio engine: all transfers
+                                             (up to --jobs) run on a single thread.
+                                             Needs Python 3.5 or later.
+         --stream-merge                      Merge FLV parts straight from the network into the
+                                             output, without saving part files.
+         --split-time <MINUTES>              Cut live recordings into files of about MINUTES.
+         --split-size <MiB>                  Cut live recordings into files of about MiB.
+         --live-retries <N>                  Stop a live recording after N failed reconnections
+                                             in a row (default: 5; inf: never stop).
+    -I | --input-file <FILE>                 Download the URLs listed in FILE (- for stdin),
+                                             one per line.
+         --batch-jobs <N>                    Download up to N URLs of --input-file concurrently.
+         --batch-log <FILE>                  Write a JSON line per URL of --input-file to FILE
+                                             (default: stderr).
+         --archive <FILE>                    Record downloaded videos in FILE (an SQLite database),
+                                             and skip the ones already recorded there.
          --no-proxy                          Don't use any proxy. (ignore $http_proxy)
          --debug                             Show traceback on KeyboardInterrupt.
     '''
 
-    short_opts = 'Vhfiuc:nF:o:p:x:y:'
-    opts = ['version', 'help', 'force', 'info', 'url', 'cookies', 'no-merge', 'no-proxy', 'debug', 'format=', 'stream=', 'itag=', 'output-dir=', 'player=', 'http-proxy=', 'extractor-proxy=', 'lang=']
+    short_opts = 'Vhfiuc:nF:o:p:x:y:j:I:'
+    opts = ['version', 'help', 'force', 'info', 'url', 'cookies', 'no-merge', 'no-proxy', 'debug', 'asyncio', 'stream-merge', 'split-time=', 'split-size=', 'live-retries=', 'format=', 'stream=', 'itag=', 'output-dir=', 'player=', 'http-proxy=', 'extractor-proxy=', 'jobs=', 'input-file=', 'batch-jobs=', 'batch-log=', 'archive=', 'lang=']
     if download_playlist:
         short_opts = 'l' + short_opts
         opts = ['playlist'] + opts
@@ -824,6 +1596,13 @@ def script_main(script_name, download, download_playlist = None):
     global player
     global extractor_proxy
     global cookies_txt
+    global jobs
+    global use_asyncio
+    global stream_merge
+    global split_time
+    global split_size
+    global live_retries
+    global archive
     cookies_txt = None
 
     info_only = False
@@ -835,6 +1614,9 @@ def script_main(script_name, download, download_playlist = None):
     proxy = None
     extractor_proxy = None
     traceback = False
+    input_file = None
+    batch_jobs = 4
+    batch_log = None
     for o, a in opts:
         if o in ('-V', '--version'):
             print(version)
@@ -871,36 +1653,166 @@ def script_main(script_name, download, download_playlist = None):
             proxy = a
         elif o in ('-y', '--extractor-proxy'):
             extractor_proxy = a
+        elif o in ('-j', '--jobs'):
+            try:
+                jobs = int(a)
+                assert jobs > 0
+            except:
+                log.e('[Error] Invalid number of jobs: %s' % a)
+                sys.exit(2)
+        elif o in ('--asyncio',):
+            if sys.version_info < (3, 5):
+                log.w('--asyncio needs Python 3.5 or later; ignored')
+            else:
+                use_asyncio = True
+        elif o in ('--stream-merge',):
+            stream_merge = True
+        elif o in ('--split-time',):
+            try:
+                split_time = float(a) * 60
+                assert split_time > 0
+            except:
+                log.e('[Error] Invalid split time: %s' % a)
+                sys.exit(2)
+        elif o in ('--split-size',):
+            try:
+                split_size = int(float(a) * 1048576)
+                assert split_size > 0
+            except:
+                log.e('[Error] Invalid split size: %s' % a)
+                sys.exit(2)
+        elif o in ('--live-retries',):
+            try:
+                live_retries = float(a)
+                assert live_retries >= 0
+            except:
+                log.e('[Error] Invalid number of retries: %s' % a)
+                sys.exit(2)
+        elif o in ('-I', '--input-file'):
+            input_file = a
+        elif o in ('--batch-jobs',):
+            try:
+                batch_jobs = int(a)
+                assert batch_jobs > 0
+            except:
+                log.e('[Error] Invalid number of batch jobs: %s' % a)
+                sys.exit(2)
+        elif o in ('--batch-log',):
+            batch_log = a
+        elif o in ('--archive',):
+            from .util.archive import Archive
+            archive = Archive(a)
         elif o in ('--lang',):
             lang = a
         else:
             log.e("try 'you-get --help' for more options")
             sys.exit(2)
-    if not args:
+    if not args and not input_file:
         print(help)
         sys.exit()
 
     set_http_proxy(proxy)
 
-    try:
-        if stream_id:
-            if not extractor_proxy:
-                download_main(download, download_playlist, args, playlist, stream_id=stream_id, output_dir=output_dir, merge=merge, info_only=info_only)
-            else:
-                download_main(download, download_playlist, args, playlist, stream_id=stream_id, extractor_proxy=extractor_proxy, output_dir=output_dir, merge=merge, info_only=info_only)
-        else:
-            if not extractor_proxy:
-                download_main(download, download_playlist, args, playlist, output_dir=output_dir, merge=merge, info_only=info_only)
+    kwargs = {'output_dir': output_dir, 'merge': merge, 'info_only': info_only}
+    if stream_id:
+        kwargs['stream_id'] = stream_id
+    if extractor_proxy:
+        kwargs['extractor_proxy'] = extractor_proxy
+
+    if input_file:
+        import itertools
+        file = sys.stdin if input_file == '-' else open(input_file, encoding = 'utf-8')
+        log_file = open(batch_log, 'a', encoding = 'utf-8') if batch_log else sys.stderr
+        try:
+            failed = download_batch(download, download_playlist, itertools.chain(args, read_urls(file)), playlist, log_file, workers = batch_jobs, **kwargs)
+        except KeyboardInterrupt:
+            if traceback:
+                raise
             else:
-                download_main(download, download_playlist, args, playlist, extractor_proxy=extractor_proxy, output_dir=output_dir, merge=merge, info_only=info_only)
+                sys.exit(1)
+        finally:
+            if file is not sys.stdin:
+                file.close()
+            if log_file is not sys.stderr:
+                log_file.close()
+        sys.exit(1 if failed else 0)
+
+    try:
+        download_main(download, download_playlist, args, playlist, **kwargs)
     except KeyboardInterrupt:
         if traceback:
             raise
         else:
             sys.exit(1)
 
+# Maps the second-level domain of a URL to the extractor module for the site
+sites = {
+    '163': 'netease',
+    '56': 'w56',
+    'acfun': 'acfun',
+    'baidu': 'baidu',
+    'baomihua': 'baomihua',
+    'bilibili': 'bilibili',
+    'blip': 'blip',
+    'catfun': 'catfun',
+    'cntv': 'cntv',
+    'cbs': 'cbs',
+    'coursera': 'coursera',
+    'dailymotion': 'dailymotion',
+    'dongting': 'dongting',
+    'douban': 'douban',
+    'douyutv': 'douyutv',
+    'ehow': 'ehow',
+    'facebook': 'facebook',
+    'freesound': 'freesound',
+    'google': 'google',
+    'iask': 'sina',
+    'ifeng': 'ifeng',
+    'in': 'alive',
+    'instagram': 'instagram',
+    'iqiyi': 'iqiyi',
+    'joy': 'joy',
+    'jpopsuki': 'jpopsuki',
+    'kankanews': 'bilibili',
+    'khanacademy': 'khan',
+    'ku6': 'ku6',
+    'kugou': 'kugou',
+    'kuwo': 'kuwo',
+    'letv': 'letv',
+    'magisto': 'magisto',
+    'miomio': 'miomio',
+    'mixcloud': 'mixcloud',
+    'mtv81': 'mtv81',
+    'nicovideo': 'nicovideo',
+    'pptv': 'pptv',
+    'qq': 'qq',
+    'sina': 'sina',
+    'smgbb': 'bilibili',
+    'sohu': 'sohu',
+    'songtaste': 'songtaste',
+    'soundcloud': 'soundcloud',
+    'ted': 'ted',
+    'theplatform': 'theplatform',
+    'tucao': 'tucao',
+    'tudou': 'tudou',
+    'tumblr': 'tumblr',
+    'vid48': 'vid48',
+    'videobam': 'videobam',
+    'vimeo': 'vimeo',
+    'vine': 'vine',
+    'vk': 'vk',
+    'xiami': 'xiami',
+    'yinyuetai': 'yinyuetai',
+    'youku': 'youku',
+    'youtu': 'youtube',
+    'youtube': 'youtube',
+    'zhanqi': 'zhanqi',
+}
+
 def url_to_module(url):
-    from .extractors import netease, w56, acfun, baidu, baomihua, bilibili, blip, catfun, cntv, cbs, coursera, dailymotion, dongting, douban, douyutv, ehow, facebook, freesound, google, sina, ifeng, alive, instagram, iqiyi, joy, jpopsuki, khan, ku6, kugou, kuwo, letv, magisto, miomio, mixcloud, mtv81, nicovideo, pptv, qq, sohu, songtaste, soundcloud, ted, theplatform, tudou, tucao, tumblr, vid48, videobam, vimeo, vine, vk, xiami, yinyuetai, youku, youtube, zhanqi
+    """Returns the extractor module for a URL (importing only that one) and
+    the URL to pass to it, following redirects for unknown domains.
+    """
 
     video_host = r1(r'https?://([^/]+)/', url)
     video_url = r1(r'https?://[^/]+(.*)', url)
@@ -912,70 +1824,9 @@ def url_to_module(url):
     assert domain, 'unsupported url: ' + url
 
     k = r1(r'([^.]+)', domain)
-    downloads = {
-        '163': netease,
-        '56': w56,
-        'acfun': acfun,
-        'baidu': baidu,
-        'baomihua': baomihua,
-        'bilibili': bilibili,
-        'blip': blip,
-        'catfun': catfun,
-        'cntv': cntv,
-        'cbs': cbs,
-        'coursera': coursera,
-        'dailymotion': dailymotion,
-        'dongting': dongting,
-        'douban': douban,
-        'douyutv': douyutv,
-        'ehow': ehow,
-        'facebook': facebook,
-        'freesound': freesound,
-        'google': google,
-        'iask': sina,
-        'ifeng': ifeng,
-        'in': alive,
-        'instagram': instagram,
-        'iqiyi': iqiyi,
-        'joy': joy,
-        'jpopsuki': jpopsuki,
-        'kankanews': bilibili,
-        'khanacademy': khan,
-        'ku6': ku6,
-        'kugou': kugou,
-        'kuwo': kuwo,
-        'letv': letv,
-        'magisto': magisto,
-        'miomio': miomio,
-        'mixcloud': mixcloud,
-        'mtv81': mtv81,
-        'nicovideo': nicovideo,
-        'pptv': pptv,
-        'qq': qq,
-        'sina': sina,
-        'smgbb': bilibili,
-        'sohu': sohu,
-        'songtaste': songtaste,
-        'soundcloud': soundcloud,
-        'ted': ted,
-        'theplatform': theplatform,
-        "tucao":tucao,
-        'tudou': tudou,
-        'tumblr': tumblr,
-        'vid48': vid48,
-        'videobam': videobam,
-        'vimeo': vimeo,
-        'vine': vine,
-        'vk': vk,
-        'xiami': xiami,
-        'yinyuetai': yinyuetai,
-        'youku': youku,
-        'youtu': youtube,
-        'youtube': youtube,
-        'zhanqi': zhanqi,
-    }
-    if k in downloads:
-        return downloads[k], url
+    if k in sites:
+        import importlib
+        return importlib.import_module('.extractors.' + sites[k], __package__), url
     else:
         import http.client
         conn = http.client.HTTPConnection(video_host)
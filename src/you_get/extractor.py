@@ -1,6 +1,6 @@
 #!/usr/bin/env python
 
-from .common import match1, download_urls, parse_host, set_proxy, unset_proxy
+from .common import match1, download_urls, parse_host, set_extractor_proxy, archived, archive_video
 from .util import log
 
 class Extractor():
@@ -14,6 +14,8 @@ class Extractor():
         if args:
             self.url = args[0]
 
+# An instance keeps the state of one download, so site modules create one
+# per call rather than sharing one: --batch-jobs runs downloads concurrently
 class VideoExtractor():
     def __init__(self, *args):
         self.url = None
@@ -27,14 +29,28 @@ class VideoExtractor():
         if args:
             self.url = args[0]
 
+    def site(self):
+        # The extractor module, as the function-based extractors use
+        return self.__class__.__module__.rsplit('.', 1)[-1]
+
     def download_by_url(self, url, **kwargs):
         self.url = url
 
+        vid = self.vid
+        if vid is None and hasattr(self.__class__, 'get_vid_from_url'):
+            vid = self.__class__.get_vid_from_url(url)
+        if not kwargs.get('info_only') and archived(self.site(), vid):
+            self.__init__()
+            return
+
         if 'extractor_proxy' in kwargs and kwargs['extractor_proxy']:
-            set_proxy(parse_host(kwargs['extractor_proxy']))
-        self.prepare(**kwargs)
-        if 'extractor_proxy' in kwargs and kwargs['extractor_proxy']:
-            unset_proxy()
+            set_extractor_proxy(parse_host(kwargs['extractor_proxy']))
+            try:
+                self.prepare(**kwargs)
+            finally:
+                set_extractor_proxy(None)
+        else:
+            self.prepare(**kwargs)
 
         try:
             self.streams_sorted = [dict([('id', stream_type['id'])] + list(self.streams[stream_type['id']].items())) for stream_type in self.__class__.stream_types if stream_type['id'] in self.streams]
@@ -48,11 +64,18 @@ class VideoExtractor():
     def download_by_vid(self, vid, **kwargs):
         self.vid = vid
 
+        if not kwargs.get('info_only') and archived(self.site(), vid):
+            self.__init__()
+            return
+
         if 'extractor_proxy' in kwargs and kwargs['extractor_proxy']:
-            set_proxy(parse_host(kwargs['extractor_proxy']))
-        self.prepare(**kwargs)
-        if 'extractor_proxy' in kwargs and kwargs['extractor_proxy']:
-            unset_proxy()
+            set_extractor_proxy(parse_host(kwargs['extractor_proxy']))
+            try:
+                self.prepare(**kwargs)
+            finally:
+                set_extractor_proxy(None)
+        else:
+            self.prepare(**kwargs)
 
         try:
             self.streams_sorted = [dict([('id', stream_type['id'])] + list(self.streams[stream_type['id']].items())) for stream_type in self.__class__.stream_types if stream_type['id'] in self.streams]
@@ -170,6 +193,7 @@ class VideoExtractor():
                 log.wtf('[Failed] Cannot extract video source.')
             # For legacy main()
             download_urls(urls, self.title, self.streams[stream_id]['container'], self.streams[stream_id]['size'], output_dir=kwargs['output_dir'], merge=kwargs['merge'])
+            archive_video(self.site(), self.vid, self.title)
             # For main_dev()
             #download_urls(urls, self.title, self.streams[stream_id]['container'], self.streams[stream_id]['size'])
 
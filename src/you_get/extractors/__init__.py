@@ -1,55 +1,162 @@
 #!/usr/bin/env python
 
-from .acfun import *
-from .alive import *
-from .baidu import *
-from .bilibili import *
-from .blip import *
-from .catfun import *
-from .cbs import *
-from .cntv import *
-from .coursera import *
-from .dailymotion import *
-from .douban import *
-from .douyutv import *
-from .ehow import *
-from .facebook import *
-from .freesound import *
-from .google import *
-from .ifeng import *
-from .instagram import *
-from .iqiyi import *
-from .joy import *
-from .jpopsuki import *
-from .ku6 import *
-from .kugou import *
-from .kuwo import *
-from .letv import *
-from .magisto import *
-from .miomio import *
-from .mixcloud import *
-from .mtv81 import *
-from .netease import *
-from .nicovideo import *
-from .pptv import *
-from .qq import *
-from .sina import *
-from .sohu import *
-from .songtaste import *
-from .soundcloud import *
-from .theplatform import *
-from .tucao import *
-from .tudou import *
-from .tumblr import *
-from .vid48 import *
-from .videobam import *
-from .vimeo import *
-from .vine import *
-from .vk import *
-from .w56 import *
-from .xiami import *
-from .yinyuetai import *
-from .youku import *
-from .youtube import *
-from .ted import *
-from .khan import *
+import sys
+
+# Extractor modules are imported on first use (PEP 562), so that loading one
+# site doesn't pay for all the others.
+modules = [
+    'acfun', 'alive', 'baidu', 'baomihua', 'bilibili', 'blip', 'catfun', 'cbs',
+    'cntv', 'coursera', 'dailymotion', 'dongting', 'douban', 'douyutv', 'ehow',
+    'facebook', 'freesound', 'google', 'ifeng', 'instagram', 'iqiyi', 'joy',
+    'jpopsuki', 'khan', 'ku6', 'kugou', 'kuwo', 'letv', 'magisto', 'miomio',
+    'mixcloud', 'mtv81', 'netease', 'nicovideo', 'pptv', 'qq', 'sina', 'sohu',
+    'songtaste', 'soundcloud', 'ted', 'theplatform', 'tucao', 'tudou',
+    'tumblr', 'vid48', 'videobam', 'vimeo', 'vine', 'vk', 'w56', 'xiami',
+    'yinyuetai', 'youku', 'youtube', 'zhanqi',
+]
+
+# Names the extractor modules export, and the module each comes from
+exports = {
+    'acfun_download': 'acfun',
+    'alive_download': 'alive',
+    'baidu_download': 'baidu',
+    'baomihua_download': 'baomihua', 'baomihua_download_by_id': 'baomihua',
+    'bilibili_download': 'bilibili', 'get_srt_xml': 'bilibili',
+    'parse_cid_playurl': 'bilibili',
+    'blip_download': 'blip',
+    'catfun_download': 'catfun',
+    'cbs_download': 'cbs',
+    'cntv_download': 'cntv', 'cntv_download_by_id': 'cntv',
+    'coursera_download': 'coursera',
+    'dailymotion_download': 'dailymotion',
+    'dongting_download': 'dongting',
+    'douban_download': 'douban',
+    'douyutv_download': 'douyutv',
+    'ehow_download': 'ehow',
+    'facebook_download': 'facebook',
+    'freesound_download': 'freesound',
+    'google_download': 'google',
+    'ifeng_download': 'ifeng', 'ifeng_download_by_id': 'ifeng',
+    'instagram_download': 'instagram',
+    'iqiyi_download': 'iqiyi',
+    'joy_download': 'joy',
+    'jpopsuki_download': 'jpopsuki',
+    'khan_download': 'khan',
+    'ku6_download': 'ku6', 'ku6_download_by_id': 'ku6',
+    'kugou_download': 'kugou',
+    'kuwo_download': 'kuwo',
+    'letv_download': 'letv', 'letvcloud_download': 'letv',
+    'letvcloud_download_by_vu': 'letv',
+    'magisto_download': 'magisto',
+    'miomio_download': 'miomio',
+    'mixcloud_download': 'mixcloud',
+    'mtv81_download': 'mtv81',
+    'netease_download': 'netease',
+    'nicovideo_download': 'nicovideo',
+    'pptv_download': 'pptv', 'pptv_download_by_id': 'pptv',
+    'qq_download': 'qq',
+    'sina_download': 'sina', 'sina_download_by_vid': 'sina',
+    'sina_download_by_vkey': 'sina',
+    'sohu_download': 'sohu',
+    'songtaste_download': 'songtaste',
+    'soundcloud_download': 'soundcloud',
+    'soundcloud_download_by_id': 'soundcloud',
+    'ted_download': 'ted',
+    'theplatform_download_by_pid': 'theplatform',
+    'tucao_download': 'tucao',
+    'tudou_download': 'tudou', 'tudou_download_playlist': 'tudou',
+    'tudou_download_by_id': 'tudou', 'tudou_download_by_iid': 'tudou',
+    'tumblr_download': 'tumblr',
+    'vid48_download': 'vid48',
+    'videobam_download': 'videobam',
+    'vimeo_download': 'vimeo', 'vimeo_download_by_id': 'vimeo',
+    'vine_download': 'vine',
+    'vk_download': 'vk',
+    'w56_download': 'w56', 'w56_download_by_id': 'w56',
+    'xiami_download': 'xiami',
+    'yinyuetai_download': 'yinyuetai', 'yinyuetai_download_by_id': 'yinyuetai',
+    'Youku': 'youku', 'youku_download_by_vid': 'youku',
+    'YouTube': 'youtube', 'download': 'youtube',
+    'download_playlist': 'youtube',
+    'zhanqi_download': 'zhanqi',
+}
+
+__all__ = modules + sorted(exports)
+
+if sys.version_info >= (3, 7):
+    import importlib
+
+    def __getattr__(name):
+        if name in modules:
+            return importlib.import_module('.' + name, __name__)
+        if name in exports:
+            return getattr(importlib.import_module('.' + exports[name], __name__), name)
+        # youtube, youku and theplatform used to re-export you_get.common
+        # through their star imports
+        common = importlib.import_module('..common', __name__)
+        if not name.startswith('_') and hasattr(common, name):
+            return getattr(common, name)
+        raise AttributeError('module %r has no attribute %r' % (__name__, name))
+
+    def __dir__():
+        return sorted(set(globals()) | set(__all__))
+
+else:
+    del __all__
+    from .acfun import *
+    from .alive import *
+    from .baidu import *
+    from .baomihua import *
+    from .bilibili import *
+    from .bilibili import get_srt_xml, parse_cid_playurl
+    from .blip import *
+    from .catfun import *
+    from .cbs import *
+    from .cntv import *
+    from .coursera import *
+    from .dailymotion import *
+    from .dongting import *
+    from .douban import *
+    from .douyutv import *
+    from .ehow import *
+    from .facebook import *
+    from .freesound import *
+    from .google import *
+    from .ifeng import *
+    from .instagram import *
+    from .iqiyi import *
+    from .joy import *
+    from .jpopsuki import *
+    from .ku6 import *
+    from .kugou import *
+    from .kuwo import *
+    from .letv import *
+    from .magisto import *
+    from .miomio import *
+    from .mixcloud import *
+    from .mtv81 import *
+    from .netease import *
+    from .nicovideo import *
+    from .pptv import *
+    from .qq import *
+    from .sina import *
+    from .sohu import *
+    from .songtaste import *
+    from .soundcloud import *
+    from .theplatform import *
+    from .tucao import *
+    from .tudou import *
+    from .tumblr import *
+    from .vid48 import *
+    from .videobam import *
+    from .vimeo import *
+    from .vine import *
+    from .vk import *
+    from .w56 import *
+    from .xiami import *
+    from .yinyuetai import *
+    from .youku import *
+    from .youtube import *
+    from .ted import *
+    from .khan import *
+    from .zhanqi import *
@@ -90,10 +90,7 @@ def acfun_download_by_vid(vid, title=None, output_dir='.', merge=True, info_only
     for i in info["result"][stream_id]["files"]:
         urls[i["no"]] = i["url"]
     ext = info["result"][stream_id]["files"][0]["type"]
-    size = 0
-    for i in urls:
-        _, _, tmp =url_info(i)
-        size +=tmp
+    size = sum(tmp for _, _, tmp in urls_info(urls))
     print_info(site_info, title, ext, size)
     print("Format:    ",stream_id)
     print()
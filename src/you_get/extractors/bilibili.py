@@ -88,10 +88,7 @@ def bilibili_download_by_cids(cids, title, output_dir='.', merge=True, info_only
     else:
         type = 'flv'
 
-    size = 0
-    for url in urls:
-        _, _, temp = url_info(url)
-        size += temp
+    size = sum(temp for _, _, temp in urls_info(urls))
 
     print_info(site_info, title, type, size)
     if not info_only:
@@ -114,10 +111,7 @@ def bilibili_download_by_cid(id, title, output_dir='.', merge=True, info_only=Fa
     else:
         type = 'flv'
 
-    size = 0
-    for url in urls:
-        _, _, temp = url_info(url)
-        size += temp or 0
+    size = sum(temp or 0 for _, _, temp in urls_info(urls))
 
     print_info(site_info, title, type, size)
     if not info_only:
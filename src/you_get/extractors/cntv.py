@@ -18,10 +18,7 @@ def cntv_download_by_id(id, title = None, output_dir = '.', merge = True, info_o
     urls = [x['url'] for x in chapters]
     ext = r1(r'\.([^.]+)$', urls[0])
     assert ext in ('flv', 'mp4')
-    size = 0
-    for url in urls:
-        _, _, temp = url_info(url)
-        size += temp
+    size = sum(temp for _, _, temp in urls_info(urls))
     
     print_info(site_info, title, ext, size)
     if not info_only:
@@ -8,15 +8,20 @@ import json
 def douyutv_download(url, output_dir = '.', merge = True, info_only = False):
     room_id = url[url.rfind('/')+1:]
 
-    content = get_html("http://www.douyutv.com/api/client/room/"+room_id)
-    data = json.loads(content)['data']
+    def room_info():
+        content = get_html("http://www.douyutv.com/api/client/room/"+room_id)
+        data = json.loads(content)['data']
+        # ValueError is what record_flv() takes for a failed reconnection
+        if not isinstance(data, dict) or not data.get('rtmp_url') or not data.get('rtmp_live'):
+            raise ValueError('room %s is offline' % room_id)
+        return data.get('room_name'), data.get('rtmp_url')+'/'+data.get('rtmp_live')
 
-    title = data.get('room_name')
-    real_url = data.get('rtmp_url')+'/'+data.get('rtmp_live')
+    title, real_url = room_info()
 
-    print_info(site_info, title, 'flv', float('inf'))
+    print_info(site_info, title, 'flv', None)
     if not info_only:
-        download_urls([real_url], title, 'flv', None, output_dir, merge = merge)
+        # The stream URL carries a key that expires; get a new one on reconnection
+        download_live_flv(lambda: room_info()[1], title, output_dir)
 
 site_info = "douyutv.com"
 download = douyutv_download
@@ -17,10 +17,7 @@ def ku6_download_by_id(id, title = None, output_dir = '.', merge = True, info_on
     ext = re.sub(r'.*\.', '', urls[0])
     assert ext in ('flv', 'mp4', 'f4v'), ext
     ext = {'f4v': 'flv'}.get(ext, ext)
-    size = 0
-    for url in urls:
-        _, _, temp = url_info(url)
-        size += temp
+    size = sum(temp for _, _, temp in urls_info(urls))
     
     print_info(site_info, title, ext, size)
     if not info_only:
@@ -8,6 +8,7 @@ import xml.etree.ElementTree as ET
 import base64, hashlib, urllib, time, re
 
 from ..common import *
+from ..util import m3u8
 
 #@DEPRECATED 
 def get_timestamp():
@@ -73,7 +74,6 @@ def video_info(vid,**kwargs):
             stream_id =sorted(support_stream_id,key= lambda i: int(i[1:]))[-1]
 
     url =info["playurl"]["domain"][0]+info["playurl"]["dispatch"][stream_id][0]
-    ext = info["playurl"]["dispatch"][stream_id][1].split('.')[-1]
     url+="&ctv=pc&m3v=1&termid=1&format=1&hwtype=un&ostype=Linux&tag=letv&sign=letv&expect=3&tn={}&pay=0&iscpn=f9051&rateid={}".format(random.random(),stream_id)
 
     r2=get_content(url,decoded=False)
@@ -81,21 +81,22 @@ def video_info(vid,**kwargs):
 
     # hold on ! more things to do
     # to decode m3u8 (encoded)
-    m3u8 = get_content(info2["location"],decoded=False)
-    m3u8_list = decode(m3u8)
-    urls = re.findall(r'^[^#][^\r]*',m3u8_list,re.MULTILINE)
-    return ext,urls
+    m3u8_url = info2["location"]
+    m3u8_list = decode(get_content(m3u8_url,decoded=False))
+    if isinstance(m3u8_list, bytes):
+        m3u8_list = m3u8_list.decode('utf-8')
+    return m3u8_url,m3u8_list
 
 def letv_download_by_vid(vid,title, output_dir='.', merge=True, info_only=False,**kwargs):
-    ext , urls = video_info(vid,**kwargs)
-    size = 0
-    for i in urls:
-        _, _, tmp = url_info(i)
-        size += tmp
+    m3u8_url, m3u8_list = video_info(vid,**kwargs)
+    size = None
+    if info_only:
+        urls = [segment.uri for segment in m3u8.parse(m3u8_list, m3u8_url, strict = False).segments]
+        size = sum(tmp for _, _, tmp in urls_info(urls))
 
-    print_info(site_info, title, ext, size)
+    print_info(site_info, title, 'ts', size)
     if not info_only:
-        download_urls(urls, title, ext, size, output_dir=output_dir, merge=merge)
+        download_hls(m3u8_url, title, output_dir=output_dir, merge=merge, content=m3u8_list)
 
 def letvcloud_download_by_vu(vu, title=None, output_dir='.', merge=True, info_only=False):
     str2Hash = 'cfflashformatjsonran0.7214574650861323uu2d8c027396ver2.1vu' + vu + 'bie^#@(%27eib58'
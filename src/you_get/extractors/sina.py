@@ -37,10 +37,7 @@ def sina_download_by_xml(xml, title, output_dir, merge, info_only):
     urls, name, vstr = video_info(xml)
     title = title or name
     assert title
-    size = 0
-    for url in urls:
-        _, _, temp = url_info(url)
-        size += temp
+    size = sum(temp for _, _, temp in urls_info(urls))
 
     print_info(site_info, title, 'flv', size)
     if not info_only:
@@ -21,7 +21,7 @@ def sohu_download(url, output_dir = '.', merge = True, info_only = False, extrac
 
     if re.match(r'http://tv.sohu.com/', url):
         if extractor_proxy:
-            set_proxy(tuple(extractor_proxy.split(":")))
+            set_extractor_proxy(tuple(extractor_proxy.split(":")))
         data = json.loads(get_decoded_html('http://hot.vrs.sohu.com/vrs_flash.action?vid=%s' % vid))
         for qtyp in ["oriVid","superVid","highVid" ,"norVid","relativeId"]:
             hqvid = data['data'][qtyp]
@@ -29,7 +29,7 @@ def sohu_download(url, output_dir = '.', merge = True, info_only = False, extrac
                 data = json.loads(get_decoded_html('http://hot.vrs.sohu.com/vrs_flash.action?vid=%s' % hqvid))
                 break
         if extractor_proxy:
-            unset_proxy()
+            set_extractor_proxy(None)
         host = data['allot']
         prot = data['prot']
         urls = []
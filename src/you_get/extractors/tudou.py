@@ -6,6 +6,8 @@ from ..common import *
 from xml.dom.minidom import parseString
 
 def tudou_download_by_iid(iid, title, output_dir = '.', merge = True, info_only = False):
+    if not info_only and archived('tudou', iid):
+        return
     data = json.loads(get_decoded_html('http://www.tudou.com/outplay/goto/getItemSegs.action?iid=%s' % iid))
     temp = max([data[i] for i in data if 'size' in data[i][0]], key=lambda x:x[0]["size"])
     vids, size = [t["k"] for t in temp], sum([t["size"] for t in temp])
@@ -21,6 +23,7 @@ def tudou_download_by_iid(iid, title, output_dir = '.', merge = True, info_only
     print_info(site_info, title, ext, size)
     if not info_only:
         download_urls(urls, title, ext, size, output_dir=output_dir, merge = merge)
+        archive_video('tudou', iid, title)
 
 def tudou_download_by_id(id, title, output_dir = '.', merge = True, info_only = False):
     html = get_html('http://www.tudou.com/programs/view/%s/' % id)
@@ -43,7 +43,15 @@ def xiami_download_pic(pic_url, file_name, output_dir):
         with open(output_dir + "/" + file_name.replace('/', '-') + ext, 'wb') as x:
             x.write(pic)
 
+def track_song_id(track):
+    try:
+        return track.getElementsByTagName("song_id")[0].firstChild.nodeValue
+    except:
+        return None
+
 def xiami_download_song(sid, output_dir = '.', merge = True, info_only = False):
+    if not info_only and archived('xiami', sid):
+        return
     xml = get_html('http://www.xiami.com/song/playlist/id/%s/object_name/default/object_id/0' % sid, faker = True)
     doc = parseString(xml)
     i = doc.getElementsByTagName("track")[0]
@@ -63,6 +71,7 @@ def xiami_download_song(sid, output_dir = '.', merge = True, info_only = False):
     if not info_only:
         file_name = "%s - %s - %s" % (song_title, album_name, artist)
         download_urls([url], file_name, ext, size, output_dir, merge = merge, faker = True)
+        archive_video('xiami', sid, song_title)
         try:
             xiami_download_lyric(lrc_url, file_name, output_dir)
         except:
@@ -78,6 +87,10 @@ def xiami_download_showcollect(cid, output_dir = '.', merge = True, info_only =
     tracks = doc.getElementsByTagName("track")
     track_nr = 1
     for i in tracks:
+        sid = track_song_id(i)
+        if not info_only and archived('xiami', sid):
+            track_nr += 1
+            continue
         artist = i.getElementsByTagName("artist")[0].firstChild.nodeValue
         album_name = i.getElementsByTagName("album_name")[0].firstChild.nodeValue
         song_title = i.getElementsByTagName("title")[0].firstChild.nodeValue
@@ -94,6 +107,7 @@ def xiami_download_showcollect(cid, output_dir = '.', merge = True, info_only =
         if not info_only:
             file_name = "%02d.%s - %s - %s" % (track_nr, song_title, artist, album_name)
             download_urls([url], file_name, ext, size, output_dir, merge = merge, faker = True)
+            archive_video('xiami', sid, song_title)
             try:
                 xiami_download_lyric(lrc_url, file_name, output_dir)
             except:
@@ -111,6 +125,10 @@ def xiami_download_album(aid, output_dir = '.', merge = True, info_only = False)
     track_nr = 1
     pic_exist = False
     for i in tracks:
+        sid = track_song_id(i)
+        if not info_only and archived('xiami', sid):
+            track_nr += 1
+            continue
         song_title = i.getElementsByTagName("title")[0].firstChild.nodeValue
         url = location_dec(i.getElementsByTagName("location")[0].firstChild.nodeValue)
         try:
@@ -127,6 +145,7 @@ def xiami_download_album(aid, output_dir = '.', merge = True, info_only = False)
         if not info_only:
             file_name = "%02d.%s" % (track_nr, song_title)
             download_urls([url], file_name, ext, size, output_dir, merge = merge, faker = True)
+            archive_video('xiami', sid, song_title)
             try:
                 xiami_download_lyric(lrc_url, file_name, output_dir)
             except:
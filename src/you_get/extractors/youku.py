@@ -3,6 +3,7 @@
 
 from ..common import *
 from ..extractor import VideoExtractor
+from ..util.m3u8 import parse as parse_m3u8_playlist
 
 import base64
 import time
@@ -50,7 +51,10 @@ class Youku(VideoExtractor):
         return base64.b64encode(bytes(new_ep, 'latin')), sid, token
 
     def parse_m3u8(m3u8):
-        return re.findall(r'(http://[^?]+)\?ts_start=0', m3u8)
+        # Segments are cut from a few whole files by ts_start/ts_end; take
+        # each file once, from its first segment, without the cut
+        return [segment.uri.split('?')[0] for segment in parse_m3u8_playlist(m3u8, strict = False).segments
+                if '?ts_start=0' in segment.uri]
 
     def get_vid_from_url(url):
         """Extracts video ID from URL.
@@ -163,9 +167,13 @@ class Youku(VideoExtractor):
             if not self.streams[stream_id]['src'] and self.password_protected:
                 log.e('[Failed] Wrong password.')
 
-site = Youku()
-download = site.download_by_url
-download_playlist = site.download_playlist_by_url
+# A new instance for every call; see VideoExtractor
+def download(url, **kwargs):
+    Youku().download_by_url(url, **kwargs)
 
-youku_download_by_vid = site.download_by_vid
+def download_playlist(url, **kwargs):
+    Youku().download_playlist_by_url(url, **kwargs)
+
+def youku_download_by_vid(vid, **kwargs):
+    Youku().download_by_vid(vid, **kwargs)
 # Used by: acfun.py bilibili.py miomio.py tudou.py
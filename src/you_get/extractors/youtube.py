@@ -205,6 +205,9 @@ class YouTube(VideoExtractor):
         self.streams[stream_id]['src'] = [src]
         self.streams[stream_id]['size'] = urls_size(self.streams[stream_id]['src'])
 
-site = YouTube()
-download = site.download_by_url
-download_playlist = site.download_playlist_by_url
+# A new instance for every call; see VideoExtractor
+def download(url, **kwargs):
+    YouTube().download_by_url(url, **kwargs)
+
+def download_playlist(url, **kwargs):
+    YouTube().download_playlist_by_url(url, **kwargs)
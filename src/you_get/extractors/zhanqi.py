@@ -19,9 +19,9 @@ def zhanqi_download(url, output_dir = '.', merge = True, info_only = False):
 
     real_url = rtmp_base+'/'+rtmp_id
     
-    print_info(site_info, title, 'flv', float('inf'))
+    print_info(site_info, title, 'flv', None)
     if not info_only:
-        download_rtmp_url(real_url, title, 'flv', {}, output_dir, merge = merge)
+        download_live_flv(real_url, title, output_dir)
 
 site_info = "zhanqi.tv"
 download = zhanqi_download
@@ -2,5 +2,6 @@
 
 from .join_flv import concat_flv
 from .join_mp4 import concat_mp4
+from .join_ts import concat_ts
 from .ffmpeg import *
 from .rtmpdump import *
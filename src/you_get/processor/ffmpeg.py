@@ -2,6 +2,9 @@
 
 import os.path
 import subprocess
+import sys
+
+from ..util.tools import detect
 
 def get_usable_ffmpeg(cmd):
     try:
@@ -18,12 +21,30 @@ def get_usable_ffmpeg(cmd):
     except:
         return None
 
-FFMPEG, FFMPEG_VERSION = get_usable_ffmpeg('ffmpeg') or get_usable_ffmpeg('avconv') or (None, None)
+def get_ffmpeg():
+    """Returns (command, version) of a usable ffmpeg or avconv, or
+    (None, None). Detected on first use rather than at import time.
+    """
+    return detect('ffmpeg', get_usable_ffmpeg) or detect('avconv', get_usable_ffmpeg) or (None, None)
+
+# FFMPEG and FFMPEG_VERSION used to be module constants; before Python 3.7
+# (no module __getattr__) they still are
+if sys.version_info >= (3, 7):
+    def __getattr__(name):
+        if name == 'FFMPEG':
+            return get_ffmpeg()[0]
+        if name == 'FFMPEG_VERSION':
+            return get_ffmpeg()[1]
+        raise AttributeError('module %r has no attribute %r' % (__name__, name))
+
+else:
+    FFMPEG, FFMPEG_VERSION = get_ffmpeg()
 
 def has_ffmpeg_installed():
-    return FFMPEG is not None
+    return get_ffmpeg()[0] is not None
 
 def ffmpeg_convert_ts_to_mkv(files, output='output.mkv'):
+    FFMPEG, FFMPEG_VERSION = get_ffmpeg()
     for file in files:
         if os.path.isfile(file):
             params = [FFMPEG, '-y', '-i']
@@ -34,6 +55,7 @@ def ffmpeg_convert_ts_to_mkv(files, output='output.mkv'):
     return
 
 def ffmpeg_concat_mp4_to_mpg(files, output='output.mpg'):
+    FFMPEG, FFMPEG_VERSION = get_ffmpeg()
     # Use concat demuxer on FFmpeg >= 1.1
     if FFMPEG == 'ffmpeg' and (FFMPEG_VERSION[0] >= 2 or (FFMPEG_VERSION[0] == 1 and FFMPEG_VERSION[1] >= 1)):
         concat_list = open(output + '.txt', 'w', encoding="utf-8")
@@ -79,6 +101,7 @@ def ffmpeg_concat_mp4_to_mpg(files, output='output.mpg'):
         raise
 
 def ffmpeg_concat_ts_to_mkv(files, output='output.mkv'):
+    FFMPEG, FFMPEG_VERSION = get_ffmpeg()
     params = [FFMPEG, '-isync', '-y', '-i']
     params.append('concat:')
     for file in files:
@@ -95,6 +118,7 @@ def ffmpeg_concat_ts_to_mkv(files, output='output.mkv'):
         return False
 
 def ffmpeg_concat_flv_to_mp4(files, output='output.mp4'):
+    FFMPEG, FFMPEG_VERSION = get_ffmpeg()
     # Use concat demuxer on FFmpeg >= 1.1
     if FFMPEG == 'ffmpeg' and (FFMPEG_VERSION[0] >= 2 or (FFMPEG_VERSION[0] == 1 and FFMPEG_VERSION[1] >= 1)):
         concat_list = open(output + '.txt', 'w', encoding="utf-8")
@@ -143,6 +167,7 @@ def ffmpeg_concat_flv_to_mp4(files, output='output.mp4'):
         raise
 
 def ffmpeg_concat_mp4_to_mp4(files, output='output.mp4'):
+    FFMPEG, FFMPEG_VERSION = get_ffmpeg()
     # Use concat demuxer on FFmpeg >= 1.1
     if FFMPEG == 'ffmpeg' and (FFMPEG_VERSION[0] >= 2 or (FFMPEG_VERSION[0] == 1 and FFMPEG_VERSION[1] >= 1)):
         concat_list = open(output + '.txt', 'w', encoding="utf-8")
@@ -181,14 +181,19 @@ def write_amf(stream, v):
 # FLV
 ##################################################
 
+# PreviousTagSize, TagType, DataSize (24 bits), Timestamp (lower 24 bits),
+# TimestampExtended, StreamID (always 0)
+tag_header = struct.Struct('>IBBHBHB3s')
+uint = struct.Struct('>I')
+
 def read_int(stream):
     return struct.unpack('>i', stream.read(4))[0]
 
 def read_uint(stream):
-    return struct.unpack('>I', stream.read(4))[0]
+    return uint.unpack(stream.read(4))[0]
 
 def write_uint(stream, n):
-    stream.write(struct.pack('>I', n))
+    stream.write(uint.pack(n))
 
 def read_byte(stream):
     return ord(stream.read(1))
@@ -205,38 +210,20 @@ def read_tag(stream):
     header = stream.read(15)
     if len(header) == 4:
         return
-    x = struct.unpack('>IBBBBBBBBBBB', header)
-    previous_tag_size = x[0]
-    data_type = x[1]
-    body_size = (x[2] << 16) | (x[3] << 8) | x[4]
+    previous_tag_size, data_type, size_hi, size_lo, ts_hi, ts_lo, ts_ext, stream_id = tag_header.unpack(header)
+    body_size = (size_hi << 16) | size_lo
     assert body_size < 1024 * 1024 * 128, 'tag body size too big (> 128MB)'
-    timestamp = (x[5] << 16) | (x[6] << 8) | x[7]
-    timestamp += x[8] << 24
-    assert x[9:] == (0, 0, 0)
+    timestamp = (ts_ext << 24) | (ts_hi << 16) | ts_lo
+    assert stream_id == b'\0\0\0'
     body = stream.read(body_size)
     return (data_type, timestamp, body_size, body, previous_tag_size)
-    #previous_tag_size = read_uint(stream)
-    #data_type = read_byte(stream)
-    #body_size = read_unsigned_medium_int(stream)
-    #assert body_size < 1024*1024*128, 'tag body size too big (> 128MB)'
-    #timestamp = read_unsigned_medium_int(stream)
-    #timestamp += read_byte(stream) << 24
-    #assert read_unsigned_medium_int(stream) == 0
-    #body = stream.read(body_size)
-    #return (data_type, timestamp, body_size, body, previous_tag_size)
 
 def write_tag(stream, tag):
     data_type, timestamp, body_size, body, previous_tag_size = tag
-    write_uint(stream, previous_tag_size)
-    write_byte(stream, data_type)
-    write_byte(stream, body_size>>16 & 0xff)
-    write_byte(stream, body_size>>8  & 0xff)
-    write_byte(stream, body_size     & 0xff)
-    write_byte(stream, timestamp>>16 & 0xff)
-    write_byte(stream, timestamp>>8  & 0xff)
-    write_byte(stream, timestamp     & 0xff)
-    write_byte(stream, timestamp>>24 & 0xff)
-    stream.write(b'\0\0\0')
+    stream.write(tag_header.pack(previous_tag_size, data_type,
+                                 body_size >> 16 & 0xff, body_size & 0xffff,
+                                 timestamp >> 16 & 0xff, timestamp & 0xffff,
+                                 timestamp >> 24 & 0xff, b'\0\0\0'))
     stream.write(body)
 
 def read_flv_header(stream):
@@ -292,47 +279,156 @@ def guess_output(inputs):
             return inputs[0][:i] + '.flv'
     return 'output.flv'
 
-def concat_flv(flvs, output = None):
-    assert flvs, 'no flv file found'
-    import os.path
+# Tags are small; let the buffered I/O batch them into large reads and writes
+buffer_size = 1024 * 1024
+
+TAG_TYPE_VIDEO = 9
+
+# Entries reserved for the keyframe index in the meta tag. Each one takes
+# 18 bytes (two AMF numbers), and the unused space must fit in the padding
+# string (at most 65535 bytes).
+keyframe_capacity = 3000
+
+# Meta fields written by concat_flv(); stale copies from the parts are dropped
+index_fields = ('duration', 'filesize', 'lastkeyframetimestamp', 'lastkeyframelocation', 'keyframes', 'padding')
+
+def read_flv_part(stream):
+    """Reads the FLV header and meta tag of a part; returns (meta_type, meta)."""
+    read_flv_header(stream)
+    return read_meta_tag(read_tag(stream))
+
+def is_keyframe(data_type, body):
+    return data_type == TAG_TYPE_VIDEO and body and body[0] >> 4 == 1
+
+def build_meta(meta, duration, filesize, times, filepositions, padding = ''):
+    """Returns a copy of meta carrying the given seek index. Every value is
+    an AMF number (or a string), so the size only depends on the number of
+    keyframes and the length of the padding.
+    """
+
+    indexed = ECMAObject(0)
+    for k, v in meta.data:
+        if k not in index_fields:
+            indexed.put(k, v)
+    indexed.put('duration', float(duration))
+    indexed.put('filesize', float(filesize))
+    indexed.put('lastkeyframetimestamp', times[-1] if times else 0.0)
+    indexed.put('lastkeyframelocation', filepositions[-1] if filepositions else 0.0)
+    indexed.put('keyframes', {'times': times, 'filepositions': filepositions})
+    indexed.put('padding', padding)
+    indexed.max_number = len(indexed.data)
+    return indexed
+
+def meta_tag_bytes(meta_type, meta):
+    buffer = BytesIO()
+    write_meta_tag(buffer, meta_type, meta)
+    return buffer.getvalue()
+
+def concat_flv(flvs, output = None, remove = False):
+    """Concatenates FLV files into output and returns its path.
+
+    flvs may be any iterable, such as a generator yielding each part as soon
+    as it has been downloaded: parts are appended one at a time. A part may
+    also be a readable binary stream (e.g. an HTTP response) instead of a
+    path; it is read tag by tag and closed. The output is written as
+    output + '.download' and renamed once every part is in, so an
+    interrupted merge never passes for a complete one; only then, with
+    remove set, are the part files deleted.
+
+    The meta tag of the output gets the total duration, the file size and a
+    keyframes index (times and filepositions) for seeking. Space for the
+    index is reserved up front and the tag rewritten in place at the end;
+    if there are more than keyframe_capacity keyframes, only every 2nd
+    (4th, ...) one is indexed.
+    """
+
+    import os
     if not output:
+        flvs = list(flvs)
+        assert flvs, 'no flv file found'
         output = guess_output(flvs)
     elif os.path.isdir(output):
+        flvs = list(flvs)
+        assert flvs, 'no flv file found'
         output = os.path.join(output, guess_output(flvs))
-    
+
     print('Merging video parts...')
-    ins = [open(flv, 'rb') for flv in flvs]
-    for stream in ins:
-        read_flv_header(stream)
-    meta_tags = map(read_tag, ins)
-    metas = list(map(read_meta_tag, meta_tags))
-    meta_types, metas = zip(*metas)
-    assert len(set(meta_types)) == 1
-    meta_type = meta_types[0]
-    
-    # must merge fields: duration
-    # TODO: check other meta info, update other meta info
-    total_duration = sum(meta.get('duration') for meta in metas)
-    meta_data = metas[0]
-    meta_data.set('duration', total_duration)
-    
-    out = open(output, 'wb')
-    write_flv_header(out)
-    write_meta_tag(out, meta_type, meta_data)
+    temp_output = output + '.download'
+    out = None
+    merged = []
     timestamp_start = 0
-    for stream in ins:
-        while True:
-            tag = read_tag(stream)
-            if tag:
-                data_type, timestamp, body_size, body, previous_tag_size = tag
-                timestamp += timestamp_start
-                tag = data_type, timestamp, body_size, body, previous_tag_size
-                write_tag(out, tag)
-            else:
-                break
-        timestamp_start = timestamp
+    times = []
+    filepositions = []
+    keyframes = 0
+    stride = 1
+    try:
+        for flv in flvs:
+            with (open(flv, 'rb', buffering = buffer_size) if isinstance(flv, str) else flv) as stream:
+                part_meta_type, part_meta = read_flv_part(stream)
+                if out is None:
+                    meta_type, meta_data = part_meta_type, part_meta
+                    # TODO: check other meta info, update other meta info
+                    total_duration = meta_data.get('duration')
+                    reserved = meta_tag_bytes(meta_type, build_meta(meta_data, 0, 0, [0.0] * keyframe_capacity, [0.0] * keyframe_capacity))
+                    out = open(temp_output, 'wb', buffering = buffer_size)
+                    write_flv_header(out)
+                    meta_offset = out.tell()
+                    out.write(reserved)
+                    previous_tag_size = len(reserved) - 4
+                else:
+                    assert part_meta_type == meta_type
+                    total_duration += part_meta.get('duration')
+
+                while True:
+                    tag = read_tag(stream)
+                    if tag:
+                        data_type, timestamp, body_size, body, _ = tag
+                        timestamp += timestamp_start
+                        if is_keyframe(data_type, body) and not (times and times[-1] == timestamp / 1000):
+                            if keyframes % stride == 0:
+                                if len(times) == keyframe_capacity:
+                                    # Out of reserved space: halve the density of the index
+                                    times = times[::2]
+                                    filepositions = filepositions[::2]
+                                    stride *= 2
+                                if keyframes % stride == 0:
+                                    times.append(timestamp / 1000)
+                                    # The tag starts after its PreviousTagSize field
+                                    filepositions.append(float(out.tell() + 4))
+                            keyframes += 1
+                        write_tag(out, (data_type, timestamp, body_size, body, previous_tag_size))
+                        previous_tag_size = 11 + body_size
+                    else:
+                        break
+                timestamp_start = timestamp
+            if isinstance(flv, str):
+                merged.append(flv)
+    except:
+        if out is not None:
+            out.close()
+        raise
+    assert out is not None, 'no flv file found'
     write_uint(out, previous_tag_size)
-    
+    filesize = out.tell()
+
+    # Fill whatever the index doesn't use with padding, so the tag keeps the
+    # size reserved for it and no tag after it has to move
+    meta = build_meta(meta_data, total_duration, filesize, times, filepositions)
+    unused = len(reserved) - len(meta_tag_bytes(meta_type, meta))
+    meta = build_meta(meta_data, total_duration, filesize, times, filepositions, ' ' * unused)
+    final = meta_tag_bytes(meta_type, meta)
+    # The meta tag's own PreviousTagSize (0) and header are unchanged
+    assert len(final) == len(reserved)
+    out.seek(meta_offset)
+    out.write(final)
+    out.close()
+
+    if os.access(output, os.W_OK):
+        os.remove(output) # on Windows rename could fail if destination filepath exists
+    os.rename(temp_output, output)
+    if remove:
+        for flv in merged:
+            os.remove(flv)
     return output
 
 def usage():
@@ -6,9 +6,27 @@
 # reader and writer
 ##################################################
 
+import io
+import os
 import struct
+import sys
+from array import array
 from io import BytesIO
 
+# Largest size or offset a 32-bit field holds; past it the output switches
+# to co64 chunk offsets and a large-size mdat header
+MAX_UINT32 = 0xffffffff
+
+# array('Q') only exists from Python 3.3; before that 64-bit offsets go in
+# array('L') where it is 64-bit, or else in a list
+try:
+    UINT64 = array('Q').typecode
+except ValueError:
+    UINT64 = 'L' if array('L').itemsize == 8 else None
+
+def uint64_array(values = ()):
+    return array(UINT64, values) if UINT64 else list(values)
+
 def skip(stream, n):
     stream.seek(stream.tell() + n)
 
@@ -36,7 +54,93 @@ def read_ulong(stream):
 def read_byte(stream):
     return ord(stream.read(1))
 
+def read_uint_array(stream, n, typecode = 'I'):
+    """Reads n big-endian unsigned ints (32-bit for 'I', 64-bit for UINT64)
+    into an array in one go."""
+    a = array(typecode)
+    a.frombytes(stream.read(n * a.itemsize))
+    assert len(a) == n, 'no enough data'
+    if sys.byteorder == 'little':
+        a.byteswap()
+    return a
+
+def write_uint_array(stream, a, typecode = 'I'):
+    if not isinstance(a, array) or a.typecode != typecode or sys.byteorder == 'little':
+        a = array(typecode, a)
+        if sys.byteorder == 'little':
+            a.byteswap()
+    stream.write(a.tobytes())
+
+def read_uint64_array(stream, n):
+    if UINT64:
+        return read_uint_array(stream, n, UINT64)
+    data = stream.read(n * 8)
+    assert len(data) == n * 8, 'no enough data'
+    return list(struct.unpack('>%dQ' % n, data))
+
+def write_uint64_array(stream, a):
+    if UINT64:
+        write_uint_array(stream, a, UINT64)
+    else:
+        stream.write(struct.pack('>%dQ' % len(a), *a))
+
+def copy_file_range(source_fd, target_fd, source_offset, target_offset, n):
+    """Copies up to n bytes between file descriptors at explicit offsets
+    without passing them through user space, using copy_file_range(2) or
+    else sendfile(2). Returns the number of bytes copied, which is short
+    (possibly 0) if neither is available or usable for these files.
+    """
+
+    copied = 0
+    if hasattr(os, 'copy_file_range'):
+        try:
+            while copied < n:
+                count = os.copy_file_range(source_fd, target_fd, n - copied, source_offset + copied, target_offset + copied)
+                if count == 0:
+                    break
+                copied += count
+            return copied
+        except OSError:
+            # e.g. EXDEV across file systems on older kernels; try sendfile
+            pass
+
+    if hasattr(os, 'sendfile'):
+        try:
+            # sendfile() writes at the current position of the target
+            os.lseek(target_fd, target_offset + copied, os.SEEK_SET)
+            while copied < n:
+                count = os.sendfile(target_fd, source_fd, source_offset + copied, n - copied)
+                if count == 0:
+                    break
+                copied += count
+        except OSError:
+            pass
+    return copied
+
 def copy_stream(source, target, n):
+    """Copies n bytes from the current position of source to target.
+
+    Between real files the kernel does the copy (see copy_file_range());
+    otherwise, and for whatever it leaves, data goes through 1 MiB reads
+    and writes.
+    """
+
+    try:
+        source_fd = source.fileno()
+        target_fd = target.fileno()
+    except (AttributeError, io.UnsupportedOperation):
+        source_fd = target_fd = None
+    if source_fd is not None and n > 0:
+        # Hand over the exact positions: drop buffered data first, and move
+        # both file objects past the copied range afterwards
+        target.flush()
+        source_offset = source.tell()
+        target_offset = target.tell()
+        copied = copy_file_range(source_fd, target_fd, source_offset, target_offset, n)
+        source.seek(source_offset + copied)
+        target.seek(target_offset + copied)
+        n -= copied
+
     buffer_size = 1024 * 1024
     while n > 0:
         to_read = min(buffer_size, n)
@@ -130,20 +234,54 @@ class VariableAtom(Atom):
         else:
             raise Exception('field not found: '+k)
 
-def read_raw(stream, size, left, type):
-    assert size == left + 8
-    body = stream.read(left)
-    return Atom(type, size, body)
+class DeferredAtom(Atom):
+    """An atom whose body is only read when first used, by the reader it
+    was parsed for; it then turns into the atom that reader returns.
+
+    Unused, it is copied through from the source like read_lazy() atoms.
+    """
+    def __init__(self, type, size, source, source_start, header, reader):
+        assert len(type) == 4
+        self.type = type
+        self.size = size
+        self.source = source
+        self.source_start = source_start
+        self.header = header
+        self.reader = reader
+    def __getattr__(self, name):
+        # Only called for attributes not set yet, i.e. body and the
+        # attributes of the reader's atom
+        if name in ('source', 'source_start', 'header', 'reader'):
+            raise AttributeError(name)
+        source = self.source
+        position = source.tell()
+        source.seek(self.source_start + self.header)
+        atom = self.reader(source, self.size, self.size - self.header, self.type)
+        source.seek(position)
+        self.__class__ = atom.__class__
+        self.__dict__ = atom.__dict__
+        return getattr(self, name)
+    def write(self, stream):
+        self.source.seek(self.source_start)
+        copy_stream(self.source, stream, self.size)
+
+def deferred(reader):
+    """Wraps an atom reader so that it runs only once the atom is used."""
+    def read_deferred(stream, size, left, type):
+        source_start = stream.tell() - (size - left)
+        skip(stream, left)
+        return DeferredAtom(type, size, stream, source_start, size - left, reader)
+    return read_deferred
 
 def read_udta(stream, size, left, type):
     assert size == left + 8
-    body = stream.read(left)
+    skip(stream, left)
     class Udta(Atom):
         def write(self, stream):
             return
         def calsize(self):
             return 0
-    return Udta(type, size, body)
+    return Udta(type, size, None)
 
 def read_body_stream(stream, left):
     body = stream.read(left)
@@ -231,7 +369,7 @@ def read_tkhd(stream, size, left, type):
     height = qt_track_height >> 16
     left -= 60
     assert left == 0
-    return VariableAtom(b'tkhd', size, body, [('duration', 20, duration, 4)])
+    return VariableAtom(b'tkhd', size, body, [('track_id', 12, track_id, 4), ('duration', 20, duration, 4)])
 
 def read_mdhd(stream, size, left, type):
     body, stream = read_body_stream(stream, left)
@@ -360,12 +498,9 @@ def read_stts(stream, size, left, type):
     #assert entry_count == 1
     left -= 4
     
-    samples = []
-    for i in range(entry_count):
-        sample_count = read_uint(stream)
-        sample_duration = read_uint(stream)
-        samples.append((sample_count, sample_duration))
-        left -= 8
+    # sample_count, sample_duration, ...
+    samples = read_uint_array(stream, entry_count * 2)
+    left -= entry_count * 8
 
     assert left == 0
     #return Atom('stts', size, None)
@@ -375,13 +510,11 @@ def read_stts(stream, size, left, type):
         def write(self, stream):
             self.write1(stream)
             write_uint(stream, self.body[0])
-            write_uint(stream, len(self.body[1]))
-            for sample_count, sample_duration in self.body[1]:
-                write_uint(stream, sample_count)
-                write_uint(stream, sample_duration)
+            write_uint(stream, len(self.body[1]) // 2)
+            write_uint_array(stream, self.body[1])
         def calsize(self):
             #oldsize = self.size # TODO: remove
-            self.size = 8 + 4 + 4 + len(self.body[1]) * 8
+            self.size = 8 + 4 + 4 + len(self.body[1]) * 4
             #assert oldsize == self.size, '%s: %d, %d' % (self.type, oldsize, self.size) # TODO: remove
             return self.size
     return stts_atom(b'stts', size, (value, samples))
@@ -393,11 +526,8 @@ def read_stss(stream, size, left, type):
     entry_count = read_uint(stream)
     left -= 4
     
-    samples = []
-    for i in range(entry_count):
-            sample = read_uint(stream)
-            samples.append(sample)
-            left -= 4
+    samples = read_uint_array(stream, entry_count)
+    left -= entry_count * 4
     
     assert left == 0
     #return Atom('stss', size, None)
@@ -408,8 +538,7 @@ def read_stss(stream, size, left, type):
             self.write1(stream)
             write_uint(stream, self.body[0])
             write_uint(stream, len(self.body[1]))
-            for sample in self.body[1]:
-                write_uint(stream, sample)
+            write_uint_array(stream, self.body[1])
         def calsize(self):
             self.size = 8 + 4 + 4 + len(self.body[1]) * 4
             return self.size
@@ -422,14 +551,10 @@ def read_stsc(stream, size, left, type):
     entry_count = read_uint(stream)
     left -= 4
     
-    chunks = []
-    for i in range(entry_count):
-        first_chunk = read_uint(stream)
-        samples_per_chunk = read_uint(stream)
-        sample_description_index = read_uint(stream)
-        assert sample_description_index == 1 # what is it?
-        chunks.append((first_chunk, samples_per_chunk, sample_description_index))
-        left -= 12
+    # first_chunk, samples_per_chunk, sample_description_index, ...
+    chunks = read_uint_array(stream, entry_count * 3)
+    assert all(i == 1 for i in chunks[2::3]) # what is it?
+    left -= entry_count * 12
     #chunks, samples = zip(*chunks)
     #total = 0
     #for c, s in zip(chunks[1:], samples):
@@ -444,13 +569,10 @@ def read_stsc(stream, size, left, type):
         def write(self, stream):
             self.write1(stream)
             write_uint(stream, self.body[0])
-            write_uint(stream, len(self.body[1]))
-            for first_chunk, samples_per_chunk, sample_description_index in self.body[1]:
-                write_uint(stream, first_chunk)
-                write_uint(stream, samples_per_chunk)
-                write_uint(stream, sample_description_index)
+            write_uint(stream, len(self.body[1]) // 3)
+            write_uint_array(stream, self.body[1])
         def calsize(self):
-            self.size = 8 + 4 + 4 + len(self.body[1]) * 12
+            self.size = 8 + 4 + 4 + len(self.body[1]) * 4
             return self.size
     return stsc_atom(b'stsc', size, (value, chunks))
 
@@ -462,18 +584,43 @@ def read_stsz(stream, size, left, type):
     sample_count = read_uint(stream)
     left -= 8
     
-    assert sample_size == 0
-    total = 0
-    sizes = []
     if sample_size == 0:
-        for i in range(sample_count):
-            entry_size = read_uint(stream)
-            sizes.append(entry_size)
-            total += entry_size
-            left -= 4
+        sizes = read_uint_array(stream, sample_count)
+        left -= sample_count * 4
+    else:
+        # All samples the same size; list them, as parts may differ
+        sizes = array('I', [sample_size]) * sample_count
     
     assert left == 0
-    #return Atom('stsz', size, None)
+    return make_stsz(size, value, sizes)
+
+def read_stz2(stream, size, left, type):
+    value = read_full_atom(stream)
+    left -= 4
+    
+    field_size = read_uint(stream) & 0xff
+    sample_count = read_uint(stream)
+    left -= 8
+    
+    data = stream.read(left)
+    assert len(data) == (sample_count * field_size + 7) // 8
+    if field_size == 4:
+        sizes = array('I')
+        for b in data:
+            sizes.append(b >> 4)
+            sizes.append(b & 0xf)
+        del sizes[sample_count:]
+    elif field_size == 8:
+        sizes = array('I', data)
+    elif field_size == 16:
+        sizes = array('I', struct.unpack('>%dH' % sample_count, data))
+    else:
+        raise NotImplementedError('stz2 field size %d' % field_size)
+    
+    # Merged sizes may need wider fields; it is written back as stsz
+    return make_stsz(size, value, sizes)
+
+def make_stsz(size, value, sizes):
     class stsz_atom(Atom):
         def __init__(self, type, size, body):
             Atom.__init__(self, type, size, body)
@@ -482,12 +629,11 @@ def read_stsz(stream, size, left, type):
             write_uint(stream, self.body[0])
             write_uint(stream, self.body[1])
             write_uint(stream, self.body[2])
-            for entry_size in self.body[3]:
-                write_uint(stream, entry_size)
+            write_uint_array(stream, self.body[3])
         def calsize(self):
             self.size = 8 + 4 + 8 + len(self.body[3]) * 4
             return self.size
-    return stsz_atom(b'stsz', size, (value, sample_size, sample_count, sizes))
+    return stsz_atom(b'stsz', size, (value, 0, len(sizes), sizes))
 
 def read_stco(stream, size, left, type):
     value = read_full_atom(stream)
@@ -496,27 +642,39 @@ def read_stco(stream, size, left, type):
     entry_count = read_uint(stream)
     left -= 4
     
-    offsets = []
-    for i in range(entry_count):
-        chunk_offset = read_uint(stream)
-        offsets.append(chunk_offset)
-        left -= 4
+    # Kept 64-bit, so that merged offsets can grow past 4 GiB
+    if type == b'co64':
+        offsets = read_uint64_array(stream, entry_count)
+        left -= entry_count * 8
+    else:
+        offsets = uint64_array(read_uint_array(stream, entry_count))
+        left -= entry_count * 4
     
     assert left == 0
     #return Atom('stco', size, None)
     class stco_atom(Atom):
+        """stco or co64, whichever the offsets fit in when written."""
         def __init__(self, type, size, body):
             Atom.__init__(self, type, size, body)
         def write(self, stream):
+            self.calsize()
             self.write1(stream)
             write_uint(stream, self.body[0])
             write_uint(stream, len(self.body[1]))
-            for chunk_offset in self.body[1]:
-                write_uint(stream, chunk_offset)
+            if self.type == b'co64':
+                write_uint64_array(stream, self.body[1])
+            else:
+                write_uint_array(stream, self.body[1])
         def calsize(self):
-            self.size = 8 + 4 + 4 + len(self.body[1]) * 4
+            offsets = self.body[1]
+            if offsets and max(offsets) > MAX_UINT32:
+                self.type = b'co64'
+                self.size = 8 + 4 + 4 + len(offsets) * 8
+            else:
+                self.type = b'stco'
+                self.size = 8 + 4 + 4 + len(offsets) * 4
             return self.size
-    return stco_atom(b'stco', size, (value, offsets))
+    return stco_atom(type, size, (value, offsets))
 
 def read_ctts(stream, size, left, type):
     value = read_full_atom(stream)
@@ -525,12 +683,9 @@ def read_ctts(stream, size, left, type):
     entry_count = read_uint(stream)
     left -= 4
     
-    samples = []
-    for i in range(entry_count):
-        sample_count = read_uint(stream)
-        sample_offset = read_uint(stream)
-        samples.append((sample_count, sample_offset))
-        left -= 8
+    # sample_count, sample_offset, ...
+    samples = read_uint_array(stream, entry_count * 2)
+    left -= entry_count * 8
     
     assert left == 0
     class ctts_atom(Atom):
@@ -539,15 +694,32 @@ def read_ctts(stream, size, left, type):
         def write(self, stream):
             self.write1(stream)
             write_uint(stream, self.body[0])
-            write_uint(stream, len(self.body[1]))
-            for sample_count, sample_offset in self.body[1]:
-                write_uint(stream, sample_count)
-                write_uint(stream, sample_offset)
+            write_uint(stream, len(self.body[1]) // 2)
+            write_uint_array(stream, self.body[1])
         def calsize(self):
-            self.size = 8 + 4 + 4 + len(self.body[1]) * 8
+            self.size = 8 + 4 + 4 + len(self.body[1]) * 4
             return self.size
     return ctts_atom(b'ctts', size, (value, samples))
 
+def read_sdtp(stream, size, left, type):
+    value = read_full_atom(stream)
+    left -= 4
+    
+    # one byte of dependency flags per sample
+    flags = stream.read(left)
+    assert len(flags) == left
+    class sdtp_atom(Atom):
+        def __init__(self, type, size, body):
+            Atom.__init__(self, type, size, body)
+        def write(self, stream):
+            self.write1(stream)
+            write_uint(stream, self.body[0])
+            stream.write(self.body[1])
+        def calsize(self):
+            self.size = 8 + 4 + len(self.body[1])
+            return self.size
+    return sdtp_atom(b'sdtp', size, (value, flags))
+
 def read_smhd(stream, size, left, type):
     body, stream = read_body_stream(stream, left)
     value = read_full_atom(stream)
@@ -617,13 +789,32 @@ def read_mdat(stream, size, left, type):
             self.write2(stream)
         def write2(self, stream):
             source, source_start, source_size = self.body
-            original = source.tell()
-            source.seek(source_start)
-            copy_stream(source, stream, source_size)
+            if source.closed:
+                # Parts are closed once merged, and opened again to copy
+                with open(source.name, 'rb') as source:
+                    source.seek(source_start)
+                    copy_stream(source, stream, source_size)
+            else:
+                source.seek(source_start)
+                copy_stream(source, stream, source_size)
         def calsize(self):
             return self.size
     return mdat_atom(b'mdat', size, (stream, source_start, source_size))
 
+def read_lazy(stream, size, left, type):
+    """Reads an atom we don't look into: only where it is in the source is
+    kept, and it is copied from there when written."""
+    source_start = stream.tell() - (size - left)
+    skip(stream, left)
+    class lazy_atom(Atom):
+        def __init__(self, type, size, body):
+            Atom.__init__(self, type, size, body)
+        def write(self, stream):
+            source, source_start = self.body
+            source.seek(source_start)
+            copy_stream(source, stream, self.size)
+    return lazy_atom(type, size, (stream, source_start))
+
 atom_readers = {
     b'mvhd': read_mvhd, # merge duration
     b'tkhd': read_tkhd, # merge duration
@@ -633,29 +824,32 @@ atom_readers = {
     b'stsd': read_stsd, # nothing
     b'avc1': read_avc1, # nothing
     b'avcC': read_avcC, # nothing
-    b'stts': read_stts, # sample_count, sample_duration
-    b'stss': read_stss, # join indexes
-    b'stsc': read_stsc, # merge # sample numbers
-    b'stsz': read_stsz, # merge # samples
-    b'stco': read_stco, # merge # chunk offsets
-    b'ctts': read_ctts, # merge
+    b'stts': deferred(read_stts), # sample_count, sample_duration
+    b'stss': deferred(read_stss), # join indexes
+    b'stsc': deferred(read_stsc), # merge # sample numbers
+    b'stsz': deferred(read_stsz), # merge # samples
+    b'stz2': deferred(read_stz2), # merge # samples, written as stsz
+    b'stco': deferred(read_stco), # merge # chunk offsets
+    b'co64': deferred(read_stco), # merge # 64-bit chunk offsets
+    b'ctts': deferred(read_ctts), # merge
+    b'sdtp': deferred(read_sdtp), # merge
     b'smhd': read_smhd, # nothing
     b'mp4a': read_mp4a, # nothing
     b'esds': read_esds, # noting
     
-    b'ftyp': read_raw,
-    b'yqoo': read_raw,
+    b'ftyp': read_lazy,
+    b'yqoo': read_lazy,
     b'moov': read_composite_atom,
     b'trak': read_composite_atom,
     b'mdia': read_composite_atom,
     b'minf': read_composite_atom,
     b'dinf': read_composite_atom,
     b'stbl': read_composite_atom,
-    b'iods': read_raw,
-    b'dref': read_raw,
-    b'free': read_raw,
-    b'edts': read_raw,
-    b'pasp': read_raw,
+    b'iods': read_lazy,
+    b'dref': read_lazy,
+    b'free': read_lazy,
+    b'edts': read_lazy,
+    b'pasp': read_lazy,
 
     b'mdat': read_mdat,
     b'udta': read_udta,
@@ -689,7 +883,6 @@ def read_atom(stream):
     n += 4
     type = header[4:8]
     n += 4
-    assert type != b'uuid'
     if size == 1:
         size = read_ulong(stream)
         n += 8
@@ -697,7 +890,7 @@ def read_atom(stream):
     left = size - n
     if type in atom_readers:
         return atom_readers[type](stream, size, left, type)
-    raise NotImplementedError('%s: %d' % (type, left))
+    return read_lazy(stream, size, left, type)
 
 def write_atom(stream, atom):
     atom.write(stream)
@@ -727,57 +920,54 @@ def read_mp4(stream):
 # merge
 ##################################################
 
+def concat_arrays(arrays, typecode = 'I'):
+    result = array(typecode)
+    for a in arrays:
+        result.extend(a)
+    return result
+
 def merge_stts(samples_list):
-    sample_list = []
-    for samples in samples_list:
-        #assert len(samples) == 1
-        #sample_list.append(samples[0])
-        sample_list += samples
-    counts, durations = zip(*sample_list)
+    sample_list = concat_arrays(samples_list)
+    counts, durations = sample_list[0::2], sample_list[1::2]
     #assert len(set(durations)) == 1, 'not all durations equal'
     if len(set(durations)) == 1:
-        return [(sum(counts), durations[0])]
+        return array('I', [sum(counts), durations[0]])
     return sample_list
 
-def merge_stss(samples, sample_number_list):
-    results = []
-    start = 0
-    for samples, sample_number_list in zip(samples, sample_number_list):
-        results.extend(map(lambda x: start + x, samples))
-        start += sample_number_list
-    return results
-
-def merge_stsc(chunks_list, total_chunk_number_list):
-    results = []
-    chunk_index = 1
-    for chunks, total in zip(chunks_list, total_chunk_number_list):
-        for i in range(len(chunks)):
-            if i < len(chunks) - 1:
-                chunk_number = chunks[i + 1][0] - chunks[i][0]
-            else:
-                chunk_number = total + 1 - chunks[i][0]
-            sample_number = chunks[i][1]
-            description = chunks[i][2]
-            results.append((chunk_index, sample_number, description))
-            chunk_index += chunk_number
-    return results
-
-def merge_stco(offsets_list, mdats):
-    offset = 0
-    results = []
-    for offsets, mdat in zip(offsets_list, mdats):
-        results.extend(offset + x - mdat.body[1] for x in offsets)
-        offset += mdat.size - 8
-    return results
-
-def merge_stsz(sizes_list):
-    return sum(sizes_list, [])
+def get_stco(trak):
+    """Returns the chunk offset atom of a track, be it stco or co64."""
+    stbl = trak.get(b'mdia', b'minf', b'stbl')
+    for a in stbl.body:
+        if a.type in (b'stco', b'co64'):
+            return a
+    raise Exception('atom not found: stco')
+
+def get_stsz(stbl):
+    """Returns the sample size atom of a sample table, be it stsz or stz2."""
+    for a in stbl.body:
+        if a.type in (b'stsz', b'stz2'):
+            return a
+    raise Exception('atom not found: stsz')
 
 def merge_mdats(mdats):
-    total_size = sum(x.size - 8 for x in mdats) + 8
+    payload_size = sum(x.body[2] for x in mdats)
+    if payload_size + 8 > MAX_UINT32:
+        # size 1 means a 64-bit size follows the type
+        total_size = payload_size + 16
+    else:
+        total_size = payload_size + 8
     class multi_mdat_atom(Atom):
         def __init__(self, type, size, body):
             Atom.__init__(self, type, size, body)
+        def header_size(self):
+            return 16 if self.size > MAX_UINT32 else 8
+        def write1(self, stream):
+            if self.size > MAX_UINT32:
+                write_uint(stream, 1)
+                stream.write(self.type)
+                write_ulong(stream, self.size)
+            else:
+                Atom.write1(self, stream)
         def write(self, stream):
             self.write1(stream)
             self.write2(stream)
@@ -788,104 +978,193 @@ def merge_mdats(mdats):
             return self.size
     return multi_mdat_atom(b'mdat', total_size, mdats)
 
-def merge_moov(moovs, mdats):
+# Sample-indexed tables that are not merged; they are left out of the output
+unmerged_tables = (b'sbgp', b'subs', b'stsh', b'stdp', b'padb')
+
+def get_track_key(trak):
+    """Tracks of the parts are matched by track ID and handler type."""
+    track_id = trak.get(b'tkhd').get('track_id')
+    handler = trak.get(b'mdia', b'hdlr').body[8:12]
+    return track_id, handler
+
+def find_atom(atom, k):
+    for a in atom.body:
+        if a.type == k:
+            return a
+
+def new_track(trak):
+    """Returns the merged sample tables of a track, empty so far; trak is
+    the track of the first part, which they are written into."""
+    return {
+        'trak': trak,
+        'tkhd': 0, 'mdhd': 0, # durations
+        'samples': 0, 'chunks': 0,
+        'stts': array('I'), 'stss': array('I'), 'stsc': array('I'),
+        'stsz': array('I'), 'stco': uint64_array(), 'ctts': array('I'),
+        'sdtp': [],
+        # The first stss, ctts and sdtp atom of any part, which the merged
+        # table goes into if the first part has none
+        'optional': {},
+    }
+
+def append_trak(track, trak, delta):
+    """Appends the samples of a part's trak to the merged track; delta
+    moves its chunk offsets to where its mdat payload goes."""
+    track['tkhd'] += trak.get(b'tkhd').get('duration')
+    track['mdhd'] += trak.get(b'mdia', b'mdhd').get('duration')
+
+    stbl = trak.get(b'mdia', b'minf', b'stbl')
+    sizes = get_stsz(stbl).body[3]
+    offsets = get_stco(trak).body[1]
+    n = len(sizes)
+
+    track['stts'].extend(stbl.get1(b'stts').body[1])
+    chunks = array('I', stbl.get1(b'stsc').body[1])
+    chunks[0::3] = array('I', (x + track['chunks'] for x in chunks[0::3]))
+    track['stsc'].extend(chunks)
+    track['stco'].extend(x + delta for x in offsets)
+    track['stsz'].extend(sizes)
+
+    # Parts without stss have only sync samples, parts without ctts decode
+    # in presentation order, and parts without sdtp leave the dependencies
+    # of their samples unknown (0)
+    stss = find_atom(stbl, b'stss')
+    track['stss'].extend(x + track['samples'] for x in (stss.body[1] if stss else range(1, n + 1)))
+    ctts = find_atom(stbl, b'ctts')
+    track['ctts'].extend(ctts.body[1] if ctts else (n, 0))
+    sdtp = find_atom(stbl, b'sdtp')
+    track['sdtp'].append(sdtp.body[1] if sdtp else bytes(n))
+    for x in (stss, ctts, sdtp):
+        if x:
+            track['optional'].setdefault(x.type, x)
+
+    track['samples'] += n
+    track['chunks'] += len(offsets)
+
+def finish_trak(track):
+    """Writes the merged sample tables into the trak of the first part."""
+    trak = track['trak']
+    trak.get(b'tkhd').set('duration', track['tkhd'])
+    trak.get(b'mdia', b'mdhd').set('duration', track['mdhd'])
+
+    stbl = trak.get(b'mdia', b'minf', b'stbl')
+    stts_atom = stbl.get1(b'stts')
+    stts_atom.body = stts_atom.body[0], merge_stts([track['stts']])
+    stsc_atom = stbl.get1(b'stsc')
+    stsc_atom.body = stsc_atom.body[0], track['stsc']
+    stco_atom = get_stco(trak)
+    stco_atom.body = stco_atom.body[0], track['stco']
+    stsz_atom = get_stsz(stbl)
+    stsz_atom.body = stsz_atom.body[0], stsz_atom.body[1], len(track['stsz']), track['stsz']
+
+    # stss, ctts and sdtp are written if any part has them
+    optional = track['optional']
+    if b'ctts' in optional:
+        ctts_atom = put_table(stbl, optional[b'ctts'], (b'stts',))
+        ctts_atom.body = ctts_atom.body[0], track['ctts']
+    if b'stss' in optional:
+        stss_atom = put_table(stbl, optional[b'stss'], (b'stts', b'ctts'))
+        stss_atom.body = stss_atom.body[0], track['stss']
+    if b'sdtp' in optional:
+        sdtp_atom = put_table(stbl, optional[b'sdtp'], ())
+        sdtp_atom.body = sdtp_atom.body[0], b''.join(track['sdtp'])
+
+    stbl.body = [x for x in stbl.body if x.type not in unmerged_tables]
+
+def put_table(stbl, atom, after):
+    """Returns the atom of stbl of the same type as atom; if stbl has none,
+    atom is added right after the last atom of the types in after, or at
+    the end."""
+    existing = find_atom(stbl, atom.type)
+    if existing:
+        return existing
+    positions = [i for i, x in enumerate(stbl.body) if x.type in after]
+    stbl.body.insert(positions[-1] + 1 if positions else len(stbl.body), atom)
+    return atom
+
+def merge_moov(parts):
+    """Merges the moovs of the parts, (moov, mdat) pairs taken one at a
+    time, into the first one, and returns it with the list of mdats.
+
+    Only the merged tables are kept, so parts can be dropped as soon as
+    they are merged. Chunk offsets come out relative to the merged mdat
+    payload; see place_chunks().
+    """
+
+    tracks = None
+    mdats = []
     mvhd_duration = 0
-    for x in moovs:
-        mvhd_duration += x.get(b'mvhd').get('duration')
-    tkhd_durations = [0, 0]
-    mdhd_durations = [0, 0]
-    for x in moovs:
-        traks = x.get_all(b'trak')
-        assert len(traks) == 2
-        tkhd_durations[0] += traks[0].get(b'tkhd').get('duration')
-        tkhd_durations[1] += traks[1].get(b'tkhd').get('duration')
-        mdhd_durations[0] += traks[0].get(b'mdia', b'mdhd').get('duration')
-        mdhd_durations[1] += traks[1].get(b'mdia', b'mdhd').get('duration')
-    #mvhd_duration = min(mvhd_duration, tkhd_durations)
-    
-    trak0s = [x.get_all(b'trak')[0] for x in moovs]
-    trak1s = [x.get_all(b'trak')[1] for x in moovs]
-    
-    stts0 = merge_stts(x.get(b'mdia', b'minf', b'stbl', b'stts').body[1] for x in trak0s)
-    stts1 = merge_stts(x.get(b'mdia', b'minf', b'stbl', b'stts').body[1] for x in trak1s)
-    
-    stss = merge_stss((x.get(b'mdia', b'minf', b'stbl', b'stss').body[1] for x in trak0s), (len(x.get(b'mdia', b'minf', b'stbl', b'stsz').body[3]) for x in trak0s))
-    
-    stsc0 = merge_stsc((x.get(b'mdia', b'minf', b'stbl', b'stsc').body[1] for x in trak0s), (len(x.get(b'mdia', b'minf', b'stbl', b'stco').body[1]) for x in trak0s))
-    stsc1 = merge_stsc((x.get(b'mdia', b'minf', b'stbl', b'stsc').body[1] for x in trak1s), (len(x.get(b'mdia', b'minf', b'stbl', b'stco').body[1]) for x in trak1s))
-    
-    stco0 = merge_stco((x.get(b'mdia', b'minf', b'stbl', b'stco').body[1] for x in trak0s), mdats)
-    stco1 = merge_stco((x.get(b'mdia', b'minf', b'stbl', b'stco').body[1] for x in trak1s), mdats)
-    
-    stsz0 = merge_stsz((x.get(b'mdia', b'minf', b'stbl', b'stsz').body[3] for x in trak0s))
-    stsz1 = merge_stsz((x.get(b'mdia', b'minf', b'stbl', b'stsz').body[3] for x in trak1s))
-    
-    ctts = sum((x.get(b'mdia', b'minf', b'stbl', b'ctts').body[1] for x in trak0s), [])
-    
-    moov = moovs[0]
-    
-    moov.get(b'mvhd').set('duration', mvhd_duration)
-    trak0 = moov.get_all(b'trak')[0]
-    trak1 = moov.get_all(b'trak')[1]
-    trak0.get(b'tkhd').set('duration', tkhd_durations[0])
-    trak1.get(b'tkhd').set('duration', tkhd_durations[1])
-    trak0.get(b'mdia', b'mdhd').set('duration', mdhd_durations[0])
-    trak1.get(b'mdia', b'mdhd').set('duration', mdhd_durations[1])
-    
-    stts_atom = trak0.get(b'mdia', b'minf', b'stbl', b'stts')
-    stts_atom.body = stts_atom.body[0], stts0
-    stts_atom = trak1.get(b'mdia', b'minf', b'stbl', b'stts')
-    stts_atom.body = stts_atom.body[0], stts1
-    
-    stss_atom = trak0.get(b'mdia', b'minf', b'stbl', b'stss')
-    stss_atom.body = stss_atom.body[0], stss
-    
-    stsc_atom = trak0.get(b'mdia', b'minf', b'stbl', b'stsc')
-    stsc_atom.body = stsc_atom.body[0], stsc0
-    stsc_atom = trak1.get(b'mdia', b'minf', b'stbl', b'stsc')
-    stsc_atom.body = stsc_atom.body[0], stsc1
-    
-    stco_atom = trak0.get(b'mdia', b'minf', b'stbl', b'stco')
-    stco_atom.body = stss_atom.body[0], stco0
-    stco_atom = trak1.get(b'mdia', b'minf', b'stbl', b'stco')
-    stco_atom.body = stss_atom.body[0], stco1
-    
-    stsz_atom = trak0.get(b'mdia', b'minf', b'stbl', b'stsz')
-    stsz_atom.body = stsz_atom.body[0], stsz_atom.body[1], len(stsz0), stsz0
-    stsz_atom = trak1.get(b'mdia', b'minf', b'stbl', b'stsz')
-    stsz_atom.body = stsz_atom.body[0], stsz_atom.body[1], len(stsz1), stsz1
-    
-    ctts_atom = trak0.get(b'mdia', b'minf', b'stbl', b'ctts')
-    ctts_atom.body = ctts_atom.body[0], ctts
-    
-    old_moov_size = moov.size
-    new_moov_size = moov.calsize()
-    new_mdat_start = mdats[0].body[1] + new_moov_size - old_moov_size
-    stco0 = list(map(lambda x: x + new_mdat_start, stco0))
-    stco1 = list(map(lambda x: x + new_mdat_start, stco1))
-    stco_atom = trak0.get(b'mdia', b'minf', b'stbl', b'stco')
-    stco_atom.body = stss_atom.body[0], stco0
-    stco_atom = trak1.get(b'mdia', b'minf', b'stbl', b'stco')
-    stco_atom.body = stss_atom.body[0], stco1
-    
-    return moov
-
-def merge_mp4s(files, output):
+    offset = 0
+    for moov, mdat in parts:
+        traks = dict((get_track_key(t), t) for t in moov.get_all(b'trak'))
+        if tracks is None:
+            first = moov
+            keys = [get_track_key(x) for x in moov.get_all(b'trak')]
+            tracks = dict((key, new_track(traks[key])) for key in keys)
+        if len(traks) != len(keys) or set(traks) != set(keys):
+            raise Exception('tracks differ between parts: %s, %s' % (keys, list(traks)))
+        for key in keys:
+            append_trak(tracks[key], traks[key], offset - mdat.body[1])
+        mvhd_duration += moov.get(b'mvhd').get('duration')
+        offset += mdat.body[2]
+        mdats.append(mdat)
+
+    first.get(b'mvhd').set('duration', mvhd_duration)
+    for key in keys:
+        finish_trak(tracks[key])
+    return first, mdats
+
+def place_chunks(atoms, moov, mdat):
+    """Turns the chunk offsets of the merged moov into file offsets for
+    the atoms written in the given order.
+
+    Moving the chunks past 4 GiB turns stco into co64, which grows moov and
+    so moves the chunks again if moov comes first; repeat until moov keeps
+    its size.
+    """
+
+    stcos = [get_stco(trak) for trak in moov.get_all(b'trak')]
+    relative = [x.body[1] for x in stcos]
+    moov_size = None
+    while moov_size != moov.calsize():
+        moov_size = moov.size
+        mdat_start = mdat.header_size()
+        for x in atoms:
+            if x is mdat:
+                break
+            mdat_start += x.calsize()
+        for stco, offsets in zip(stcos, relative):
+            stco.body = stco.body[0], uint64_array(x + mdat_start for x in offsets)
+
+def merge_mp4s(files, output, faststart = False):
+    """Merges the MP4 files into output, with the atoms in the order of the
+    first file, or with faststart as ftyp, moov, then mdat so that the file
+    plays while it is still downloading."""
     assert files
-    ins = [open(mp4, 'rb') for mp4 in files]
-    mp4s = list(map(read_mp4, ins))
-    moovs = list(map(lambda x: x[1], mp4s))
-    mdats = list(map(lambda x: x[2], mp4s))
-    moov = merge_moov(moovs, mdats)
+    first = open(files[0], 'rb')
+    first_atoms, moov, mdat = read_mp4(first)
+    def parts():
+        yield moov, mdat
+        for mp4 in files[1:]:
+            with open(mp4, 'rb') as stream:
+                _, moov1, mdat1 = read_mp4(stream)
+                yield moov1, mdat1
+    moov, mdats = merge_moov(parts())
     mdat = merge_mdats(mdats)
-    with open(output, 'wb') as output:
-        for x in mp4s[0][0]:
-            if x.type == b'moov':
-                moov.write(output)
-            elif x.type == b'mdat':
-                mdat.write(output)
-            else:
-                x.write(output)
+    atoms = []
+    for x in first_atoms:
+        if x.type == b'moov':
+            atoms.append(moov)
+        elif x.type == b'mdat':
+            atoms.append(mdat)
+        else:
+            atoms.append(x)
+    if faststart:
+        atoms.sort(key = lambda x: {b'ftyp': 0, b'moov': 1, b'mdat': 3}.get(x.type, 2))
+    place_chunks(atoms, moov, mdat)
+    with first, open(output, 'wb') as output:
+        for x in atoms:
+            x.write(output)
 
 ##################################################
 # main
@@ -902,7 +1181,7 @@ def guess_output(inputs):
             return inputs[0][:i] + '.mp4'
     return 'output.mp4'
 
-def concat_mp4(mp4s, output = None):
+def concat_mp4(mp4s, output = None, faststart = False):
     assert mp4s, 'no mp4 file found'
     import os.path
     if not output:
@@ -911,27 +1190,30 @@ def concat_mp4(mp4s, output = None):
         output = os.path.join(output, guess_output(mp4s))
     
     print('Merging video parts...')
-    merge_mp4s(mp4s, output)
+    merge_mp4s(mp4s, output, faststart)
     
     return output
 
 def usage():
-    print('Usage: [python3] join_mp4.py --output TARGET.mp4 mp4...')
+    print('Usage: [python3] join_mp4.py [--faststart] --output TARGET.mp4 mp4...')
 
 def main():
     import sys, getopt
     try:
-        opts, args = getopt.getopt(sys.argv[1:], "ho:", ["help", "output="])
+        opts, args = getopt.getopt(sys.argv[1:], "ho:", ["help", "output=", "faststart"])
     except getopt.GetoptError as err:
         usage()
         sys.exit(1)
     output = None
+    faststart = False
     for o, a in opts:
         if o in ("-h", "--help"):
             usage()
             sys.exit()
         elif o in ("-o", "--output"):
             output = a
+        elif o == "--faststart":
+            faststart = True
         else:
             usage()
             sys.exit(1)
@@ -939,7 +1221,7 @@ def main():
         usage()
         sys.exit(1)
     
-    concat_mp4(args, output)
+    concat_mp4(args, output, faststart)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,347 @@
+#!/usr/bin/env python
+
+# reference: ISO/IEC 13818-1 (MPEG-2 systems), 2.4.3 transport stream packets
+
+import mmap
+import os
+import sys
+from array import array
+
+PACKET_SIZE = 188
+SYNC_BYTE = 0x47
+NULL_PID = 0x1fff
+
+# PTS, DTS and the PCR base count a 90 kHz clock in 33 bits
+TIMESTAMP_WRAP = 1 << 33
+
+# How far (in 90 kHz ticks) the first decoding time of a part may be before
+# or after the last one of the previous part for it to be taken as
+# continuing its timeline (streams are muxed a little out of step); beyond
+# that its timestamps are moved to follow the previous part
+max_overlap = 90000
+max_gap = 10 * 90000
+
+# Gap left between rebased parts: one frame at 25 fps
+rebase_gap = 3600
+
+# PES streams without the optional header carrying PTS/DTS: program stream
+# map, padding, private stream 2, ECM, EMM, DSMCC, H.222.1 type E, directory
+no_header_streams = (0xbc, 0xbe, 0xbf, 0xf0, 0xf1, 0xf2, 0xf8, 0xff)
+
+def signed(ticks):
+    """Maps a difference of timestamps modulo 2^33 to -2^32 .. 2^32."""
+    ticks %= TIMESTAMP_WRAP
+    return ticks - TIMESTAMP_WRAP if ticks >= TIMESTAMP_WRAP // 2 else ticks
+
+def find_sync(data, pos = 0):
+    """Returns the position of the first packet at or after pos, i.e. of a
+    sync byte followed by another one a packet later, or None."""
+    while True:
+        pos = data.find(b'\x47', pos)
+        if pos < 0 or pos + PACKET_SIZE > len(data):
+            return None
+        if pos + PACKET_SIZE == len(data) or data[pos + PACKET_SIZE] == SYNC_BYTE:
+            return pos
+        pos += 1
+
+def read_timestamp(packet, i):
+    return (packet[i] >> 1 & 0x07) << 30 | packet[i + 1] << 22 | \
+        (packet[i + 2] >> 1) << 15 | packet[i + 3] << 7 | packet[i + 4] >> 1
+
+def write_timestamp(packet, i, ts):
+    # Keeps the 4-bit prefix and the marker bits
+    packet[i] = packet[i] & 0xf1 | ts >> 29 & 0x0e
+    packet[i + 1] = ts >> 22 & 0xff
+    packet[i + 2] = ts >> 14 & 0xfe | 1
+    packet[i + 3] = ts >> 7 & 0xff
+    packet[i + 4] = ts << 1 & 0xfe | 1
+
+def read_pcr(packet, i):
+    # Only the 90 kHz base; the 27 MHz extension is left as it is
+    return packet[i] << 25 | packet[i + 1] << 17 | packet[i + 2] << 9 | \
+        packet[i + 3] << 1 | packet[i + 4] >> 7
+
+def write_pcr(packet, i, base):
+    packet[i] = base >> 25 & 0xff
+    packet[i + 1] = base >> 17 & 0xff
+    packet[i + 2] = base >> 9 & 0xff
+    packet[i + 3] = base >> 1 & 0xff
+    packet[i + 4] = packet[i + 4] & 0x7f | (base & 1) << 7
+
+def timestamp_fields(packet):
+    """Returns the clock fields of a packet as (position, is_pcr) pairs: the
+    PCR in its adaptation field and the PTS/DTS of a PES header starting
+    in its payload."""
+    fields = []
+    payload = 4
+    if packet[3] & 0x20:
+        length = packet[4]
+        if length >= 7 and packet[5] & 0x10:
+            fields.append((6, True))
+        payload = 5 + length
+    if packet[3] & 0x10 and packet[1] & 0x40 and payload + 14 <= PACKET_SIZE:
+        if packet[payload:payload + 3] == b'\0\0\1' and packet[payload + 3] not in no_header_streams:
+            flags = packet[payload + 7] >> 6
+            if flags & 2:
+                fields.append((payload + 9, False))
+            if flags == 3 and payload + 19 <= PACKET_SIZE:
+                fields.append((payload + 14, False))
+    return fields
+
+def read_field(packet, field):
+    i, is_pcr = field
+    return read_pcr(packet, i) if is_pcr else read_timestamp(packet, i)
+
+def decoding_time(packet, fields):
+    """Returns the DTS of the PES header in a packet (its PTS if it has no
+    DTS), or None."""
+    ts = None
+    for field in fields:
+        if not field[1]:
+            ts = read_field(packet, field)
+    return ts
+
+def first_decoding_time(view, pos, packets = 512):
+    """Returns the earliest decoding time in the first packets from pos."""
+    first = None
+    end = min(len(view), pos + packets * PACKET_SIZE)
+    while pos + PACKET_SIZE <= end and view[pos] == SYNC_BYTE:
+        if view[pos + 1] & 0x40:
+            packet = view[pos:pos + PACKET_SIZE]
+            ts = decoding_time(packet, timestamp_fields(packet))
+            if ts is not None and (first is None or signed(ts - first) < 0):
+                first = ts
+        pos += PACKET_SIZE
+    return first
+
+def follow_on(continuity, pid, b3):
+    """Returns how much the continuity counters of a PID in a part must be
+    shifted by to follow on from the previous part, given the 4th header
+    byte of its first packet in the part."""
+    last = continuity.get(pid)
+    if last is None:
+        return 0
+    # The counter goes up with each packet carrying payload
+    return ((last + 1 if b3 & 0x10 else last) - b3) & 0x0f
+
+def move_clock(packet, fields, offset, clock):
+    """Adds offset to the clock fields of a packet (a bytearray, unless
+    offset is 0), and moves the end of the timeline past it."""
+    ts = decoding_time(packet, fields)
+    if ts is not None:
+        ts = (ts + offset) % TIMESTAMP_WRAP
+        if clock['end'] is None or signed(ts - clock['end']) > 0:
+            clock['end'] = ts
+    if offset:
+        for field in fields:
+            moved = (read_field(packet, field) + offset) % TIMESTAMP_WRAP
+            if field[1]:
+                write_pcr(packet, field[0], moved)
+            else:
+                write_timestamp(packet, field[0], moved)
+
+# Translation tables over TS header bytes
+pid_high_bits = bytes(i & 0x1f for i in range(256))
+unit_start_bit = bytes(i >> 6 & 1 for i in range(256))
+adaptation_bit = bytes(i >> 5 & 1 for i in range(256))
+
+def append_aligned(out, view, pos, continuity, clock, offset):
+    """Appends a part whose packets are all in place and whose continuity
+    counters already follow on, as most parts cut from one stream are, and
+    returns True; returns False, without writing anything, otherwise.
+
+    The packet headers are read as columns of strided slices, so that only
+    the packets that may carry a clock field (starting a PES or having an
+    adaptation field) are looked at one by one.
+    """
+
+    n = (len(view) - pos) // PACKET_SIZE
+    stop = pos + n * PACKET_SIZE
+    if bytes(view[pos:stop:PACKET_SIZE]).count(SYNC_BYTE) != n:
+        return False
+    h1 = bytes(view[pos + 1:stop:PACKET_SIZE])
+    h3 = bytes(view[pos + 3:stop:PACKET_SIZE])
+
+    pids = bytearray(2 * n)
+    pids[0::2] = h1.translate(pid_high_bits)
+    pids[1::2] = view[pos + 2:stop:PACKET_SIZE]
+    pids = array('H', pids)
+    if sys.byteorder == 'little':
+        pids.byteswap()
+    last_packets = {}
+    reversed_pids = pids[::-1]
+    for pid in set(pids):
+        if pid == NULL_PID:
+            continue
+        if follow_on(continuity, pid, h3[pids.index(pid)]):
+            return False
+        last_packets[pid] = n - 1 - reversed_pids.index(pid)
+    for pid, i in last_packets.items():
+        continuity[pid] = h3[i] & 0x0f
+
+    marks = int.from_bytes(h1.translate(unit_start_bit), 'big') | \
+        int.from_bytes(h3.translate(adaptation_bit), 'big')
+    marks = marks.to_bytes(n, 'big')
+    run = pos
+    i = marks.find(1)
+    while i >= 0:
+        p = pos + i * PACKET_SIZE
+        packet = view[p:p + PACKET_SIZE]
+        fields = timestamp_fields(packet)
+        if offset and fields:
+            packet = bytearray(packet)
+            move_clock(packet, fields, offset, clock)
+            out.write(view[run:p])
+            out.write(packet)
+            run = p + PACKET_SIZE
+        else:
+            move_clock(packet, fields, 0, clock)
+        i = marks.find(1, i + 1)
+    out.write(view[run:stop])
+    return True
+
+def append_packets(out, data, view, pos, continuity, clock, offset):
+    """Appends a part packet by packet, shifting continuity counters and
+    skipping over garbage between packets."""
+    deltas = {}
+    run = pos
+    while pos + PACKET_SIZE <= len(view):
+        if view[pos] != SYNC_BYTE:
+            # Lost sync: drop the garbage up to the next packet
+            out.write(view[run:pos])
+            pos = run = find_sync(data, pos + 1)
+            if pos is None:
+                return
+            continue
+
+        b1 = view[pos + 1]
+        b3 = view[pos + 3]
+        pid = (b1 & 0x1f) << 8 | view[pos + 2]
+        if pid == NULL_PID:
+            pos += PACKET_SIZE
+            continue
+        delta = deltas.get(pid)
+        if delta is None:
+            delta = deltas[pid] = follow_on(continuity, pid, b3)
+        cc = (b3 + delta) & 0x0f
+        continuity[pid] = cc
+
+        fields = ()
+        if b1 & 0x40 or b3 & 0x20:
+            fields = timestamp_fields(view[pos:pos + PACKET_SIZE])
+        if delta or offset and fields:
+            packet = bytearray(view[pos:pos + PACKET_SIZE])
+            packet[3] = b3 & 0xf0 | cc
+            move_clock(packet, fields, offset, clock)
+            out.write(view[run:pos])
+            out.write(packet)
+            run = pos + PACKET_SIZE
+        elif fields:
+            move_clock(view[pos:pos + PACKET_SIZE], fields, 0, clock)
+        pos += PACKET_SIZE
+    out.write(view[run:pos])
+
+def append_ts(out, data, continuity, clock):
+    """Appends the packets of a TS part in data (bytes or an mmap) to out.
+
+    continuity maps each PID to the continuity counter of its last packet
+    written, and clock holds the 'offset' added to the timestamps of the
+    part and the 'end' of the timeline so far; both carry over from part
+    to part. Counters of the part are shifted to follow on, and if its
+    decoding times don't continue the timeline, all its timestamps (PCR,
+    PTS, DTS) are moved to do so.
+
+    Packets left as they are (all of them, for parts cut from one stream)
+    are written as slices of data, without copying them.
+    """
+
+    view = memoryview(data)
+    try:
+        pos = find_sync(data)
+        if pos is None:
+            return
+
+        first = first_decoding_time(view, pos)
+        if first is not None and clock['end'] is not None:
+            gap = signed(first + clock['offset'] - clock['end'])
+            if not -max_overlap <= gap <= max_gap:
+                clock['offset'] = (clock['end'] + rebase_gap - first) % TIMESTAMP_WRAP
+        offset = clock['offset']
+
+        if not append_aligned(out, view, pos, continuity, clock, offset):
+            append_packets(out, data, view, pos, continuity, clock, offset)
+    finally:
+        view.release()
+
+def guess_output(inputs):
+    inputs = [os.path.basename(x) for x in inputs]
+    n = min(map(len, inputs))
+    for i in reversed(range(1, n)):
+        if len(set(s[:i] for s in inputs)) == 1:
+            return inputs[0][:i] + '.ts'
+    return 'output.ts'
+
+def concat_ts(tss, output = None, remove = False):
+    """Concatenates MPEG-TS files into output and returns its path.
+
+    Parts are memory-mapped and appended one at a time (see append_ts()),
+    so continuity counters run on and PCR/PTS/DTS form one timeline across
+    them. The output is written as output + '.download' and renamed once
+    every part is in, so an interrupted merge never passes for a complete
+    one; only then, with remove set, are the parts deleted.
+    """
+
+    tss = list(tss)
+    assert tss, 'no ts file found'
+    if not output:
+        output = guess_output(tss)
+    elif os.path.isdir(output):
+        output = os.path.join(output, guess_output(tss))
+
+    print('Merging video parts...')
+    continuity = {}
+    clock = {'offset': 0, 'end': None}
+    temp_output = output + '.download'
+    with open(temp_output, 'wb') as out:
+        for ts in tss:
+            with open(ts, 'rb') as f:
+                if os.fstat(f.fileno()).st_size:
+                    with mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ) as data:
+                        append_ts(out, data, continuity, clock)
+
+    if os.access(output, os.W_OK):
+        os.remove(output) # on Windows rename could fail if destination filepath exists
+    os.rename(temp_output, output)
+    if remove:
+        for ts in tss:
+            os.remove(ts)
+    return output
+
+def usage():
+    print('Usage: [python3] join_ts.py --output TARGET.ts ts...')
+
+def main():
+    import sys, getopt
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "ho:", ["help", "output="])
+    except getopt.GetoptError as err:
+        usage()
+        sys.exit(1)
+    output = None
+    for o, a in opts:
+        if o in ("-h", "--help"):
+            usage()
+            sys.exit()
+        elif o in ("-o", "--output"):
+            output = a
+        else:
+            usage()
+            sys.exit(1)
+    if not args:
+        usage()
+        sys.exit(1)
+
+    concat_ts(args, output)
+
+if __name__ == '__main__':
+    main()
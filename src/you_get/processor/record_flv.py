@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+
+"""Records a live FLV stream into one file, or a series of files cut at
+keyframes, reconnecting whenever the stream drops."""
+
+import os
+import struct
+import time
+from http.client import HTTPException
+from io import BytesIO
+
+from .join_flv import ECMAObject, TAG_TYPE_METADATA, TAG_TYPE_VIDEO, buffer_size, build_meta, \
+    is_keyframe, meta_tag_bytes, read_meta_data, read_tag, uint, write_flv_header, write_tag, write_uint
+
+TAG_TYPE_AUDIO = 8
+
+# How far (in ms) a tag may be before or after the latest one for it to be
+# taken as continuing the timeline (audio and video are muxed a little out
+# of step); beyond that, as after a reconnection, the timeline is moved to
+# follow on
+max_overlap = 1000
+max_gap = 10000
+
+# Gap left when the timeline is moved: one frame at 25 fps
+rebase_gap = 40
+
+# Seconds to wait before reconnecting, doubled after each failed attempt
+retry_delay = 1
+max_retry_delay = 60
+
+def is_sequence_header(data_type, body):
+    """Returns whether a tag carries the AVC decoder configuration or the
+    AAC AudioSpecificConfig, which decoders need before any frame."""
+    if data_type == TAG_TYPE_VIDEO:
+        return len(body) > 1 and body[0] & 0x0f == 7 and body[1] == 0
+    if data_type == TAG_TYPE_AUDIO:
+        return len(body) > 1 and body[0] >> 4 == 10 and body[1] == 0
+    return False
+
+def read_live_header(stream):
+    """Reads the FLV header of a live stream, which may announce only one
+    of audio and video; returns False if the stream is empty."""
+    header = stream.read(9)
+    if not header:
+        return False
+    if len(header) < 9 or header[:3] != b'FLV':
+        raise ValueError('not an FLV stream')
+    stream.read(uint.unpack(header[5:9])[0] - 9)
+    return True
+
+def read_live_tag(stream):
+    """Reads a tag like read_tag(), but returns None for a stream cut
+    anywhere, as a dropped connection leaves it."""
+    try:
+        tag = read_tag(stream)
+    except struct.error:
+        return None
+    if tag and len(tag[3]) != tag[2]:
+        return None
+    return tag
+
+def to_ecma_object(meta):
+    if isinstance(meta, ECMAObject):
+        return meta
+    o = ECMAObject(len(meta))
+    for k, v in meta.items():
+        o.put(k, v)
+    return o
+
+class FlvRecorder:
+    """Writes the tags of a live stream, across reconnections, into FLV
+    files named by path_for(), starting a new one at the first keyframe
+    after split_time seconds or split_size bytes (if given).
+
+    Each file starts with a meta tag, rewritten with its duration and size
+    once it is complete, and the latest sequence headers, and its
+    timestamps start from 0.
+    """
+
+    def __init__(self, path_for, split_time = None, split_size = None):
+        self.path_for = path_for
+        self.split_time = split_time
+        self.split_size = split_size
+        self.meta_type, self.meta = 'onMetaData', ECMAObject(0)
+        self.sequence_headers = {}
+        self.has_video = False
+        self.offset = 0
+        self.last = None
+        self.out = None
+        self.paths = []
+
+    def write(self, tag):
+        data_type, timestamp, body_size, body, _ = tag
+        if data_type == TAG_TYPE_METADATA:
+            meta_type, meta = read_meta_data(BytesIO(body))
+            if meta_type == 'onMetaData' and isinstance(meta, (ECMAObject, dict)):
+                # Goes into the meta tag of the next file
+                self.meta_type, self.meta = meta_type, to_ecma_object(meta)
+            elif self.out:
+                self.write_tag(data_type, self.last, body)
+            return
+        elif is_sequence_header(data_type, body):
+            # Repeated after each reconnection; only changes are written
+            if self.sequence_headers.get(data_type) != body:
+                self.sequence_headers[data_type] = body
+                if self.out:
+                    self.write_tag(data_type, self.last, body)
+            return
+
+        t = timestamp + self.offset
+        if self.last is not None and not -max_overlap <= t - self.last <= max_gap:
+            self.offset = self.last + rebase_gap - timestamp
+            t = self.last + rebase_gap
+        if data_type == TAG_TYPE_VIDEO:
+            self.has_video = True
+        if self.out is None:
+            self.open(t)
+        elif (is_keyframe(data_type, body) or not self.has_video) and self.is_full(t):
+            self.close()
+            self.open(t)
+        self.write_tag(data_type, t, body)
+        self.last = t if self.last is None else max(self.last, t)
+        self.end = max(self.end, t)
+
+    def is_full(self, t):
+        return self.split_time and t - self.start >= self.split_time * 1000 or \
+            self.split_size and self.out.tell() >= self.split_size
+
+    def write_tag(self, data_type, t, body):
+        write_tag(self.out, (data_type, max(t - self.start, 0), len(body), body, self.previous_tag_size))
+        self.previous_tag_size = 11 + len(body)
+
+    def file_meta(self, filesize):
+        duration = (self.end - self.start) / 1000
+        return meta_tag_bytes(self.file_meta_type, build_meta(self.file_meta_data, duration, filesize, [], []))
+
+    def open(self, t):
+        self.path = self.path_for()
+        self.out = open(self.path + '.download', 'wb', buffering = buffer_size)
+        self.start = self.end = t
+        self.file_meta_type, self.file_meta_data = self.meta_type, self.meta
+        write_flv_header(self.out)
+        self.meta_offset = self.out.tell()
+        # Every meta value is a number, so the final tag has the same size
+        reserved = self.file_meta(0)
+        self.out.write(reserved)
+        self.previous_tag_size = len(reserved) - 4
+        for data_type in (TAG_TYPE_VIDEO, TAG_TYPE_AUDIO):
+            if data_type in self.sequence_headers:
+                self.write_tag(data_type, t, self.sequence_headers[data_type])
+
+    def close(self):
+        if self.out is None:
+            return
+        write_uint(self.out, self.previous_tag_size)
+        filesize = self.out.tell()
+        self.out.seek(self.meta_offset)
+        self.out.write(self.file_meta(filesize))
+        self.out.close()
+        self.out = None
+        if os.access(self.path, os.W_OK):
+            os.remove(self.path) # on Windows rename could fail if destination filepath exists
+        os.rename(self.path + '.download', self.path)
+        self.paths.append(self.path)
+        print('Saved %s' % self.path)
+
+def record_flv(open_stream, path_for, split_time = None, split_size = None, retries = 5):
+    """Records the live FLV stream returned by open_stream() (any readable
+    binary stream) into files named by path_for(); see FlvRecorder.
+
+    When the stream ends or fails, open_stream() is called again after a
+    delay, until it has failed retries times in a row without yielding a
+    tag (retries may be float('inf') to keep trying); the delay doubles after
+    each failure, up to max_retry_delay. Returns the paths of the files
+    written, which are complete even if the recording is interrupted.
+    """
+
+    recorder = FlvRecorder(path_for, split_time, split_size)
+    failures = 0
+    delay = retry_delay
+    try:
+        while True:
+            received = False
+            try:
+                stream = open_stream()
+                try:
+                    if read_live_header(stream):
+                        while True:
+                            tag = read_live_tag(stream)
+                            if tag is None:
+                                break
+                            recorder.write(tag)
+                            received = True
+                finally:
+                    stream.close()
+                print('Stream ended')
+            except (OSError, HTTPException, ValueError, AssertionError) as e:
+                print('Stream failed: %s' % e)
+
+            if received:
+                failures = 0
+                delay = retry_delay
+            else:
+                failures += 1
+                if failures > retries:
+                    break
+            print('Reconnecting in %d s...' % delay)
+            time.sleep(delay)
+            if not received:
+                delay = min(delay * 2, max_retry_delay)
+    finally:
+        recorder.close()
+    return recorder.paths
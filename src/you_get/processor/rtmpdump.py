@@ -2,6 +2,9 @@
 
 import os.path
 import subprocess
+import sys
+
+from ..util.tools import detect
 
 def get_usable_rtmpdump(cmd):
     try:
@@ -11,10 +14,25 @@ def get_usable_rtmpdump(cmd):
     except:
         return None
 
-RTMPDUMP = get_usable_rtmpdump('rtmpdump')
+def get_rtmpdump():
+    """Returns the rtmpdump command, or None. Detected on first use rather
+    than at import time.
+    """
+    return detect('rtmpdump', get_usable_rtmpdump)
+
+# RTMPDUMP used to be a module constant; before Python 3.7 (no module
+# __getattr__) it still is
+if sys.version_info >= (3, 7):
+    def __getattr__(name):
+        if name == 'RTMPDUMP':
+            return get_rtmpdump()
+        raise AttributeError('module %r has no attribute %r' % (__name__, name))
+
+else:
+    RTMPDUMP = get_rtmpdump()
 
 def has_rtmpdump_installed():
-    return RTMPDUMP is not None
+    return get_rtmpdump() is not None
 
 #
 #params ={"-y":"playlist","-q":None,} 
@@ -25,7 +43,7 @@ def download_rtmpdump_stream(url, title, ext,params={},output_dir='.'):
     filename = '%s.%s' % (title, ext)
     filepath = os.path.join(output_dir, filename)
 
-    cmdline = [RTMPDUMP, '-r']
+    cmdline = [get_rtmpdump(), '-r']
     cmdline.append(url)
     cmdline.append('-o')
     cmdline.append(filepath)
@@ -41,6 +59,27 @@ def download_rtmpdump_stream(url, title, ext,params={},output_dir='.'):
     subprocess.call(cmdline)
     return
 
+class RtmpdumpStream:
+    """The FLV output of rtmpdump for a live stream, as a readable binary
+    stream; closing it stops rtmpdump."""
+
+    def __init__(self, url, params={}):
+        cmdline = [get_rtmpdump(), '-q', '-v', '-r', url, '-o', '-']
+        for key in params.keys():
+            cmdline.append(key)
+            if params[key]!=None:
+                cmdline.append(params[key])
+        self.process = subprocess.Popen(cmdline, stdout=subprocess.PIPE)
+
+    def read(self, n=-1):
+        return self.process.stdout.read(n)
+
+    def close(self):
+        if self.process.poll() is None:
+            self.process.terminate()
+        self.process.stdout.close()
+        self.process.wait()
+
 #
 #To be refactor
 #
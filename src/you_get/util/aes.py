@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+
+"""AES-CBC decryption, as used for HLS segments (EXT-X-KEY METHOD=AES-128).
+
+decryptor() uses the cryptography package if it is installed, and the
+table-driven pure Python cipher below otherwise.
+"""
+
+import struct
+
+try:
+    from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+    from cryptography.hazmat.backends import default_backend
+except ImportError:
+    Cipher = None
+
+BLOCK_SIZE = 16
+
+def _xtime(a):
+    a <<= 1
+    return a ^ 0x11b if a & 0x100 else a
+
+def _mul(a, b):
+    p = 0
+    while b:
+        if b & 1:
+            p ^= a
+        a = _xtime(a)
+        b >>= 1
+    return p
+
+def _tables():
+    # S-box from the multiplicative inverses in GF(2^8), generated by 3
+    exp, log = [0] * 255, [0] * 256
+    x = 1
+    for i in range(255):
+        exp[i] = x
+        log[x] = i
+        x ^= _xtime(x)
+    sbox = [0] * 256
+    for a in range(256):
+        b = exp[(255 - log[a]) % 255] if a else 0
+        s = b
+        for _ in range(4):
+            b = (b << 1 | b >> 7) & 0xff
+            s ^= b
+        sbox[a] = s ^ 0x63
+    inv_sbox = [0] * 256
+    for a, s in enumerate(sbox):
+        inv_sbox[s] = a
+
+    # Inverse rounds: InvSubBytes and InvMixColumns of each byte position
+    td0 = []
+    for s in inv_sbox:
+        td0.append(_mul(s, 14) << 24 | _mul(s, 9) << 16 | _mul(s, 13) << 8 | _mul(s, 11))
+    td1 = [(t >> 8 | t << 24) & 0xffffffff for t in td0]
+    td2 = [(t >> 8 | t << 24) & 0xffffffff for t in td1]
+    td3 = [(t >> 8 | t << 24) & 0xffffffff for t in td2]
+    return sbox, inv_sbox, td0, td1, td2, td3
+
+_sbox, _inv_sbox, _td0, _td1, _td2, _td3 = _tables()
+
+def _sub_word(w):
+    s = _sbox
+    return s[w >> 24] << 24 | s[w >> 16 & 0xff] << 16 | s[w >> 8 & 0xff] << 8 | s[w & 0xff]
+
+def expand_key(key):
+    """Returns the round keys, as 32-bit words, of a 16, 24 or 32 byte key."""
+    if len(key) not in (16, 24, 32):
+        raise ValueError('invalid AES key length: %d' % len(key))
+    nk = len(key) // 4
+    rounds = nk + 6
+    w = list(struct.unpack('>%dI' % nk, key))
+    rcon = 1
+    for i in range(nk, 4 * (rounds + 1)):
+        t = w[i - 1]
+        if i % nk == 0:
+            t = _sub_word((t << 8 | t >> 24) & 0xffffffff) ^ rcon << 24
+            rcon = _xtime(rcon)
+        elif nk > 6 and i % nk == 4:
+            t = _sub_word(t)
+        w.append(w[i - nk] ^ t)
+    return w
+
+def decryption_key(key):
+    """Returns the round keys of the equivalent inverse cipher: in reverse
+    order, with InvMixColumns applied to all but the first and last."""
+    w = expand_key(key)
+    rounds = len(w) // 4 - 1
+    s, td0, td1, td2, td3 = _sbox, _td0, _td1, _td2, _td3
+    dk = []
+    for r in range(rounds + 1):
+        words = w[4 * (rounds - r):4 * (rounds - r) + 4]
+        if 0 < r < rounds:
+            # td0[sbox[x]] is the InvMixColumns column of x alone
+            words = [td0[s[x >> 24]] ^ td1[s[x >> 16 & 0xff]] ^ td2[s[x >> 8 & 0xff]] ^ td3[s[x & 0xff]]
+                     for x in words]
+        dk.extend(words)
+    return dk
+
+def decrypt_cbc(dk, iv, data):
+    """Decrypts whole blocks of data in CBC mode, with round keys dk from
+    decryption_key(), and returns the plaintext and the IV of what
+    follows (the last block of ciphertext)."""
+    n = len(data) // 4
+    words = struct.unpack('>%dI' % n, data)
+    out = [0] * n
+    td0, td1, td2, td3, si = _td0, _td1, _td2, _td3, _inv_sbox
+    rounds = len(dk) // 4 - 1
+    k0, k1, k2, k3 = dk[:4]
+    middle = [tuple(dk[k:k + 4]) for k in range(4, 4 * rounds, 4)]
+    l0, l1, l2, l3 = dk[4 * rounds:]
+    p0, p1, p2, p3 = struct.unpack('>4I', iv)
+    for i in range(0, n, 4):
+        c0, c1, c2, c3 = words[i:i + 4]
+        s0, s1, s2, s3 = c0 ^ k0, c1 ^ k1, c2 ^ k2, c3 ^ k3
+        for m0, m1, m2, m3 in middle:
+            s0, s1, s2, s3 = (
+                td0[s0 >> 24] ^ td1[s3 >> 16 & 0xff] ^ td2[s2 >> 8 & 0xff] ^ td3[s1 & 0xff] ^ m0,
+                td0[s1 >> 24] ^ td1[s0 >> 16 & 0xff] ^ td2[s3 >> 8 & 0xff] ^ td3[s2 & 0xff] ^ m1,
+                td0[s2 >> 24] ^ td1[s1 >> 16 & 0xff] ^ td2[s0 >> 8 & 0xff] ^ td3[s3 & 0xff] ^ m2,
+                td0[s3 >> 24] ^ td1[s2 >> 16 & 0xff] ^ td2[s1 >> 8 & 0xff] ^ td3[s0 & 0xff] ^ m3)
+        out[i] = (si[s0 >> 24] << 24 | si[s3 >> 16 & 0xff] << 16 | si[s2 >> 8 & 0xff] << 8 | si[s1 & 0xff]) ^ l0 ^ p0
+        out[i + 1] = (si[s1 >> 24] << 24 | si[s0 >> 16 & 0xff] << 16 | si[s3 >> 8 & 0xff] << 8 | si[s2 & 0xff]) ^ l1 ^ p1
+        out[i + 2] = (si[s2 >> 24] << 24 | si[s1 >> 16 & 0xff] << 16 | si[s0 >> 8 & 0xff] << 8 | si[s3 & 0xff]) ^ l2 ^ p2
+        out[i + 3] = (si[s3 >> 24] << 24 | si[s2 >> 16 & 0xff] << 16 | si[s1 >> 8 & 0xff] << 8 | si[s0 & 0xff]) ^ l3 ^ p3
+        p0, p1, p2, p3 = c0, c1, c2, c3
+    return struct.pack('>%dI' % n, *out), data[-BLOCK_SIZE:] if data else iv
+
+def unpad(block):
+    """Strips the PKCS#7 padding off the last block of plaintext."""
+    n = block[-1] if block else 0
+    if not 0 < n <= BLOCK_SIZE or block[-n:] != bytes([n]) * n:
+        raise ValueError('bad PKCS#7 padding')
+    return block[:-n]
+
+class Decryptor:
+    """Decrypts a stream of AES-CBC ciphertext with PKCS#7 padding, fed to
+    update() in pieces of any size. The last block is held back until
+    finalize(), which unpads it."""
+
+    def __init__(self, key, iv):
+        self.dk = decryption_key(key)
+        self.iv = iv
+        self.pending = b''
+
+    def update(self, data):
+        data = self.pending + data
+        # Keep at least one block: it may be the padded one
+        n = max(len(data) - 1, 0) // BLOCK_SIZE * BLOCK_SIZE
+        self.pending = data[n:]
+        plain, self.iv = decrypt_cbc(self.dk, self.iv, data[:n])
+        return plain
+
+    def finalize(self):
+        if len(self.pending) != BLOCK_SIZE:
+            raise ValueError('ciphertext is not a whole number of blocks')
+        plain, self.iv = decrypt_cbc(self.dk, self.iv, self.pending)
+        self.pending = b''
+        return unpad(plain)
+
+class _CryptographyDecryptor:
+    def __init__(self, key, iv):
+        self.context = Cipher(algorithms.AES(key), modes.CBC(iv), backend = default_backend()).decryptor()
+        self.pending = b''
+
+    def update(self, data):
+        data = self.pending + self.context.update(data)
+        n = max(len(data) - 1, 0) // BLOCK_SIZE * BLOCK_SIZE
+        self.pending = data[n:]
+        return data[:n]
+
+    def finalize(self):
+        return unpad(self.pending + self.context.finalize())
+
+def decryptor(key, iv):
+    """Returns a streaming decryptor (update() and finalize()) for AES-CBC
+    with PKCS#7 padding."""
+    if Cipher is not None:
+        return _CryptographyDecryptor(key, iv)
+    return Decryptor(key, iv)
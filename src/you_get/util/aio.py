@@ -0,0 +1,422 @@
+#!/usr/bin/env python
+
+"""An asyncio download engine.
+
+Drives many concurrent transfers from a single thread over raw
+asyncio.open_connection() streams, with the same .download temp files,
+resume and progress bar semantics as common.url_save() and
+common.url_save_chunked().
+
+Needs Python 3.5 or later (async def); common only imports it when
+--asyncio is given, which is refused on older versions.
+"""
+
+import asyncio
+import http.client
+import io
+import os
+import socket
+from urllib import error, parse, request
+
+async def timed(awaitable, timeout):
+    """Awaits awaitable, raising socket.timeout (an OSError, as for
+    blocking sockets) if it takes longer than timeout seconds."""
+    if timeout is None:
+        return await awaitable
+    try:
+        return await asyncio.wait_for(awaitable, timeout)
+    except asyncio.TimeoutError:
+        raise socket.timeout('timed out')
+
+class Response:
+    """The status, headers and body stream of one HTTP/1.1 response."""
+
+    def __init__(self, session, key, reader, writer, method, url, status, reason, headers):
+        self.session = session
+        self.key = key
+        self.reader = reader
+        self.writer = writer
+        self.url = url
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+
+        self.chunked = (headers['transfer-encoding'] or '').lower() == 'chunked'
+        self.chunk_left = None
+        content_length = headers['content-length']
+        if method == 'HEAD' or status in (204, 304) or 100 <= status < 200:
+            self.length = 0
+        elif not self.chunked and content_length is not None:
+            self.length = int(content_length)
+        else:
+            self.length = None
+        self.will_close = (headers['connection'] or '').lower() == 'close' or \
+            (self.length is None and not self.chunked)
+
+        self.done = False
+        if self.length == 0:
+            self.finish()
+
+    async def receive(self, awaitable):
+        # A timed out connection is left mid-response: never reuse it
+        try:
+            return await timed(awaitable, self.session.read_timeout)
+        except socket.timeout:
+            self.close()
+            raise
+
+    def finish(self):
+        self.done = True
+        if self.will_close:
+            self.writer.close()
+        else:
+            self.session.release(self.key, self.reader, self.writer)
+
+    def close(self):
+        if not self.done:
+            self.done = True
+            self.writer.close()
+
+    async def read(self, n=1024 * 256):
+        """Reads up to n bytes of the body; returns b'' at its end, or when
+        the connection drops before it.
+        """
+
+        if self.done:
+            return b''
+
+        if self.chunked:
+            if not self.chunk_left:
+                if self.chunk_left == 0:
+                    await self.receive(self.reader.readline()) # CRLF after the previous chunk
+                line = await self.receive(self.reader.readline())
+                if not line:
+                    self.close()
+                    return b''
+                self.chunk_left = int(line.split(b';')[0], 16)
+                if self.chunk_left == 0:
+                    while (await self.receive(self.reader.readline())) not in (b'\r\n', b'\n', b''):
+                        pass # Trailers
+                    self.finish()
+                    return b''
+            data = await self.receive(self.reader.read(min(n, self.chunk_left)))
+            if not data:
+                self.close()
+                return b''
+            self.chunk_left -= len(data)
+            return data
+
+        if self.length is not None:
+            data = await self.receive(self.reader.read(min(n, self.length)))
+            if not data:
+                self.close()
+                return b''
+            self.length -= len(data)
+            if self.length == 0:
+                self.finish()
+            return data
+
+        data = await self.receive(self.reader.read(n))
+        if not data:
+            self.finish()
+        return data
+
+    async def drain(self):
+        while await self.read():
+            pass
+
+class Session:
+    """Keep-alive connections shared by the transfers of one event loop,
+    keyed by (scheme, host, port, proxy).
+
+    get_proxy(scheme, host) returns None or (host, port, auth) of the
+    proxy to use, as util.connpool.ConnectionPool.get_proxy() does.
+
+    Connecting (including any proxy tunnel and TLS handshake) fails after
+    connect_timeout seconds, and reading the response after read_timeout
+    seconds without data, with socket.timeout; None waits forever.
+    """
+
+    redirect_codes = (301, 302, 303, 307, 308)
+
+    def __init__(self, get_proxy=None, max_idle_per_host=6, max_redirects=10, connect_timeout=30, read_timeout=60):
+        self.get_proxy = get_proxy or (lambda scheme, host: None)
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_idle_per_host = max_idle_per_host
+        self.max_redirects = max_redirects
+        self.idle = {}
+        self.ssl_context = None
+
+    async def connect(self, key):
+        return await timed(self.open_connection(key), self.connect_timeout)
+
+    async def open_connection(self, key):
+        scheme, host, port, proxy = key
+        ssl_context = None
+        if scheme == 'https':
+            if self.ssl_context is None:
+                import ssl
+                self.ssl_context = ssl.create_default_context()
+            ssl_context = self.ssl_context
+
+        if not proxy:
+            return await asyncio.open_connection(host, port, ssl=ssl_context, server_hostname=host if ssl_context else None)
+        if not ssl_context:
+            return await asyncio.open_connection(proxy[0], proxy[1])
+
+        # Tunnel through the proxy on a plain socket, then hand it over to TLS
+        loop = asyncio.get_event_loop()
+        infos = await loop.getaddrinfo(proxy[0], proxy[1], type=socket.SOCK_STREAM)
+        family, type, proto, _, address = infos[0]
+        sock = socket.socket(family, type, proto)
+        sock.setblocking(False)
+        try:
+            await loop.sock_connect(sock, address)
+            connect = 'CONNECT %s:%s HTTP/1.1\r\nHost: %s:%s\r\n' % (host, port, host, port)
+            if proxy[2]:
+                connect += 'Proxy-Authorization: %s\r\n' % proxy[2]
+            await loop.sock_sendall(sock, (connect + '\r\n').encode('ascii'))
+            reply = b''
+            while b'\r\n\r\n' not in reply:
+                data = await loop.sock_recv(sock, 4096)
+                if not data:
+                    break
+                reply += data
+            status = reply.split(b'\r\n', 1)[0].split()
+            if len(status) < 2 or status[1] != b'200':
+                raise error.URLError('Tunnel connection failed: %s' % reply.split(b'\r\n', 1)[0].decode('iso-8859-1'))
+        except:
+            sock.close()
+            raise
+        return await asyncio.open_connection(sock=sock, ssl=ssl_context, server_hostname=host)
+
+    def release(self, key, reader, writer):
+        conns = self.idle.setdefault(key, [])
+        if len(conns) < self.max_idle_per_host and not reader.at_eof():
+            conns.append((reader, writer))
+        else:
+            writer.close()
+
+    def close(self):
+        for conns in self.idle.values():
+            for reader, writer in conns:
+                writer.close()
+        self.idle = {}
+
+    async def send(self, method, url, headers):
+        o = parse.urlsplit(url)
+        port = o.port or (443 if o.scheme == 'https' else 80)
+        proxy = self.get_proxy(o.scheme, o.hostname)
+        key = (o.scheme, o.hostname, port, proxy)
+
+        headers = dict(headers)
+        if proxy and o.scheme == 'http':
+            selector = parse.urlunsplit((o.scheme, o.netloc, o.path or '/', o.query, ''))
+            if proxy[2]:
+                headers['Proxy-Authorization'] = proxy[2]
+        else:
+            selector = parse.urlunsplit(('', '', o.path or '/', o.query, ''))
+        names = set(k.lower() for k in headers)
+        lines = ['%s %s HTTP/1.1' % (method, selector)]
+        if 'host' not in names:
+            lines.append('Host: %s' % (o.hostname if o.port is None else '%s:%s' % (o.hostname, o.port)))
+        if 'accept-encoding' not in names:
+            lines.append('Accept-Encoding: identity')
+        if 'user-agent' not in names:
+            lines.append('User-Agent: Python-urllib/%s' % request.__version__)
+        lines += ['%s: %s' % (k, v) for k, v in headers.items()]
+        message = ('\r\n'.join(lines) + '\r\n\r\n').encode('iso-8859-1')
+
+        for attempt in range(2):
+            conns = self.idle.get(key)
+            reused = bool(conns)
+            reader, writer = conns.pop() if reused else await self.connect(key)
+            try:
+                writer.write(message)
+                await writer.drain()
+                while True:
+                    status_line = await timed(reader.readline(), self.read_timeout)
+                    if not status_line:
+                        raise http.client.RemoteDisconnected('Remote end closed connection without response')
+                    raw = b''
+                    while True:
+                        line = await timed(reader.readline(), self.read_timeout)
+                        raw += line
+                        if line in (b'\r\n', b'\n', b''):
+                            break
+                    status = status_line.decode('iso-8859-1').rstrip('\r\n').split(' ', 2)
+                    if int(status[1]) != 100:
+                        break
+            except (OSError, http.client.HTTPException) as e:
+                writer.close()
+                if reused and attempt == 0 and not isinstance(e, socket.timeout):
+                    # The server may have dropped an idle keep-alive connection
+                    continue
+                if isinstance(e, OSError):
+                    raise error.URLError(e)
+                raise
+            response_headers = http.client.parse_headers(io.BytesIO(raw))
+            reason = status[2] if len(status) > 2 else ''
+            return Response(self, key, reader, writer, method, url, int(status[1]), reason, response_headers)
+
+    async def request(self, method, url, headers={}):
+        """Sends a request and returns its Response, following redirects and
+        raising urllib.error.HTTPError for error statuses.
+        """
+
+        for _ in range(self.max_redirects + 1):
+            response = await self.send(method, url, headers)
+            location = response.headers['location']
+            if response.status in self.redirect_codes and location:
+                await response.drain()
+                url = parse.urljoin(url, location)
+                if response.status == 303:
+                    method = 'GET'
+                continue
+            if response.status >= 400:
+                response.close()
+                raise error.HTTPError(url, response.status, response.reason, response.headers, None)
+            return response
+        response.close()
+        raise error.HTTPError(url, response.status, 'Too many redirects', response.headers, None)
+
+async def save(session, url, filepath, bar, headers={}, is_part=False, chunked=False, force=False, file_size=None, etag=None):
+    """Saves a URL to filepath, like url_save() (or url_save_chunked() if
+    chunked is set).
+
+    Unless chunked, file_size (float('inf') if unknown) and etag must be
+    those of the URL as probed by common.url_meta(), which falls back to a
+    Range request for hosts that reject HEAD.
+    """
+
+    assert chunked or file_size is not None, 'the URL must be probed first'
+
+    if os.path.exists(filepath):
+        if not force and (chunked or file_size == os.path.getsize(filepath)):
+            if not is_part:
+                if bar:
+                    bar.done()
+                print('Skipping %s: file already exists' % os.path.basename(filepath))
+            else:
+                if bar:
+                    bar.update_received(os.path.getsize(filepath))
+            return
+        else:
+            if not is_part:
+                if bar:
+                    bar.done()
+                print('Overwriting %s' % os.path.basename(filepath), '...')
+    elif not os.path.exists(os.path.dirname(filepath)):
+        os.mkdir(os.path.dirname(filepath))
+
+    temp_filepath = filepath + '.download' if chunked or file_size != float('inf') else filepath
+    received = 0
+    if not force:
+        open_mode = 'ab'
+
+        if os.path.exists(temp_filepath):
+            received += os.path.getsize(temp_filepath)
+            if bar:
+                bar.update_received(received)
+    else:
+        open_mode = 'wb'
+
+    if chunked or received < file_size:
+        headers = dict(headers)
+        if received:
+            headers['Range'] = 'bytes=%s-' % received
+            # Only resume if the file hasn't changed since it was probed
+            if etag and not chunked:
+                headers['If-Range'] = etag
+        response = await session.request('GET', url, headers)
+
+        if chunked:
+            restart = received and response.status != 206
+        else:
+            try:
+                content_range = response.headers['content-range']
+                range_start = int(content_range[6:].split('/')[0].split('-')[0])
+                end_length = int(content_range[6:].split('/')[1])
+                range_length = end_length - range_start
+            except:
+                content_length = response.headers['content-length']
+                range_length = int(content_length) if content_length is not None else float('inf')
+            if response.status != 206 and received and file_size != float('inf'):
+                # Range ignored, or If-Range found the file changed since it
+                # was probed: the whole file follows, maybe with a new size
+                file_size = range_length
+            restart = response.status != 206 or file_size != received + range_length
+        if restart:
+            if bar:
+                bar.update_received(-received)
+            received = 0
+            open_mode = 'wb'
+
+        with open(temp_filepath, open_mode) as output:
+            while True:
+                buffer = await response.read()
+                if not buffer:
+                    if chunked or received == file_size or file_size == float('inf'): # Download finished
+                        break
+                    else: # Unexpected termination. Retry request
+                        headers['Range'] = 'bytes=%s-' % received
+                        response = await session.request('GET', url, headers)
+                        if response.status != 206:
+                            # The whole file follows: start over, as above
+                            output.seek(0)
+                            output.truncate()
+                            if bar:
+                                bar.update_received(-received)
+                            received = 0
+                        continue
+                output.write(buffer)
+                received += len(buffer)
+                if bar:
+                    bar.update_received(len(buffer))
+
+    assert received == os.path.getsize(temp_filepath), '%s == %s == %s' % (received, os.path.getsize(temp_filepath), temp_filepath)
+
+    if temp_filepath != filepath:
+        if os.access(filepath, os.W_OK):
+            os.remove(filepath) # on Windows rename could fail if destination filepath exists
+        os.rename(temp_filepath, filepath)
+
+async def save_all(urls, filepaths, bar, headers={}, is_part=True, chunked=False, force=False, concurrency=1, get_proxy=None, metas=None,
+                   connect_timeout=30, read_timeout=60):
+    session = Session(get_proxy, connect_timeout=connect_timeout, read_timeout=read_timeout)
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    finished = [0]
+
+    async def save_one(url, filepath, meta):
+        async with semaphore:
+            await save(session, url, filepath, bar, headers, is_part=is_part, chunked=chunked, force=force, **meta)
+        finished[0] += 1
+        if bar and is_part:
+            bar.update_piece(finished[0])
+
+    metas = metas or [{}] * len(urls)
+    tasks = [asyncio.ensure_future(save_one(url, filepath, meta)) for url, filepath, meta in zip(urls, filepaths, metas)]
+    try:
+        await asyncio.gather(*tasks)
+    except:
+        for task in tasks:
+            task.cancel()
+        raise
+    finally:
+        session.close()
+
+def download(urls, filepaths, bar, **kwargs):
+    """Saves every URL to the filepath at the same index, running up to
+    `concurrency` transfers at a time on a new event loop.
+
+    Takes the keyword arguments of save_all(); metas, if given, holds the
+    file_size and etag arguments of save() for each URL. Blocks until all
+    are done.
+    """
+
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(save_all(urls, filepaths, bar, **kwargs))
+    finally:
+        loop.close()
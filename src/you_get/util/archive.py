@@ -0,0 +1,33 @@
+#!/usr/bin/env python
+
+import sqlite3
+import threading
+import time
+
+class Archive:
+    """An on-disk index of downloaded videos, keyed by (site, vid), in an
+    SQLite database. It can be shared by threads (--batch-jobs) and by
+    several processes."""
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, timeout = 60, check_same_thread = False)
+        with self.db:
+            self.db.execute('CREATE TABLE IF NOT EXISTS archive ('
+                            'site TEXT NOT NULL, vid TEXT NOT NULL, title TEXT, time REAL, '
+                            'PRIMARY KEY (site, vid))')
+
+    def __contains__(self, key):
+        site, vid = key
+        with self.lock:
+            row = self.db.execute('SELECT 1 FROM archive WHERE site = ? AND vid = ?', (site, str(vid))).fetchone()
+        return row is not None
+
+    def add(self, site, vid, title = None):
+        with self.lock, self.db:
+            self.db.execute('INSERT OR REPLACE INTO archive VALUES (?, ?, ?, ?)',
+                            (site, str(vid), title, time.time()))
+
+    def close(self):
+        with self.lock:
+            self.db.close()
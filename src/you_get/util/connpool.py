@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+
+import base64
+import http.client
+import threading
+from urllib import error, parse, request
+
+class PooledResponse:
+    """A http.client.HTTPResponse that returns its connection to the pool
+    once the body has been read to the end.
+
+    Everything else is delegated to the wrapped response, so it can be used
+    wherever the result of urllib.request.urlopen() was.
+    """
+
+    def __init__(self, pool, key, conn, response, url):
+        self.pool = pool
+        self.key = key
+        self.conn = conn
+        self.response = response
+        self.url = url
+
+    def __getattr__(self, name):
+        return getattr(self.response, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def geturl(self):
+        return self.url
+
+    def read(self, amt=None):
+        data = self.response.read(amt)
+        if self.response.isclosed():
+            self.release()
+        return data
+
+    def release(self):
+        if self.conn is not None:
+            conn, self.conn = self.conn, None
+            self.pool.release(self.key, conn)
+
+    def close(self):
+        if self.response.isclosed():
+            self.release()
+        elif self.conn is not None:
+            # Unread body: the connection can't be reused
+            self.response.close()
+            self.conn.close()
+            self.conn = None
+
+class ConnectionPool:
+    """Keep-alive HTTP(S) connections, keyed by (scheme, host, port, proxy).
+
+    Idle connections are kept up to max_idle_per_host for each key and
+    max_idle in total; a stale keep-alive connection is retried once on a
+    fresh one. Connecting, and every read, fail with socket.timeout after
+    timeout seconds.
+    """
+
+    redirect_codes = (301, 302, 303, 307, 308)
+
+    def __init__(self, max_idle=32, max_idle_per_host=6, max_redirects=10, timeout=60):
+        self.max_idle = max_idle
+        self.timeout = timeout
+        self.max_idle_per_host = max_idle_per_host
+        self.max_redirects = max_redirects
+        # None: use the system settings; {}: no proxy
+        self.proxies = None
+        self.idle = {}
+        self.lock = threading.Lock()
+        self.ssl_context = None
+        self.local = threading.local()
+
+    def set_proxies(self, proxies):
+        self.proxies = proxies
+
+    def set_thread_proxies(self, proxies):
+        """Overrides the proxies for requests made by the calling thread
+        only; None drops the override."""
+        self.local.proxies = proxies
+
+    def get_proxy(self, scheme, host):
+        proxies = getattr(self.local, 'proxies', None)
+        if proxies is None:
+            proxies = self.proxies
+        if proxies is None:
+            if request.proxy_bypass(host):
+                return None
+            proxies = request.getproxies()
+        proxy = proxies.get(scheme)
+        if not proxy:
+            return None
+        if '://' not in proxy:
+            proxy = 'http://' + proxy
+        o = parse.urlsplit(proxy)
+        auth = None
+        if o.username:
+            credentials = '%s:%s' % (parse.unquote(o.username), parse.unquote(o.password or ''))
+            auth = 'Basic ' + base64.b64encode(credentials.encode('utf-8')).decode('ascii')
+        return o.hostname, o.port or 80, auth
+
+    def connect(self, key):
+        scheme, host, port, proxy = key
+        if scheme == 'https':
+            if self.ssl_context is None:
+                import ssl
+                if hasattr(ssl, 'create_default_context'):
+                    self.ssl_context = ssl.create_default_context()
+                else:
+                    # Python < 3.4: as urllib did there, without verification
+                    self.ssl_context = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
+            if proxy:
+                conn = http.client.HTTPSConnection(proxy[0], proxy[1], timeout=self.timeout, context=self.ssl_context)
+                conn.set_tunnel(host, port, headers={'Proxy-Authorization': proxy[2]} if proxy[2] else None)
+            else:
+                conn = http.client.HTTPSConnection(host, port, timeout=self.timeout, context=self.ssl_context)
+        else:
+            if proxy:
+                conn = http.client.HTTPConnection(proxy[0], proxy[1], timeout=self.timeout)
+            else:
+                conn = http.client.HTTPConnection(host, port, timeout=self.timeout)
+        return conn
+
+    def acquire(self, key):
+        with self.lock:
+            conns = self.idle.get(key)
+            if conns:
+                return conns.pop(), True
+        return self.connect(key), False
+
+    def release(self, key, conn):
+        if conn.sock is None:
+            # Closed by the server (Connection: close) or by http.client
+            return
+        with self.lock:
+            conns = self.idle.setdefault(key, [])
+            if len(conns) < self.max_idle_per_host and sum(map(len, self.idle.values())) < self.max_idle:
+                conns.append(conn)
+                return
+        conn.close()
+
+    def clear(self):
+        with self.lock:
+            idle, self.idle = self.idle, {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+    def request(self, method, url, data, headers):
+        o = parse.urlsplit(url)
+        port = o.port or (443 if o.scheme == 'https' else 80)
+        proxy = self.get_proxy(o.scheme, o.hostname)
+        key = (o.scheme, o.hostname, port, proxy)
+
+        headers = dict(headers)
+        if proxy and o.scheme == 'http':
+            # Absolute-form request target through a plain HTTP proxy
+            selector = parse.urlunsplit((o.scheme, o.netloc, o.path or '/', o.query, ''))
+            if proxy[2]:
+                headers['Proxy-Authorization'] = proxy[2]
+        else:
+            selector = parse.urlunsplit(('', '', o.path or '/', o.query, ''))
+
+        for attempt in range(2):
+            conn, reused = self.acquire(key)
+            try:
+                conn.request(method, selector, body=data, headers=headers)
+                response = conn.getresponse()
+            except (OSError, http.client.HTTPException) as e:
+                conn.close()
+                if reused and attempt == 0:
+                    # The server may have dropped an idle keep-alive connection
+                    continue
+                if isinstance(e, OSError):
+                    raise error.URLError(e)
+                raise
+            return PooledResponse(self, key, conn, response, url)
+
+    def urlopen(self, req, method=None):
+        """Sends a urllib.request.Request (or a URL) and returns the response.
+
+        Follows redirects and raises urllib.error.HTTPError for error
+        statuses, like urllib.request.urlopen().
+        """
+
+        if isinstance(req, str):
+            req = request.Request(req)
+        url = req.full_url
+        if parse.urlsplit(url).scheme not in ('http', 'https'):
+            return request.urlopen(req)
+
+        method = method or req.get_method()
+        data = req.data
+        headers = dict(req.header_items())
+        if 'User-agent' not in headers:
+            headers['User-agent'] = 'Python-urllib/%s' % request.__version__
+        if data is not None and 'Content-type' not in headers:
+            headers['Content-type'] = 'application/x-www-form-urlencoded'
+
+        for _ in range(self.max_redirects + 1):
+            response = self.request(method, url, data, headers)
+            if method == 'HEAD':
+                response.read()
+            location = response.getheader('Location') or response.getheader('URI')
+            if response.status in self.redirect_codes and location:
+                response.read()
+                response.close()
+                url = parse.urljoin(url, location)
+                if response.status == 303 or (response.status in (301, 302) and method not in ('GET', 'HEAD')):
+                    method = 'GET'
+                    data = None
+                    headers = {k: v for k, v in headers.items() if k.lower() not in ('content-length', 'content-type')}
+                continue
+            if response.status >= 400:
+                raise error.HTTPError(url, response.status, response.reason, response.headers, response)
+            return response
+
+        raise error.HTTPError(url, response.status, 'Too many redirects', response.headers, response)
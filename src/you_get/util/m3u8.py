@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+
+"""HLS playlists (RFC 8216): master playlists listing variant streams, and
+media playlists listing the segments of one of them."""
+
+import re
+from urllib.parse import urljoin
+
+_attribute = re.compile(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)')
+
+def parse_attributes(s):
+    """Parses an attribute list such as 'BANDWIDTH=1280000,CODECS="a,b"'
+    into a dict, with quoted strings unquoted."""
+    attributes = {}
+    for name, value in _attribute.findall(s):
+        if value.startswith('"'):
+            value = value[1:-1]
+        attributes[name] = value
+    return attributes
+
+class Variant:
+    """A variant stream of a master playlist."""
+
+    def __init__(self, uri, attributes):
+        self.uri = uri
+        self.attributes = attributes
+        self.bandwidth = int(attributes.get('BANDWIDTH', 0))
+
+class Segment:
+    """A media segment: its URI, the byte range of it to fetch if any, as
+    (offset, length), and the EXT-X-KEY attributes in effect, if any."""
+
+    def __init__(self, uri, duration, sequence, byterange = None, key = None, discontinuity = False):
+        self.uri = uri
+        self.duration = duration
+        self.sequence = sequence
+        self.byterange = byterange
+        self.key = key
+        self.discontinuity = discontinuity
+
+class Playlist:
+    def __init__(self, url):
+        self.url = url
+        self.variants = []
+        self.segments = []
+        self.target_duration = None
+        self.media_sequence = 0
+        self.endlist = False
+
+    @property
+    def is_master(self):
+        return bool(self.variants)
+
+    @property
+    def duration(self):
+        return sum(s.duration for s in self.segments)
+
+def parse(text, url = None, strict = True):
+    """Parses the text of a playlist; relative URIs are resolved against
+    url. Unknown tags are ignored.
+
+    Unless strict, the #EXTM3U header may be missing, as it is from some
+    playlists that extractors build or decode themselves."""
+
+    lines = [line.strip() for line in text.splitlines()]
+    lines = [line for line in lines if line]
+    if lines and lines[0] == '#EXTM3U':
+        lines = lines[1:]
+    elif strict:
+        raise ValueError('not an M3U8 playlist')
+
+    playlist = Playlist(url)
+    resolve = (lambda uri: urljoin(url, uri)) if url else (lambda uri: uri)
+    duration = None
+    byterange = None
+    next_offset = {}
+    key = None
+    discontinuity = False
+    variant = None
+    for line in lines:
+        if line.startswith('#'):
+            tag, _, value = line.partition(':')
+            if tag == '#EXTINF':
+                duration = float(value.split(',')[0])
+            elif tag == '#EXT-X-BYTERANGE':
+                length, _, offset = value.partition('@')
+                byterange = (int(offset) if offset else None, int(length))
+            elif tag == '#EXT-X-KEY':
+                key = parse_attributes(value)
+                if key.get('METHOD', 'NONE') == 'NONE':
+                    key = None
+                elif 'URI' in key:
+                    key['URI'] = resolve(key['URI'])
+            elif tag == '#EXT-X-DISCONTINUITY':
+                discontinuity = True
+            elif tag == '#EXT-X-TARGETDURATION':
+                playlist.target_duration = float(value)
+            elif tag == '#EXT-X-MEDIA-SEQUENCE':
+                playlist.media_sequence = int(value)
+            elif tag == '#EXT-X-ENDLIST':
+                playlist.endlist = True
+            elif tag == '#EXT-X-STREAM-INF':
+                variant = parse_attributes(value)
+        elif variant is not None:
+            playlist.variants.append(Variant(resolve(line), variant))
+            variant = None
+        else:
+            uri = resolve(line)
+            if byterange is not None:
+                offset, length = byterange
+                if offset is None:
+                    # Follows the previous range of the same resource
+                    offset = next_offset.get(uri, 0)
+                next_offset[uri] = offset + length
+                byterange = (offset, length)
+            sequence = playlist.media_sequence + len(playlist.segments)
+            playlist.segments.append(Segment(uri, duration or 0, sequence, byterange, key, discontinuity))
+            duration = None
+            byterange = None
+            discontinuity = False
+    return playlist
+
+def choose_variant(playlist, bandwidth = None):
+    """Returns the variant of a master playlist with the highest bandwidth,
+    or with the highest one not above bandwidth (bits/s) if given, falling
+    back to the lowest one."""
+    variants = sorted(playlist.variants, key = lambda v: v.bandwidth)
+    if bandwidth is not None:
+        fitting = [v for v in variants if v.bandwidth <= bandwidth]
+        return fitting[-1] if fitting else variants[0]
+    return variants[-1]
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+
+import threading
+
+def imap(func, iterable, workers):
+    """Applies func to every item of iterable in up to `workers` threads.
+
+    Results are yielded in the order of the input, each one as soon as it
+    (and every result before it) is ready. Items are pulled from iterable
+    lazily, so it may be an unbounded stream. If func raises, no further
+    items are started and the exception is re-raised in the caller.
+
+    Worker threads are daemonic so that an interrupted caller does not have
+    to wait for in-flight calls to return.
+    """
+
+    items = enumerate(iterable)
+    source_lock = threading.Lock()
+    cond = threading.Condition()
+    results = {}
+    state = {'taken': 0, 'finished': 0, 'stopped': False}
+
+    def worker():
+        try:
+            while not state['stopped']:
+                with source_lock:
+                    if state['stopped']:
+                        return
+                    try:
+                        i, item = next(items)
+                    except StopIteration:
+                        return
+                    except BaseException as e:
+                        state['stopped'] = True
+                        with cond:
+                            results[state['taken']] = (False, e)
+                        return
+                    state['taken'] = i + 1
+                try:
+                    result = (True, func(item))
+                except BaseException as e:
+                    state['stopped'] = True
+                    result = (False, e)
+                with cond:
+                    results[i] = result
+                    cond.notify_all()
+        finally:
+            with cond:
+                state['finished'] += 1
+                cond.notify_all()
+
+    workers = max(1, workers)
+    for _ in range(workers):
+        # Thread() only takes daemon from Python 3.3
+        t = threading.Thread(target=worker)
+        t.daemon = True
+        t.start()
+
+    try:
+        i = 0
+        while True:
+            with cond:
+                while i not in results and state['finished'] < workers:
+                    cond.wait()
+                if i not in results:
+                    return
+                ok, value = results.pop(i)
+            if not ok:
+                raise value
+            yield value
+            i += 1
+    finally:
+        state['stopped'] = True
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+
+import json
+import os
+import shutil
+import threading
+
+_results = {}
+_lock = threading.Lock()
+
+def cache_file():
+    """Path of the file caching the results of detect() across runs."""
+    base = os.getenv('XDG_CACHE_HOME') or os.getenv('LOCALAPPDATA') or \
+        os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'you-get', 'tools.json')
+
+def load_cache(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            cache = json.load(f)
+        return cache if isinstance(cache, dict) else {}
+    except:
+        return {}
+
+def save_cache(path, cache):
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp = '%s.%d' % (path, os.getpid())
+        with open(temp, 'w', encoding='utf-8') as f:
+            json.dump(cache, f)
+        if os.access(path, os.W_OK):
+            os.remove(path) # on Windows rename could fail if destination filepath exists
+        os.rename(temp, path)
+    except:
+        pass # A cache we can't write is just a slower start next time
+
+def which(cmd):
+    """Path of cmd if it is an executable on the PATH, or None."""
+    # shutil.which() only exists from Python 3.3
+    if hasattr(shutil, 'which'):
+        return shutil.which(cmd)
+    exts = os.getenv('PATHEXT', '').split(os.pathsep) if os.name == 'nt' else ['']
+    for dir in os.getenv('PATH', os.defpath).split(os.pathsep):
+        for ext in exts:
+            path = os.path.join(dir, cmd + ext)
+            if os.path.isfile(path) and os.access(path, os.X_OK):
+                return path
+    return None
+
+def detect(cmd, probe):
+    """Returns probe(cmd) for an external command, such as its version, or
+    None if cmd is not on the PATH.
+
+    The result is memoized for the process and cached in cache_file(),
+    keyed by the resolved path, size and mtime of the binary, so that the
+    command is only run again after it has been replaced. probe must
+    return something JSON can store; lists come back as tuples.
+    """
+
+    with _lock:
+        if cmd in _results:
+            return _results[cmd]
+
+        path = which(cmd)
+        if path is None:
+            _results[cmd] = None
+            return None
+        path = os.path.realpath(path)
+        st = os.stat(path)
+        key = {'path': path, 'size': st.st_size, 'mtime': st.st_mtime}
+
+        cache_path = cache_file()
+        cache = load_cache(cache_path)
+        entry = cache.get(cmd)
+        if isinstance(entry, dict) and all(entry.get(k) == v for k, v in key.items()):
+            result = entry.get('result')
+        else:
+            result = probe(cmd)
+            cache[cmd] = dict(key, result=result)
+            save_cache(cache_path, cache)
+
+        if isinstance(result, list):
+            result = tuple(result)
+        _results[cmd] = result
+        return result
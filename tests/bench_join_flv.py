@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+
+"""Micro-benchmark of the FLV tag codec in processor.join_flv.
+
+Builds a synthetic FLV of small tags in memory, then times read_tag() and
+write_tag() against the byte-at-a-time codec they replaced, and concat_flv()
+over two copies of the file on disk.
+
+    python tests/bench_join_flv.py [TAGS]
+"""
+
+import os
+import struct
+import sys
+import tempfile
+import time
+from io import BytesIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'src'))
+
+from you_get.processor import join_flv
+
+def legacy_read_tag(stream):
+    header = stream.read(15)
+    if len(header) == 4:
+        return
+    x = struct.unpack('>IBBBBBBBBBBB', header)
+    previous_tag_size = x[0]
+    data_type = x[1]
+    body_size = (x[2] << 16) | (x[3] << 8) | x[4]
+    timestamp = (x[5] << 16) | (x[6] << 8) | x[7]
+    timestamp += x[8] << 24
+    assert x[9:] == (0, 0, 0)
+    body = stream.read(body_size)
+    return (data_type, timestamp, body_size, body, previous_tag_size)
+
+def legacy_write_tag(stream, tag):
+    data_type, timestamp, body_size, body, previous_tag_size = tag
+    write_byte = join_flv.write_byte
+    join_flv.write_uint(stream, previous_tag_size)
+    write_byte(stream, data_type)
+    write_byte(stream, body_size>>16 & 0xff)
+    write_byte(stream, body_size>>8  & 0xff)
+    write_byte(stream, body_size     & 0xff)
+    write_byte(stream, timestamp>>16 & 0xff)
+    write_byte(stream, timestamp>>8  & 0xff)
+    write_byte(stream, timestamp     & 0xff)
+    write_byte(stream, timestamp>>24 & 0xff)
+    stream.write(b'\0\0\0')
+    stream.write(body)
+
+def make_flv(tags):
+    """Returns an FLV of `tags` audio/video tags of 16 to 400 bytes."""
+    out = BytesIO()
+    join_flv.write_flv_header(out)
+    meta = join_flv.ECMAObject(1)
+    meta.put('duration', tags * 0.02)
+    join_flv.write_meta_tag(out, 'onMetaData', meta)
+    previous_tag_size = out.tell() - 13
+    for i in range(tags):
+        body = bytes(16 + i * 7 % 384)
+        join_flv.write_tag(out, (8 + i % 2, i * 20, len(body), body, previous_tag_size))
+        previous_tag_size = 11 + len(body)
+    join_flv.write_uint(out, previous_tag_size)
+    return out.getvalue()
+
+def read_all(read_tag, data):
+    stream = BytesIO(data)
+    join_flv.read_flv_header(stream)
+    tags = []
+    while True:
+        tag = read_tag(stream)
+        if not tag:
+            return tags
+        tags.append(tag)
+
+def write_all(write_tag, tags):
+    out = BytesIO()
+    for tag in tags:
+        write_tag(out, tag)
+    return out.getvalue()
+
+def timed(func, *args):
+    best = None
+    for _ in range(3):
+        started = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    data = make_flv(n)
+    print('%d tags, %.1f MB' % (n, len(data) / 1e6))
+
+    legacy, tags = timed(read_all, legacy_read_tag, data)
+    current, _ = timed(read_all, join_flv.read_tag, data)
+    print('read_tag   %7.3f s -> %7.3f s  (%.1fx)' % (legacy, current, legacy / current))
+
+    legacy, expected = timed(write_all, legacy_write_tag, tags)
+    current, result = timed(write_all, join_flv.write_tag, tags)
+    assert result == expected
+    print('write_tag  %7.3f s -> %7.3f s  (%.1fx)' % (legacy, current, legacy / current))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        parts = []
+        for i in range(2):
+            parts.append(os.path.join(tmp, 'part%d.flv' % i))
+            with open(parts[-1], 'wb') as f:
+                f.write(data)
+        elapsed, _ = timed(join_flv.concat_flv, parts, os.path.join(tmp, 'out.flv'))
+        print('concat_flv %7.3f s  (%.0f MB/s)' % (elapsed, 2 * len(data) / 1e6 / elapsed))
+
+if __name__ == '__main__':
+    main()
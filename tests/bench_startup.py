@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+
+"""Measures the import cost of resolving a single URL to its extractor.
+
+Runs `python -X importtime` in a fresh interpreter for each case and reports
+the wall time of the imports, the sum of the per-module times logged by
+-X importtime (which doesn't see modules loaded through importlib, only
+what they import in turn) and the number of extractor modules loaded. The
+"eager" case imports every extractor, as url_to_module() used to do, for
+comparison.
+
+    python tests/bench_startup.py [URL] [-n RUNS]
+"""
+
+import os
+import re
+import subprocess
+import sys
+
+src = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'src')
+
+cases = [
+    ('lazy', 'from you_get.common import url_to_module; url_to_module(%r)'),
+    ('eager', 'import you_get.extractors as e; [getattr(e, m) for m in e.__all__]; '
+              'from you_get.common import url_to_module; url_to_module(%r)'),
+]
+
+wrapper = """import sys, time
+started = time.perf_counter()
+%s
+print(time.perf_counter() - started)
+print(len([m for m in sys.modules if m.startswith('you_get.extractors.')]))
+"""
+
+def measure(code):
+    """Returns (wall time in ms, -X importtime total in ms, number of
+    extractor modules).
+    """
+
+    env = dict(os.environ, PYTHONPATH=src)
+    p = subprocess.run([sys.executable, '-X', 'importtime', '-c', wrapper % code],
+                       env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                       universal_newlines=True, check=True)
+    elapsed, extractors = p.stdout.split()
+    logged = 0
+    for line in p.stderr.splitlines():
+        m = re.match(r'import time:\s+(\d+) \|', line)
+        if m:
+            logged += int(m.group(1))
+    return float(elapsed) * 1000, logged / 1000, int(extractors)
+
+def main():
+    args = sys.argv[1:]
+    runs = 5
+    if '-n' in args:
+        i = args.index('-n')
+        runs = int(args[i + 1])
+        del args[i:i + 2]
+    url = args[0] if args else 'http://www.youtube.com/watch?v=pzKerr0JIPA'
+
+    print('%-6s %10s %14s %11s' % ('', 'wall', 'importtime', 'extractors'))
+    for name, code in cases:
+        results = [measure(code % url) for _ in range(runs)]
+        print('%-6s %7.1f ms %11.1f ms %11d' % (name, min(r[0] for r in results), min(r[1] for r in results), results[0][2]))
+
+if __name__ == '__main__':
+    main()
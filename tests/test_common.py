@@ -1,11 +1,404 @@
 #!/usr/bin/env python
 
+import io
+import os
+import sys
+import tempfile
+import threading
+import time
 import unittest
+from unittest import mock
+from http.server import HTTPServer, BaseHTTPRequestHandler
 
 from you_get.common import *
+from you_get import common
+from you_get.extractor import VideoExtractor
+from you_get.util.archive import Archive
+from you_get.util.connpool import PooledResponse
+from .test_processor import make_flv
+from .test_util import KeepAliveHandler, encrypt_cbc, range_handler, start_server
 
 class TestCommon(unittest.TestCase):
     
     def test_match1(self):
         self.assertEqual(match1('http://youtu.be/1234567890A', r'youtu.be/([^/]+)'), '1234567890A')
         self.assertEqual(match1('http://youtu.be/1234567890A', r'youtu.be/([^/]+)', r'youtu.(\w+)'), ['1234567890A', 'be'])
+
+    def test_read_urls(self):
+        self.assertEqual(list(read_urls(['# comment\n', '\n', ' http://youtu.be/1234567890A \n', 'youku.com\n'])), ['http://youtu.be/1234567890A', 'youku.com'])
+
+    def test_url_to_module_is_lazy(self):
+        import subprocess, sys
+        code = ('import sys; from you_get.common import url_to_module; '
+                'm, url = url_to_module("http://youtu.be/1234567890A"); '
+                'print(m.__name__, len([n for n in sys.modules if n.startswith("you_get.extractors.")]))')
+        out = subprocess.check_output([sys.executable, '-c', code], universal_newlines=True)
+        self.assertEqual(out.split(), ['you_get.extractors.youtube', '1'])
+
+    def test_extractor_exports(self):
+        from you_get import extractors
+        from you_get.extractors.bilibili import get_srt_xml
+        from you_get.extractors.youtube import YouTube
+        self.assertIs(extractors.YouTube, YouTube)
+        self.assertIs(extractors.get_srt_xml, get_srt_xml)
+        self.assertEqual(extractors.letvcloud_download.__module__, 'you_get.extractors.letv')
+        names = {}
+        exec('from you_get.extractors import *', names)
+        self.assertTrue(callable(names['sina_download_by_vid']))
+        self.assertIn('Youku', names)
+        with self.assertRaises(AttributeError):
+            extractors.youtube_download
+
+    def test_chunked_skips_existing(self):
+        with tempfile.TemporaryDirectory() as tmp, \
+             mock.patch('you_get.common.url_save_parts') as save_parts:
+            for ext in ('mkv', 'ts'):
+                path = os.path.join(tmp, 'video.' + ext)
+                open(path, 'wb').close()
+                download_urls_chunked(['http://127.0.0.1:1/0.ts', 'http://127.0.0.1:1/1.ts'], 'video', 'ts', 100,
+                                      output_dir = tmp)
+                os.remove(path)
+            self.assertFalse(save_parts.called)
+
+    def test_live_flv_paths(self):
+        with tempfile.TemporaryDirectory() as tmp, \
+             mock.patch('you_get.common.split_time', 60), \
+             mock.patch('you_get.common.live_retries', float('inf')), \
+             mock.patch('you_get.processor.record_flv.record_flv') as record, \
+             mock.patch('time.strftime', return_value='20150101-000000'):
+            download_live_flv('http://127.0.0.1:1/live.flv', 'live', output_dir = tmp)
+            path_for = record.call_args[0][1]
+            self.assertEqual(record.call_args[0][4], float('inf'))
+            paths = []
+            for i in range(3):
+                paths.append(path_for())
+                open(paths[-1] + '.download', 'wb').close()
+            self.assertEqual([os.path.basename(p) for p in paths],
+                             ['live 20150101-000000.flv', 'live 20150101-000000 (2).flv',
+                              'live 20150101-000000 (3).flv'])
+
+    def serve_range(self, **attrs):
+        handler = range_handler(**attrs)
+        server, base = start_server(handler)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return handler, base
+
+    def assertSaved(self, path, data):
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), data)
+        self.assertEqual(os.listdir(os.path.dirname(path)), [os.path.basename(path)])
+
+    def test_url_save_parts_failure(self):
+        failing = threading.Event()
+        def save(url, filepath, bar, **kwargs):
+            i = int(url[-1])
+            if i == 1:
+                failing.wait(5)
+                raise IOError('part 1 failed')
+            if i == 2:
+                failing.set()
+            time.sleep(0.2)
+            with open(filepath, 'wb') as f:
+                f.write(b'part %d' % i)
+        with tempfile.TemporaryDirectory() as tmp, \
+             mock.patch('you_get.common.url_save', save), \
+             mock.patch.object(common, 'jobs', 3):
+            urls = ['http://127.0.0.1:1/%d' % i for i in range(6)]
+            paths = [os.path.join(tmp, '%d.flv' % i) for i in range(6)]
+            self.assertRaises(IOError, url_save_parts, urls, paths, DummyProgressBar())
+            # Part 2 was in flight when part 1 failed: it is finished, and
+            # no part is started after the failure
+            self.assertEqual(sorted(os.listdir(tmp)), ['0.flv', '2.flv'])
+
+    def test_download_urls_merge_failure(self):
+        # Merged as they arrive without ffmpeg; the parts saved are kept
+        # until the merge is complete
+        def save(url, filepath, bar, **kwargs):
+            if url.endswith('fail'):
+                raise IOError('part failed')
+            make_flv(filepath, 10)
+        with tempfile.TemporaryDirectory() as tmp, \
+             mock.patch('you_get.common.url_save', save), \
+             mock.patch('you_get.processor.ffmpeg.has_ffmpeg_installed', return_value = False), \
+             mock.patch.object(common, 'show_progress', False):
+            urls = ['http://127.0.0.1:1/0', 'http://127.0.0.1:1/fail']
+            self.assertRaises(IOError, download_urls, urls, 'video', 'flv', 1000, output_dir = tmp)
+            self.assertIn('video[00].flv', os.listdir(tmp))
+            self.assertNotIn('video.flv', os.listdir(tmp))
+
+            urls[1] = 'http://127.0.0.1:1/1'
+            download_urls(urls, 'video', 'flv', 1000, output_dir = tmp)
+            self.assertEqual(os.listdir(tmp), ['video.flv'])
+
+    def test_url_stream_reconnect(self):
+        data = bytes(range(200))
+        def response(status, body, length):
+            r = mock.Mock(status = status, headers = {'content-length': str(length)})
+            r.read.side_effect = io.BytesIO(body).read
+            return r
+        # The first connection drops halfway
+        responses = [response(200, data[:100], 200), response(206, data[100:], 100)]
+        with mock.patch('you_get.common.urlopen', side_effect = responses) as urlopen:
+            with UrlStream('http://127.0.0.1:1/a', None) as stream:
+                self.assertEqual(stream.read(150), data[:150])
+                self.assertEqual(stream.read(), data[150:])
+            self.assertEqual(urlopen.call_args[0][0].headers['Range'], 'bytes=100-')
+        self.assertTrue(responses[0].close.called)
+        self.assertTrue(responses[1].close.called)
+
+    def test_url_meta_cache(self):
+        handler, base = self.serve_range()
+        with mock.patch.dict(common.url_meta_cache, clear = True), \
+             mock.patch.object(common, 'url_meta_cache_size', 2):
+            url_meta(base + '/a')
+            url_meta(base + '/a')
+            self.assertEqual(handler.requests, [('HEAD', None)])
+            # Probed again with the headers of faker
+            url_meta(base + '/a', faker = True)
+            self.assertEqual(len(handler.requests), 2)
+            # Only the 2 most recently used are kept
+            url_meta(base + '/b')
+            url_meta(base + '/a', faker = True)
+            url_meta(base + '/a')
+            self.assertEqual(len(handler.requests), 4)
+            self.assertEqual(list(common.url_meta_cache), [(base + '/a', True), (base + '/a', False)])
+
+    def test_url_save_resume(self):
+        handler, base = self.serve_range()
+        with tempfile.TemporaryDirectory() as tmp, mock.patch.dict(common.url_meta_cache, clear = True):
+            # 206: the rest is appended
+            path = os.path.join(tmp, 'a.mp4')
+            with open(path + '.download', 'wb') as f:
+                f.write(handler.data[:1000])
+            url_save(base + '/a', path, None)
+            self.assertSaved(path, handler.data)
+            self.assertEqual(handler.requests[-1], ('GET', 'bytes=1000-'))
+            os.remove(path)
+
+            # 200: the file has changed, and grown, since it was probed
+            meta = url_meta(base + '/b')
+            meta['etag'], meta['content-length'] = '"v0"', str(len(handler.data) - 500)
+            with open(path + '.download', 'wb') as f:
+                f.write(handler.data[:1000])
+            url_save(base + '/b', path, None)
+            self.assertSaved(path, handler.data)
+            self.assertEqual(handler.requests[-1], ('GET', 'bytes=1000-'))
+
+    def test_url_save_ranged(self):
+        data = bytes(range(256)) * 4096 * 4
+        handler, base = self.serve_range(data = data)
+        with tempfile.TemporaryDirectory() as tmp, mock.patch.dict(common.url_meta_cache, clear = True):
+            # 206: four ranges of 1 MiB
+            path = os.path.join(tmp, 'a.mp4')
+            url_save_ranged(base + '/a', path, None)
+            self.assertSaved(path, data)
+            ranges = sorted(r for m, r in handler.requests if m == 'GET')
+            self.assertEqual(ranges, ['bytes=%d-%d' % (i << 20, ((i + 1) << 20) - 1) for i in range(4)])
+            os.remove(path)
+
+            # 200 after an ETag mismatch: start over from 0
+            url_meta(base + '/b')['etag'] = '"v0"'
+            del handler.requests[:]
+            url_save_ranged(base + '/b', path, None)
+            self.assertSaved(path, data)
+            self.assertEqual(handler.requests[-1], ('GET', None))
+
+    def test_url_save_ranged_failure(self):
+        data = bytes(range(256)) * 4096 * 4
+        handler, base = self.serve_range(data = data)
+        real_urlopen = common.urlopen
+        returned = threading.Event()
+        late = []
+        def urlopen(req):
+            range = req.headers.get('Range')
+            if range == 'bytes=0-1048575':
+                time.sleep(0.1)
+                raise IOError('range failed')
+            response = real_urlopen(req)
+            read = response.read
+            def slow_read(n = None):
+                if returned.is_set():
+                    late.append(range)
+                time.sleep(0.05)
+                return read(n)
+            response.read = slow_read
+            return response
+        with tempfile.TemporaryDirectory() as tmp, \
+             mock.patch.dict(common.url_meta_cache, clear = True), \
+             mock.patch('you_get.common.urlopen', urlopen):
+            path = os.path.join(tmp, 'a.mp4')
+            self.assertRaises(IOError, url_save_ranged, base + '/a', path, None)
+            returned.set()
+            # The other ranges stopped before the error was raised, and
+            # left their progress to resume from
+            time.sleep(0.3)
+            self.assertEqual(late, [])
+            self.assertEqual(sorted(os.listdir(tmp)), ['a.mp4.download', 'a.mp4.download.ranges'])
+
+    def test_url_save_ranged_unsupported(self):
+        handler, base = self.serve_range(ranges = False)
+        with tempfile.TemporaryDirectory() as tmp, mock.patch.dict(common.url_meta_cache, clear = True):
+            path = os.path.join(tmp, 'a.mp4')
+            with open(path + '.download', 'wb') as f:
+                f.write(b'x' * 1000)
+            url_save_ranged(base + '/a', path, None)
+            self.assertSaved(path, handler.data)
+            self.assertEqual(handler.requests[1:], [('GET', 'bytes=0-0'), ('GET', 'bytes=1000-')])
+
+    @unittest.skipIf(sys.version_info < (3, 5), 'util.aio needs Python 3.5')
+    def test_url_save_aio(self):
+        # A host that refuses HEAD is probed with a Range request first
+        handler = range_handler(head = False)
+        server, base = start_server(handler)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        with tempfile.TemporaryDirectory() as tmp, \
+             mock.patch.dict(common.url_meta_cache, clear = True), \
+             mock.patch.dict(common.probe_methods, clear = True):
+            paths = [os.path.join(tmp, 'a.mp4'), os.path.join(tmp, 'b.mp4')]
+            url_save_aio([base + '/a', base + '/b'], paths, DummyProgressBar())
+            for path in paths:
+                with open(path, 'rb') as f:
+                    self.assertEqual(f.read(), handler.data)
+            self.assertEqual(common.probe_methods, {base[7:]: 'Range'})
+        self.assertIn(('GET', 'bytes=0-0'), handler.requests)
+        self.assertEqual(handler.requests.count(('GET', None)), 2)
+
+    def test_download_hls(self):
+        key = bytes(range(16))
+        segments = [bytes([i]) * (1000 + i) for i in range(5)]
+        files = {'/key': key}
+        playlist = ['#EXTM3U', '#EXT-X-MEDIA-SEQUENCE:3']
+        for i, segment in enumerate(segments):
+            if i == 1:
+                playlist.append('#EXT-X-KEY:METHOD=AES-128,URI="/key"')
+            if i == 3:
+                playlist.append('#EXT-X-KEY:METHOD=AES-128,URI="/key",IV=0x0102')
+            if i == 4:
+                playlist.append('#EXT-X-KEY:METHOD=NONE')
+            if i in (1, 2, 3):
+                # Without IV, the IV is the media sequence number
+                iv = 0x0102 if i == 3 else 3 + i
+                segments[i], files['/%d.ts' % i] = encrypt_cbc(key, iv.to_bytes(16, 'big'), segment)
+            else:
+                files['/%d.ts' % i] = segment
+            playlist += ['#EXTINF:1,', '%d.ts' % i]
+        files['/index.m3u8'] = '\n'.join(playlist).encode()
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/octet-stream')
+                self.end_headers()
+                self.wfile.write(files[self.path])
+            def log_message(self, *args):
+                pass
+
+        server = HTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        jobs = common.jobs
+        try:
+            common.jobs = 3
+            with tempfile.TemporaryDirectory() as output_dir:
+                download_hls('http://127.0.0.1:%d/index.m3u8' % server.server_port, 'hls', output_dir)
+                with open(os.path.join(output_dir, 'hls.ts'), 'rb') as f:
+                    self.assertEqual(f.read(), b''.join(segments))
+
+            # A playlist given by an extractor, without #EXTM3U, and parts
+            # left unmerged
+            content = files['/index.m3u8'].decode()[len('#EXTM3U'):]
+            with tempfile.TemporaryDirectory() as output_dir:
+                download_hls('http://127.0.0.1:%d/index.m3u8' % server.server_port, 'hls', output_dir,
+                             content = content, merge = False)
+                self.assertEqual(sorted(os.listdir(output_dir)), ['hls[%02d].ts' % i for i in range(5)])
+                for i, segment in enumerate(segments):
+                    with open(os.path.join(output_dir, 'hls[%02d].ts' % i), 'rb') as f:
+                        self.assertEqual(f.read(), segment)
+        finally:
+            common.jobs = jobs
+            server.shutdown()
+            server.server_close()
+
+    def test_archive(self):
+        calls = []
+        class Site(VideoExtractor):
+            name = 'Site'
+            stream_types = [{'id': 'hd'}]
+            def get_vid_from_url(url):
+                return url.rsplit('/', 1)[-1]
+            def prepare(self, **kwargs):
+                calls.append(self.vid)
+                self.vid = self.vid or Site.get_vid_from_url(self.url)
+                self.title = 'Video %s' % self.vid
+                self.streams = {'hd': {'container': 'flv', 'size': 0, 'src': ['http://example.com/v.flv']}}
+
+        with tempfile.TemporaryDirectory() as tmp:
+            common.archive = Archive(os.path.join(tmp, 'archive.db'))
+            try:
+                with mock.patch('you_get.extractor.download_urls') as download_urls, \
+                     mock.patch('builtins.print'):
+                    Site().download_by_url('http://example.com/1', output_dir=tmp, merge=True)
+                    Site().download_by_url('http://example.com/1', output_dir=tmp, merge=True)
+                    Site().download_by_vid('1', output_dir=tmp, merge=True)
+                    Site().download_by_vid('2', output_dir=tmp, merge=True)
+                self.assertEqual(calls, [None, '2'])
+                self.assertEqual(download_urls.call_count, 2)
+                self.assertIn((Site.__module__.rsplit('.', 1)[-1], '1'), common.archive)
+            finally:
+                common.archive.close()
+                common.archive = None
+
+    def test_installed_opener(self):
+        server, base = start_server(KeepAliveHandler)
+        proxies = common.connection_pool.proxies
+        try:
+            common.connection_pool.set_proxies({})
+            # An extractor logging in with a cookie opener, as nicovideo does
+            request.install_opener(request.build_opener(request.HTTPCookieProcessor()))
+            get_content(base + '/login')
+            self.assertEqual(get_content(base + '/a').split()[2], 'session=42')
+
+            # A proxy opener leaves requests to the pool, without the session
+            unset_proxy()
+            with urlopen(base + '/a') as response:
+                self.assertIsInstance(response, PooledResponse)
+            self.assertEqual(get_content(base + '/a').split()[2], 'None')
+        finally:
+            request.install_opener(None)
+            common.connection_pool.set_proxies(proxies)
+            common.connection_pool.clear()
+            server.shutdown()
+            server.server_close()
+
+    def test_batch_same_extractor(self):
+        from you_get.extractors import youku
+        barrier = threading.Barrier(2, timeout=5)
+        proxies = []
+        def prepare(self, **kwargs):
+            self.vid = self.vid or youku.Youku.get_vid_from_url(self.url)
+            proxies.append(common.connection_pool.get_proxy('http', 'example.com'))
+            # Both downloads are in the extractor at the same time
+            barrier.wait()
+            self.title = 'Video %s' % self.vid
+            self.streams = {'hd2': {'container': 'flv', 'size': 1, 'src': ['http://example.com/%s.flv' % self.vid]}}
+
+        downloads = []
+        def download_urls(urls, title, *args, **kwargs):
+            downloads.append((title, urls))
+
+        log_file = io.StringIO()
+        with mock.patch.object(youku.Youku, 'prepare', prepare), \
+             mock.patch.object(youku.Youku, 'extract', lambda self, **kwargs: None), \
+             mock.patch('you_get.extractor.download_urls', download_urls), \
+             mock.patch('builtins.print'):
+            failed = download_batch(youku.download, youku.download_playlist,
+                                    ['v.youku.com/v_show/id_A.html', 'v.youku.com/v_show/id_B.html'],
+                                    False, log_file, workers=2, output_dir='.', merge=True,
+                                    extractor_proxy='127.0.0.1:8087')
+        self.assertEqual(failed, 0, log_file.getvalue())
+        self.assertEqual(sorted(downloads), [('Video A', ['http://example.com/A.flv']),
+                                             ('Video B', ['http://example.com/B.flv'])])
+        self.assertEqual(proxies, [('127.0.0.1', 8087, None)] * 2)
+        # The extractor proxy was only ever set for the batch threads
+        self.assertIsNone(getattr(common.connection_pool.local, 'proxies', None))
@@ -0,0 +1,615 @@
+#!/usr/bin/env python
+
+import os
+import struct
+import tempfile
+import unittest
+from io import BytesIO
+from unittest import mock
+
+from you_get.processor import join_flv, join_mp4, join_ts, record_flv
+
+def make_flv(path, tags, keyframe_interval=5):
+    """Writes an FLV of alternating video/audio tags, 40 ms apart."""
+    with open(path, 'wb') as f:
+        join_flv.write_flv_header(f)
+        meta = join_flv.ECMAObject(2)
+        meta.put('duration', tags * 0.04)
+        meta.put('width', 640.0)
+        join_flv.write_meta_tag(f, 'onMetaData', meta)
+        previous_tag_size = f.tell() - 13
+        for i in range(tags):
+            if i % 2 == 0:
+                frame_type = 1 if i % (2 * keyframe_interval) == 0 else 2
+                data_type, body = 9, bytes([frame_type << 4 | 7]) + bytes(50)
+            else:
+                data_type, body = 8, bytes([0xaf]) + bytes(20)
+            join_flv.write_tag(f, (data_type, i * 40, len(body), body, previous_tag_size))
+            previous_tag_size = 11 + len(body)
+        join_flv.write_uint(f, previous_tag_size)
+
+def read_flv(path):
+    with open(path, 'rb') as f:
+        meta_type, meta = join_flv.read_flv_part(f)
+        tags = []
+        while True:
+            tag = join_flv.read_tag(f)
+            if not tag:
+                return meta, tags
+            tags.append(tag)
+
+class TestJoinFlv(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.parts = []
+        for i in range(3):
+            self.parts.append(os.path.join(self.tmp.name, 'part%d.flv' % i))
+            make_flv(self.parts[-1], 100)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_concat_flv(self):
+        output = join_flv.concat_flv(iter(self.parts), os.path.join(self.tmp.name, 'out.flv'))
+        meta, tags = read_flv(output)
+        self.assertEqual(len(tags), 300)
+        self.assertAlmostEqual(meta.get('duration'), 12.0)
+        self.assertEqual(meta.get('width'), 640.0)
+        self.assertEqual(meta.get('filesize'), os.path.getsize(output))
+        timestamps = [tag[1] for tag in tags]
+        self.assertEqual(timestamps, sorted(timestamps))
+        for previous, tag in zip(tags, tags[1:]):
+            self.assertEqual(tag[4], 11 + previous[2])
+
+        keyframes = meta.get('keyframes')
+        self.assertEqual(len(keyframes['times']), 30)
+        with open(output, 'rb') as f:
+            for t, position in zip(keyframes['times'], keyframes['filepositions']):
+                # Each position is the start of a tag, after PreviousTagSize
+                f.seek(int(position) - 4)
+                data_type, timestamp, body_size, body, previous_tag_size = join_flv.read_tag(f)
+                self.assertTrue(join_flv.is_keyframe(data_type, body))
+                self.assertEqual(timestamp, round(t * 1000))
+        self.assertEqual(meta.get('lastkeyframetimestamp'), keyframes['times'][-1])
+
+    def test_concat_flv_keyframe_overflow(self):
+        capacity = join_flv.keyframe_capacity
+        join_flv.keyframe_capacity = 8
+        try:
+            output = join_flv.concat_flv(self.parts, os.path.join(self.tmp.name, 'out.flv'))
+        finally:
+            join_flv.keyframe_capacity = capacity
+        meta, tags = read_flv(output)
+        self.assertEqual(len(tags), 300)
+        self.assertLessEqual(len(meta.get('keyframes')['times']), 8)
+
+    def test_concat_flv_remove(self):
+        # Parts are only deleted once the output is complete
+        output = os.path.join(self.tmp.name, 'out.flv')
+        missing = os.path.join(self.tmp.name, 'missing.flv')
+        self.assertRaises(OSError, join_flv.concat_flv, self.parts + [missing], output, remove=True)
+        self.assertEqual(sorted(os.listdir(self.tmp.name)),
+                         ['out.flv.download', 'part0.flv', 'part1.flv', 'part2.flv'])
+        join_flv.concat_flv(self.parts, output, remove=True)
+        self.assertEqual(os.listdir(self.tmp.name), ['out.flv'])
+
+def make_live_flv(frames, start=0, cut=False):
+    """Returns a live FLV stream: meta and sequence headers, then alternating
+    video/audio tags 20 ms apart from start, with a keyframe every second;
+    with cut set, the stream stops in the middle of its last tag."""
+    stream = BytesIO()
+    join_flv.write_flv_header(stream)
+    meta = join_flv.ECMAObject(1)
+    meta.put('width', 640.0)
+    join_flv.write_meta_tag(stream, 'onMetaData', meta)
+    previous_tag_size = stream.tell() - 13
+    tags = [(9, 0, bytes([0x17, 0]) + b'avcC'), (8, 0, bytes([0xaf, 0]) + b'asc')]
+    for i in range(frames):
+        if i % 2 == 0:
+            frame_type = 1 if i % 50 == 0 else 2
+            tags.append((9, start + i * 20, bytes([frame_type << 4 | 7, 1]) + bytes(50)))
+        else:
+            tags.append((8, start + i * 20, bytes([0xaf, 1]) + bytes(20)))
+    for data_type, timestamp, body in tags:
+        join_flv.write_tag(stream, (data_type, timestamp, len(body), body, previous_tag_size))
+        previous_tag_size = 11 + len(body)
+    return stream.getvalue()[:-10] if cut else stream.getvalue()
+
+class TestRecordFlv(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.delay = record_flv.retry_delay
+        record_flv.retry_delay = 0
+
+    def tearDown(self):
+        record_flv.retry_delay = self.delay
+        self.tmp.cleanup()
+
+    def record(self, streams, **kwargs):
+        streams = iter(streams)
+        def open_stream():
+            try:
+                return BytesIO(next(streams))
+            except StopIteration:
+                raise OSError('offline')
+        names = iter(range(100))
+        path_for = lambda: os.path.join(self.tmp.name, '%d.flv' % next(names))
+        with mock.patch('builtins.print'):
+            return record_flv.record_flv(open_stream, path_for, retries=2, **kwargs)
+
+    def test_reconnect(self):
+        # The server restarts its timestamps on reconnection; an empty
+        # response doesn't stop the recording
+        paths = self.record([make_live_flv(300, 5000, cut=True), b'', make_live_flv(200)])
+        self.assertEqual(len(paths), 1)
+        meta, tags = read_flv(paths[0])
+        self.assertEqual(meta.get('width'), 640.0)
+        self.assertEqual(meta.get('filesize'), os.path.getsize(paths[0]))
+        # Sequence headers come once, and the lost tag is dropped
+        self.assertEqual([tag[3][1] for tag in tags[:3]], [0, 0, 1])
+        self.assertEqual(len(tags), 2 + 299 + 200)
+        timestamps = [tag[1] for tag in tags[2:]]
+        self.assertEqual(timestamps[:299], [i * 20 for i in range(299)])
+        self.assertEqual(timestamps[299:], [298 * 20 + 40 + i * 20 for i in range(200)])
+        self.assertAlmostEqual(meta.get('duration'), timestamps[-1] / 1000)
+
+    def test_split(self):
+        paths = self.record([make_live_flv(500)], split_time=2)
+        self.assertEqual(len(paths), 5)
+        for path in paths:
+            meta, tags = read_flv(path)
+            self.assertEqual([tag[3][1] for tag in tags[:2]], [0, 0])
+            self.assertTrue(join_flv.is_keyframe(tags[2][0], tags[2][3]))
+            self.assertEqual(tags[2][1], 0)
+            self.assertEqual(len(tags), 2 + 100)
+            self.assertAlmostEqual(meta.get('duration'), 1.98)
+
+        paths = self.record([make_live_flv(500)], split_size=2000)
+        self.assertEqual(len(paths), 10)
+
+##################################################
+# MP4
+##################################################
+
+def atom(type, body):
+    return struct.pack('>I', 8 + len(body)) + type + body
+def full(type, body, value=0):
+    return atom(type, struct.pack('>I', value) + body)
+
+def sample_bytes(part, track, index, size):
+    unit = struct.pack('>HHI', part, track, index)
+    return (unit * (size // 8 + 1))[:size]
+
+def make_mp4(part, video_samples=23, audio_samples=37, video_per_chunk=5, audio_per_chunk=8, moov_last=False, exotic=False,
+             sync_tables=True):
+    """Returns the bytes of an MP4 (ftyp, moov, mdat, or ftyp, mdat, moov
+    with moov_last) with an avc1 and an mp4a track whose chunks are
+    interleaved in mdat.
+
+    exotic adds a text track with a tx3g sample entry, writes the traks of
+    odd parts in reverse order, the audio sizes as stz2, sdtp and sbgp for
+    the video, and a uuid atom after ftyp. Without sync_tables, the video
+    has no stss, ctts or sdtp."""
+    tracks = [
+        dict(handler=b'vide', n=video_samples, per_chunk=video_per_chunk, duration=1000, timescale=25000,
+             sizes=[100 + (i * 37 + part * 11) % 900 for i in range(video_samples)]),
+        dict(handler=b'soun', n=audio_samples, per_chunk=audio_per_chunk, duration=1024, timescale=44100,
+             sizes=[20 + (i * 13 + part) % 200 for i in range(audio_samples)]),
+    ]
+    if exotic:
+        tracks.append(dict(handler=b'text', n=3 + part, per_chunk=1, duration=25000, timescale=25000,
+                           sizes=[10 + i for i in range(3 + part)]))
+    # Chunks: list of (track, first sample, count), interleaved
+    chunk_lists = []
+    for t, tr in enumerate(tracks):
+        chunk_lists.append([(t, s, min(tr['per_chunk'], tr['n'] - s)) for s in range(0, tr['n'], tr['per_chunk'])])
+    order = []
+    for i in range(max(map(len, chunk_lists))):
+        for cl in chunk_lists:
+            if i < len(cl):
+                order.append(cl[i])
+
+    def build(mdat_start):
+        payload = b''
+        offsets = [[] for _ in tracks]
+        for t, first, count in order:
+            offsets[t].append(mdat_start + 8 + len(payload))
+            for i in range(first, first + count):
+                payload += sample_bytes(part, t, i, tracks[t]['sizes'][i])
+        traks = []
+        for t, tr in enumerate(tracks):
+            dur = tr['n'] * tr['duration']
+            tkhd = full(b'tkhd', struct.pack('>IIII I', 0, 0, t + 1, 0, dur * 1000 // tr['timescale']) + bytes(8) + struct.pack('>HHHH', 0, 0, 0, 0) + bytes(36) + struct.pack('>II', 640 << 16, 360 << 16), 7)
+            mdhd = full(b'mdhd', struct.pack('>IIII', 0, 0, tr['timescale'], dur) + struct.pack('>HH', 0x55c4, 0))
+            hdlr = full(b'hdlr', struct.pack('>IIIII', 0, struct.unpack('>I', tr['handler'])[0], 0, 0, 0) + b'Track\0')
+            if t == 0:
+                mhd = full(b'vmhd', struct.pack('>HHHH', 0, 0, 0, 0), 1)
+                entry = atom(b'avc1', bytes(6) + struct.pack('>H', 1) + bytes(16) + struct.pack('>HHII', 640, 360, 72 << 16, 72 << 16) + bytes(4) + struct.pack('>HB', 1, 0) + bytes(31) + struct.pack('>H', 24) + b'\xff\xff' + atom(b'avcC', b'\x01\x64\x00\x1f\xff\xe1'))
+            elif t == 2:
+                mhd = full(b'nmhd', b'')
+                entry = atom(b'tx3g', bytes(6) + struct.pack('>H', 1) + bytes(30))
+            else:
+                mhd = full(b'smhd', struct.pack('>HH', 0, 0))
+                entry = atom(b'mp4a', bytes(6) + struct.pack('>H', 1) + bytes(8) + struct.pack('>HH', 2, 16) + bytes(4) + struct.pack('>H', 44100) + bytes(2) + full(b'esds', b'\x03\x19\x00\x00\x00'))
+            stsd = full(b'stsd', struct.pack('>I', 1) + entry)
+            stts = full(b'stts', struct.pack('>III', 1, tr['n'], tr['duration']))
+            counts = [c for _, _, c in chunk_lists[t]]
+            entries = [(1, counts[0])]
+            for i, c in enumerate(counts[1:], 2):
+                if c != entries[-1][1]:
+                    entries.append((i, c))
+            stsc = full(b'stsc', struct.pack('>I', len(entries)) + b''.join(struct.pack('>III', f, c, 1) for f, c in entries))
+            if exotic and t == 1:
+                stsz = full(b'stz2', struct.pack('>II', 16, tr['n']) + b''.join(struct.pack('>H', s) for s in tr['sizes']))
+            else:
+                stsz = full(b'stsz', struct.pack('>II', 0, tr['n']) + b''.join(struct.pack('>I', s) for s in tr['sizes']))
+            stco = full(b'stco', struct.pack('>I', len(offsets[t])) + b''.join(struct.pack('>I', o) for o in offsets[t]))
+            extra = b''
+            if t == 0 and sync_tables:
+                keys = list(range(1, tr['n'] + 1, 10))
+                extra += full(b'stss', struct.pack('>I', len(keys)) + b''.join(struct.pack('>I', k) for k in keys))
+                extra += full(b'ctts', struct.pack('>I', 1) + struct.pack('>II', tr['n'], 2000))
+                if exotic:
+                    extra += full(b'sdtp', bytes([0x20 if i % 10 == 0 else 0x10 for i in range(tr['n'])]))
+                    extra += full(b'sbgp', b'rap ' + struct.pack('>III', 1, tr['n'], 1))
+            stbl = atom(b'stbl', stsd + stts + extra + stsc + stsz + stco)
+            dinf = atom(b'dinf', full(b'dref', struct.pack('>I', 1) + full(b'url ', b'', 1)))
+            minf = atom(b'minf', mhd + dinf + stbl)
+            mdia = atom(b'mdia', mdhd + hdlr + minf)
+            traks.append(atom(b'trak', tkhd + mdia))
+        if exotic and part % 2:
+            traks.reverse()
+        traks = b''.join(traks)
+        mvhd = full(b'mvhd', struct.pack('>IIII', 0, 0, 1000, max(tr['n'] * tr['duration'] * 1000 // tr['timescale'] for tr in tracks)) + struct.pack('>IH', 0x10000, 0x100) + bytes(10) + bytes(36) + bytes(24) + struct.pack('>I', 3))
+        moov = atom(b'moov', mvhd + traks)
+        return moov, atom(b'mdat', payload)
+
+    ftyp = atom(b'ftyp', b'isom\0\0\2\0isomiso2avc1mp41')
+    if exotic:
+        ftyp += atom(b'uuid', bytes(range(16)) + b'part %d' % part)
+    if moov_last:
+        moov, mdat = build(len(ftyp))
+        return ftyp + mdat + moov
+    moov, _ = build(0)
+    moov, mdat = build(len(ftyp) + len(moov))
+    return ftyp + moov + mdat
+
+def atom_children(buf, start, end):
+    pos = start
+    while pos < end:
+        size, type = struct.unpack('>I4s', buf[pos:pos + 8])
+        header = 8
+        if size == 1:
+            size = struct.unpack('>Q', buf[pos + 8:pos + 16])[0]
+            header = 16
+        yield type, pos + header, pos + size
+        pos += size
+
+def read_stbls(data):
+    """Returns the sample tables of an MP4 in `data` by track ID, as lists
+    of (type, body) in file order."""
+    def find(start, end, type):
+        return [(s, e) for t, s, e in atom_children(data, start, end) if t == type]
+    (ms, me), = find(0, len(data), b'moov')
+    result = {}
+    for ts, te in find(ms, me, b'trak'):
+        (hs, he), = find(ts, te, b'tkhd')
+        track_id = struct.unpack('>I', data[hs + 12:hs + 16])[0]
+        (ds, de), = find(ts, te, b'mdia')
+        (ns, ne), = find(ds, de, b'minf')
+        (bs, be), = find(ns, ne, b'stbl')
+        result[track_id] = [(t, data[s:e]) for t, s, e in atom_children(data, bs, be)]
+    return result
+
+def read_samples(data):
+    """Returns the sample bytes of an MP4 in `data` by track ID, located
+    through stsc, stco or co64, and stsz or stz2."""
+    result = {}
+    for track_id, stbl in read_stbls(data).items():
+        tables = dict(stbl)
+        stsc = tables[b'stsc']; n = struct.unpack('>I', stsc[4:8])[0]
+        stsc = [struct.unpack('>III', stsc[8 + 12 * i:20 + 12 * i]) for i in range(n)]
+        if b'stz2' in tables:
+            stsz = tables[b'stz2']; n = struct.unpack('>I', stsz[8:12])[0]
+            sizes = struct.unpack('>%dH' % n, stsz[12:12 + 2 * n])
+        else:
+            stsz = tables[b'stsz']; n = struct.unpack('>I', stsz[8:12])[0]
+            sizes = struct.unpack('>%dI' % n, stsz[12:12 + 4 * n])
+        if b'co64' in tables:
+            co = tables[b'co64']; n = struct.unpack('>I', co[4:8])[0]
+            offsets = struct.unpack('>%dQ' % n, co[8:8 + 8 * n])
+        else:
+            co = tables[b'stco']; n = struct.unpack('>I', co[4:8])[0]
+            offsets = struct.unpack('>%dI' % n, co[8:8 + 4 * n])
+        samples = []
+        s = 0
+        for c, offset in enumerate(offsets, 1):
+            per_chunk = [e[1] for e in stsc if e[0] <= c][-1]
+            for _ in range(per_chunk):
+                samples.append(data[offset:offset + sizes[s]])
+                offset += sizes[s]
+                s += 1
+        assert s == len(sizes)
+        result[track_id] = samples
+    return result
+
+class TestJoinMp4(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write_parts(self, n, **kwargs):
+        parts = []
+        for i in range(n):
+            parts.append(os.path.join(self.tmp.name, 'part%d.mp4' % i))
+            with open(parts[-1], 'wb') as f:
+                f.write(make_mp4(i, video_samples=23 + i, audio_samples=37 + 2 * i, **kwargs))
+        return parts
+
+    def assertMerged(self, output, parts):
+        with open(output, 'rb') as f:
+            merged = read_samples(f.read())
+        expected = {}
+        for part in parts:
+            with open(part, 'rb') as f:
+                for track, samples in read_samples(f.read()).items():
+                    expected.setdefault(track, []).extend(samples)
+        self.assertEqual(merged, expected)
+
+    def test_concat_mp4(self):
+        parts = self.write_parts(3)
+        output = join_mp4.concat_mp4(parts, os.path.join(self.tmp.name, 'out.mp4'))
+        self.assertMerged(output, parts)
+
+    def test_co64(self):
+        # Pretend 32-bit fields hold 4 KiB, so that offsets past it go co64
+        # and the merged mdat gets a 64-bit size
+        parts = self.write_parts(3)
+        output = os.path.join(self.tmp.name, 'out.mp4')
+        with mock.patch.object(join_mp4, 'MAX_UINT32', 4096):
+            join_mp4.concat_mp4(parts, output)
+        with open(output, 'rb') as f:
+            data = f.read()
+        self.assertEqual(data.count(b'co64'), 2)
+        self.assertNotIn(b'stco', data)
+        self.assertIn(struct.pack('>I4s', 1, b'mdat'), data)
+        self.assertMerged(output, parts)
+
+        # ... which reads back in, and leaves co64 once the offsets fit
+        again = os.path.join(self.tmp.name, 'again.mp4')
+        join_mp4.concat_mp4([output, parts[0]], again)
+        with open(again, 'rb') as f:
+            data = f.read()
+        self.assertNotIn(b'co64', data)
+        self.assertMerged(again, parts + parts[:1])
+
+    def test_co64_without_array_q(self):
+        # As before Python 3.3: offsets in array('L') or in a list
+        parts = self.write_parts(3)
+        for typecode in ('L', None):
+            output = os.path.join(self.tmp.name, 'out.mp4')
+            with mock.patch.object(join_mp4, 'MAX_UINT32', 4096), \
+                 mock.patch.object(join_mp4, 'UINT64', typecode):
+                join_mp4.concat_mp4(parts, output)
+                again = os.path.join(self.tmp.name, 'again.mp4')
+                join_mp4.concat_mp4([output, parts[0]], again)
+            with open(again, 'rb') as f:
+                self.assertEqual(f.read().count(b'co64'), 2)
+            self.assertMerged(again, parts + parts[:1])
+
+    def test_exotic(self):
+        parts = self.write_parts(3, exotic=True)
+        output = join_mp4.concat_mp4(parts, os.path.join(self.tmp.name, 'out.mp4'))
+        self.assertMerged(output, parts)
+        with open(output, 'rb') as f:
+            data = f.read()
+        self.assertIn(b'tx3g', data)
+        self.assertIn(b'uuid' + bytes(range(16)) + b'part 0', data)
+        self.assertNotIn(b'stz2', data)
+        self.assertNotIn(b'sbgp', data)
+        # sdtp: one byte per video sample of every part
+        sdtp = data.index(b'sdtp')
+        size = struct.unpack('>I', data[sdtp - 4:sdtp])[0]
+        self.assertEqual(size, 12 + 23 + 24 + 25)
+
+    def test_optional_tables(self):
+        # stss, ctts and sdtp are merged whichever parts have them
+        for order in ((False, True), (True, False)):
+            parts = []
+            for i, sync_tables in enumerate(order):
+                parts.append(os.path.join(self.tmp.name, 'part%d.mp4' % i))
+                with open(parts[-1], 'wb') as f:
+                    f.write(make_mp4(i, video_samples=23 + i, exotic=True, sync_tables=sync_tables))
+            output = join_mp4.concat_mp4(parts, os.path.join(self.tmp.name, 'out.mp4'))
+            self.assertMerged(output, parts)
+            with open(output, 'rb') as f:
+                stbl = read_stbls(f.read())[1]
+            types = [b'stsd', b'stts', b'ctts', b'stss', b'stsc', b'stsz', b'stco', b'sdtp']
+            if order[0]:
+                # As laid out in the first part
+                self.assertCountEqual([t for t, _ in stbl], types)
+            else:
+                self.assertEqual([t for t, _ in stbl], types)
+            tables = dict(stbl)
+
+            # Every sample of the part without stss is a sync sample
+            n = struct.unpack('>I', tables[b'stss'][4:8])[0]
+            stss = list(struct.unpack('>%dI' % n, tables[b'stss'][8:]))
+            ctts = list(struct.unpack('>%dI' % (2 * struct.unpack('>I', tables[b'ctts'][4:8])[0]), tables[b'ctts'][8:]))
+            sdtp = tables[b'sdtp'][4:]
+            keys = lambda n, start: [start + k for k in range(1, n + 1, 10)]
+            if order[0]:
+                self.assertEqual(stss, keys(23, 0) + list(range(24, 24 + 24)))
+                self.assertEqual(ctts, [23, 2000, 24, 0])
+                self.assertEqual(sdtp[23:], bytes(24))
+            else:
+                self.assertEqual(stss, list(range(1, 24)) + keys(24, 23))
+                self.assertEqual(ctts, [23, 0, 24, 2000])
+                self.assertEqual(sdtp[:23], bytes(23))
+            self.assertEqual(len(sdtp), 23 + 24)
+
+    def test_faststart(self):
+        parts = self.write_parts(3, moov_last=True)
+        output = os.path.join(self.tmp.name, 'out.mp4')
+        join_mp4.concat_mp4(parts, output)
+        self.assertMerged(output, parts)
+
+        join_mp4.concat_mp4(parts, output, faststart=True)
+        with open(output, 'rb') as f:
+            data = f.read()
+        types = []
+        pos = 0
+        while pos < len(data):
+            size, type = struct.unpack('>I4s', data[pos:pos + 8])
+            types.append(type)
+            pos += size
+        self.assertEqual(types, [b'ftyp', b'moov', b'mdat'])
+        self.assertMerged(output, parts)
+
+    def test_deferred_atom(self):
+        stts = full(b'stts', struct.pack('>IIIII', 2, 10, 1000, 1, 500))
+        # Written as it was without being decoded ...
+        atom = join_mp4.read_atom(BytesIO(stts))
+        self.assertIsInstance(atom, join_mp4.DeferredAtom)
+        out = BytesIO()
+        atom.write(out)
+        self.assertEqual(out.getvalue(), stts)
+        # ... and decoded when its body is used
+        atom = join_mp4.read_atom(BytesIO(stts))
+        self.assertEqual(list(atom.body[1]), [10, 1000, 1, 500])
+        atom.body = atom.body[0], join_mp4.merge_stts([atom.body[1]])
+        self.assertEqual(atom.calsize(), 8 + 4 + 4 + 2 * 8)
+
+    def test_copy_stream(self):
+        data = os.urandom(3 * 1024 * 1024 + 123)
+        source = os.path.join(self.tmp.name, 'source')
+        target = os.path.join(self.tmp.name, 'target')
+        with open(source, 'wb') as f:
+            f.write(data)
+        with open(source, 'rb') as s, open(target, 'wb') as t:
+            t.write(b'head')
+            s.seek(100)
+            join_mp4.copy_stream(s, t, len(data) - 200)
+            t.write(b'tail')
+            self.assertEqual(s.tell(), len(data) - 100)
+        with open(target, 'rb') as f:
+            self.assertEqual(f.read(), b'head' + data[100:-100] + b'tail')
+
+        # No file descriptors: plain read/write loop
+        t = BytesIO()
+        s = BytesIO(data)
+        s.seek(5)
+        join_mp4.copy_stream(s, t, 10)
+        self.assertEqual(t.getvalue(), data[5:15])
+
+def ts_packet(pid, cc, payload, start=False, pcr=None):
+    """Returns a 188-byte TS packet, its payload padded by an adaptation field."""
+    header = bytes([0x47, (0x40 if start else 0) | pid >> 8, pid & 0xff])
+    if pcr is None and len(payload) == 184:
+        return header + bytes([0x10 | cc]) + payload
+    flags = b'\x00'
+    if pcr is not None:
+        flags = b'\x10' + struct.pack('>IH', pcr >> 1, (pcr & 1) << 15 | 0x7e00)
+    stuffing = b'\xff' * (183 - len(flags) - len(payload))
+    return header + bytes([0x30 | cc, 183 - len(payload)]) + flags + stuffing + payload
+
+def pes_header(stream_id, pts, dts):
+    def timestamp(prefix, ts):
+        return bytes([prefix << 4 | ts >> 29 & 0x0e | 1, ts >> 22 & 0xff, ts >> 14 & 0xfe | 1, ts >> 7 & 0xff, ts << 1 & 0xfe | 1])
+    return b'\0\0\1' + bytes([stream_id, 0, 0, 0x80, 0xc0, 10]) + timestamp(3, pts) + timestamp(1, dts)
+
+def make_ts(frames, start=0):
+    """Returns a TS of `frames` video frames (PID 0x100, two packets each,
+    carrying the PCR) and audio frames (PID 0x101), 40 ms apart."""
+    packets = [ts_packet(0, 0, b'\0\0\xb0\x0d' + bytes(180), True),
+               ts_packet(0x1000, 0, b'\0\2\xb0\x17' + bytes(180), True)]
+    cc = {0x100: 0, 0x101: 0}
+    def add(pid, payload, start=False, pcr=None):
+        packets.append(ts_packet(pid, cc[pid], payload, start, pcr))
+        cc[pid] = (cc[pid] + 1) % 16
+    for i in range(frames):
+        pts = start + i * 3600
+        add(0x100, pes_header(0xe0, pts + 3600, pts) + bytes([i % 256]) * 100, True, pts)
+        add(0x100, bytes([i % 256]) * 184)
+        add(0x101, pes_header(0xc0, pts, pts) + bytes([i % 256]) * 20, True)
+    return b''.join(packets)
+
+def read_ts(data):
+    """Returns [(pid, cc, has payload, clock fields)] of the packets in data."""
+    packets = []
+    for pos in range(0, len(data), 188):
+        packet = data[pos:pos + 188]
+        assert packet[0] == 0x47
+        fields = [(i, is_pcr, join_ts.read_field(packet, (i, is_pcr))) for i, is_pcr in join_ts.timestamp_fields(packet)]
+        packets.append(((packet[1] & 0x1f) << 8 | packet[2], packet[3] & 0x0f, bool(packet[3] & 0x10), fields))
+    return packets
+
+class TestJoinTs(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def concat(self, datas):
+        parts = []
+        for i, data in enumerate(datas):
+            parts.append(os.path.join(self.tmp.name, 'part%d.ts' % i))
+            with open(parts[-1], 'wb') as f:
+                f.write(data)
+        output = join_ts.concat_ts(parts, os.path.join(self.tmp.name, 'out.ts'), remove=True)
+        self.assertFalse(any(os.path.exists(x) for x in parts))
+        with open(output, 'rb') as f:
+            return f.read()
+
+    def test_failed_merge(self):
+        # A part that cannot be read leaves no output, and every part
+        part = os.path.join(self.tmp.name, 'part0.ts')
+        with open(part, 'wb') as f:
+            f.write(make_ts(10))
+        output = os.path.join(self.tmp.name, 'out.ts')
+        self.assertRaises(OSError, join_ts.concat_ts, [part, part + '.missing'], output, remove=True)
+        self.assertEqual(sorted(os.listdir(self.tmp.name)), ['out.ts.download', 'part0.ts'])
+
+    def test_continuous_parts(self):
+        # Parts cut from one stream are joined as they are
+        data = make_ts(30)
+        cut = 188 * 40
+        self.assertEqual(self.concat([data[:cut], data[cut:]]), data)
+
+    def test_rebase_in_place(self):
+        # Counters follow on (32 frames, without PAT/PMT) but the timeline
+        # starts over: only the packets with clock fields are rewritten
+        second = make_ts(32)[2 * 188:]
+        data = self.concat([make_ts(32), second])
+        dts = [v for pid, _, _, fields in read_ts(data) if pid == 0x100 for i, is_pcr, v in fields[2:]]
+        self.assertEqual(dts, [i * 3600 for i in range(64)])
+        # The video packet continuing the last frame is untouched
+        self.assertEqual(data[-2 * 188:-188], second[-2 * 188:-188])
+
+    def test_rebase(self):
+        # Parts with timelines of their own: starting over, and an hour ahead
+        data = self.concat([make_ts(60), make_ts(37), make_ts(21, start=3600 * 90000)])
+        packets = read_ts(data)
+        self.assertEqual(len(data), len(make_ts(60)) + len(make_ts(37)) + len(make_ts(21)))
+        last_cc = {}
+        for pid, cc, payload, fields in packets:
+            if pid in last_cc and pid not in (0, 0x1000):
+                self.assertEqual(cc, (last_cc[pid] + 1) % 16 if payload else last_cc[pid])
+            last_cc[pid] = cc
+        # Video DTS (and PCR) run on 40 ms apart across the parts
+        dts = [v for pid, _, _, fields in packets if pid == 0x100 for i, is_pcr, v in fields[2:]]
+        pcr = [v for pid, _, _, fields in packets if pid == 0x100 for i, is_pcr, v in fields if is_pcr]
+        self.assertEqual(dts, [i * 3600 for i in range(60 + 37 + 21)])
+        self.assertEqual(pcr, dts)
+        # Payloads are untouched
+        self.assertEqual(data[-20:], make_ts(21)[-20:])
+
+if __name__ == '__main__':
+    unittest.main()
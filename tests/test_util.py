@@ -1,11 +1,359 @@
 #!/usr/bin/env python
 
+import asyncio
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
 import unittest
+from unittest import mock
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib import request
 
 from you_get.util.fs import *
+from you_get.util import aes, m3u8
+from you_get.util.parallel import imap
+from you_get.util.archive import Archive
+from you_get.util.connpool import ConnectionPool
+
+def encrypt_cbc(key, iv, plain):
+    """AES-CBC encrypts plain, padded, using only the block decryption:
+    each block of ciphertext is derived from the one after it, starting
+    from an arbitrary last one. The first block of plain is then whatever
+    the first block of ciphertext decrypts to with iv; returns it with the
+    rest of plain, and the ciphertext."""
+    assert len(plain) >= 16
+    n = 16 - len(plain) % 16
+    plain += bytes([n]) * n
+    dk = aes.decryption_key(key)
+    blocks = [bytes(range(16))]
+    for i in range(len(plain) - 16, 0, -16):
+        block, _ = aes.decrypt_cbc(dk, bytes(16), blocks[0])
+        blocks.insert(0, bytes(a ^ b for a, b in zip(block, plain[i:i + 16])))
+    block, _ = aes.decrypt_cbc(dk, iv, blocks[0])
+    return block + plain[16:-n], b''.join(blocks)
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    """Answers every GET with its path, the client port and the Cookie
+    header; /close drops the connection after answering, without saying
+    so, as a server timing out an idle keep-alive connection does."""
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if self.path == '/login':
+            body = b'ok'
+        else:
+            body = ('%s %d %s' % (self.path, self.client_address[1], self.headers['Cookie'])).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        if self.path == '/login':
+            self.send_header('Set-Cookie', 'session=42; Path=/')
+        self.end_headers()
+        self.wfile.write(body)
+        if self.path == '/close':
+            self.close_connection = True
+
+    def log_message(self, *args):
+        pass
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """Serves data at every path, with an ETag, honouring Range (bytes=N-
+    or bytes=N-M) and If-Range unless ranges is off. HEAD is refused with
+    405 unless head is on, and the body is sent after delay seconds. With
+    cut, the first GET is dropped after that many bytes of body.
+
+    Subclasses set these class attributes, and requests, a list that gets
+    the method and Range header of each request."""
+    protocol_version = 'HTTP/1.1'
+    data = bytes(range(256)) * 200
+    etag = '"v1"'
+    ranges = True
+    head = True
+    delay = 0
+    cut = None
+    requests = None
+
+    def do_HEAD(self):
+        if self.head:
+            self.respond(False)
+        else:
+            self.log_request()
+            self.send_response(405)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+    def do_GET(self):
+        self.respond(True)
+
+    def respond(self, body):
+        if self.requests is not None:
+            self.requests.append((self.command, self.headers['Range']))
+        start, end = 0, len(self.data) - 1
+        m = re.match(r'bytes=(\d+)-(\d*)$', self.headers['Range'] or '')
+        partial = m and self.ranges and self.headers['If-Range'] in (None, self.etag)
+        if partial:
+            start = int(m.group(1))
+            if m.group(2):
+                end = min(int(m.group(2)), end)
+        self.send_response(206 if partial else 200)
+        self.send_header('Content-Type', 'video/mp4')
+        self.send_header('Content-Length', str(end + 1 - start))
+        self.send_header('ETag', self.etag)
+        if partial:
+            self.send_header('Content-Range', 'bytes %d-%d/%d' % (start, end, len(self.data)))
+        if self.ranges:
+            self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+        if body:
+            time.sleep(self.delay)
+            if self.cut is not None and [m for m, _ in self.requests].count('GET') == 1:
+                self.wfile.write(self.data[start:start + self.cut])
+                self.close_connection = True
+                return
+            self.wfile.write(self.data[start:end + 1])
+
+    def log_message(self, *args):
+        pass
+
+def range_handler(**attrs):
+    return type('Handler', (RangeHandler,), dict(attrs, requests = []))
+
+def start_server(handler):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, 'http://127.0.0.1:%d' % server.server_port
+
+class TestConnectionPool(unittest.TestCase):
+
+    def setUp(self):
+        self.server, self.base = start_server(KeepAliveHandler)
+        self.pool = ConnectionPool()
+        self.pool.set_proxies({})
+
+    def tearDown(self):
+        self.pool.clear()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def get(self, path):
+        with self.pool.urlopen(self.base + path) as response:
+            return response.read().decode().split()
+
+    def test_reuse(self):
+        ports = [self.get('/a')[1], self.get('/b')[1], self.get('/c')[1]]
+        self.assertEqual(len(set(ports)), 1)
+
+        # A response closed before its body is read gives up its connection
+        response = self.pool.urlopen(self.base + '/d')
+        response.close()
+        self.assertNotEqual(self.get('/e')[1], ports[0])
+
+    def test_timeout(self):
+        handler = range_handler(delay = 1)
+        server, base = start_server(handler)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.pool.timeout = 0.2
+        with self.pool.urlopen(base + '/a') as response:
+            self.assertRaises(OSError, response.read)
+
+    def test_ssl_context_fallback(self):
+        import ssl, warnings
+        with mock.patch.dict(ssl.__dict__), warnings.catch_warnings():
+            # PROTOCOL_SSLv23 is deprecated where the fallback isn't needed
+            warnings.simplefilter('ignore', DeprecationWarning)
+            del ssl.create_default_context
+            conn = self.pool.connect(('https', 'example.com', 443, None))
+        self.assertIsInstance(self.pool.ssl_context, ssl.SSLContext)
+        self.assertEqual(conn.timeout, 60)
+
+    def test_stale_connection(self):
+        first = self.get('/close')[1]
+        # The idle connection is dead; the request is retried on a new one
+        second = self.get('/a')[1]
+        self.assertNotEqual(first, second)
+        self.assertEqual(self.get('/b')[1], second)
+
+@unittest.skipIf(sys.version_info < (3, 5), 'util.aio needs Python 3.5')
+class TestAio(unittest.TestCase):
+
+    def setUp(self):
+        from you_get.util import aio
+        self.aio = aio
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def serve(self, **attrs):
+        handler = range_handler(**attrs)
+        server, base = start_server(handler)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return handler, base
+
+    def download(self, urls, paths, metas, **kwargs):
+        self.aio.download(urls, paths, None, is_part = True, concurrency = 2, get_proxy = lambda scheme, host: None,
+                          metas = metas, **kwargs)
+
+    def test_save(self):
+        handler, base = self.serve()
+        size = len(handler.data)
+        paths = [os.path.join(self.tmp.name, name) for name in ('a', 'b', 'c')]
+        # a resumes, b is a stale partial download, c starts from scratch
+        for path in paths[:2]:
+            with open(path + '.download', 'wb') as f:
+                f.write(handler.data[:1000])
+        metas = [{'file_size': size, 'etag': handler.etag}, {'file_size': size, 'etag': '"v0"'}, {'file_size': size}]
+        self.download([base + '/a', base + '/b', base + '/c'], paths, metas)
+        for path in paths:
+            with open(path, 'rb') as f:
+                self.assertEqual(f.read(), handler.data)
+            self.assertFalse(os.path.exists(path + '.download'))
+        self.assertCountEqual(handler.requests, [('GET', 'bytes=1000-')] * 2 + [('GET', None)])
+
+    def test_retry_without_ranges(self):
+        # The connection drops; the retry gets the whole file again
+        handler, base = self.serve(ranges = False, cut = 3000)
+        path = os.path.join(self.tmp.name, 'a')
+        self.download([base + '/a'], [path], [{'file_size': len(handler.data)}])
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), handler.data)
+        self.assertEqual(handler.requests, [('GET', None), ('GET', 'bytes=3000-')])
+
+    def test_read_timeout(self):
+        handler, base = self.serve(delay = 1)
+        path = os.path.join(self.tmp.name, 'a')
+        with self.assertRaises(OSError):
+            self.download([base + '/a'], [path], [{'file_size': len(handler.data)}], read_timeout = 0.2)
+
+    def test_connect_timeout(self):
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        self.assertRaises(OSError, loop.run_until_complete, self.aio.timed(asyncio.sleep(1), 0.05))
+        self.assertEqual(loop.run_until_complete(self.aio.timed(asyncio.sleep(0, 'done'), 1)), 'done')
 
 class TestUtil(unittest.TestCase):
     def test_legitimize(self):
         self.assertEqual(legitimize("1*2", os="Linux"), "1*2")
         self.assertEqual(legitimize("1*2", os="Darwin"), "1*2")
         self.assertEqual(legitimize("1*2", os="Windows"), "1-2")
+
+    def test_m3u8(self):
+        master = m3u8.parse('\n'.join([
+            '#EXTM3U',
+            '#EXT-X-STREAM-INF:BANDWIDTH=800000,CODECS="avc1.4d401f,mp4a.40.2"',
+            'low/index.m3u8',
+            '#EXT-X-STREAM-INF:BANDWIDTH=2400000',
+            'http://cdn.example.com/high/index.m3u8',
+        ]), 'http://example.com/live/master.m3u8')
+        self.assertTrue(master.is_master)
+        self.assertEqual(master.variants[0].uri, 'http://example.com/live/low/index.m3u8')
+        self.assertEqual(master.variants[0].attributes['CODECS'], 'avc1.4d401f,mp4a.40.2')
+        self.assertEqual(m3u8.choose_variant(master).bandwidth, 2400000)
+        self.assertEqual(m3u8.choose_variant(master, 1000000).bandwidth, 800000)
+        self.assertEqual(m3u8.choose_variant(master, 1000).bandwidth, 800000)
+
+        media = m3u8.parse('\n'.join([
+            '#EXTM3U',
+            '#EXT-X-TARGETDURATION:10',
+            '#EXT-X-MEDIA-SEQUENCE:7',
+            '#EXT-X-KEY:METHOD=AES-128,URI="key.bin",IV=0x01',
+            '#EXTINF:9.5,',
+            '#EXT-X-BYTERANGE:1000@0',
+            'all.ts',
+            '#EXTINF:10.0,',
+            '#EXT-X-BYTERANGE:500',
+            'all.ts',
+            '#EXT-X-KEY:METHOD=NONE',
+            '#EXT-X-DISCONTINUITY',
+            '#EXTINF:4.5,',
+            'last.ts',
+            '#EXT-X-ENDLIST',
+        ]), 'http://example.com/vod/index.m3u8')
+        self.assertFalse(media.is_master)
+        self.assertTrue(media.endlist)
+        self.assertEqual(media.duration, 24.0)
+        first, second, last = media.segments
+        self.assertEqual(first.uri, 'http://example.com/vod/all.ts')
+        self.assertEqual((first.sequence, second.sequence, last.sequence), (7, 8, 9))
+        self.assertEqual((first.byterange, second.byterange, last.byterange), ((0, 1000), (1000, 500), None))
+        self.assertEqual(first.key['URI'], 'http://example.com/vod/key.bin')
+        self.assertIs(second.key, first.key)
+        self.assertIsNone(last.key)
+        self.assertEqual([s.discontinuity for s in media.segments], [False, False, True])
+
+        self.assertRaises(ValueError, m3u8.parse, '<html></html>')
+        # Playlists that extractors hand over may lack the header
+        loose = m3u8.parse('#EXTINF:5,\nhttp://a/1.flv?ts_start=0\n#EXTINF:5,\nhttp://a/1.flv?ts_start=5\n', strict = False)
+        self.assertEqual([s.uri for s in loose.segments], ['http://a/1.flv?ts_start=0', 'http://a/1.flv?ts_start=5'])
+
+    def test_imap(self):
+        daemons = []
+        def square(x):
+            daemons.append(threading.current_thread().daemon)
+            time.sleep(0.01 * (x % 3))
+            return x * x
+        self.assertEqual(list(imap(square, range(10), 4)), [x * x for x in range(10)])
+        self.assertTrue(all(daemons))
+
+        def fail(x):
+            if x == 3:
+                raise ValueError(x)
+            return x
+        results = imap(fail, range(10), 2)
+        self.assertEqual([next(results) for _ in range(3)], [0, 1, 2])
+        self.assertRaises(ValueError, next, results)
+
+    def test_which(self):
+        import shutil
+        from you_get.util import tools
+        with tempfile.TemporaryDirectory() as tmp, mock.patch.dict(shutil.__dict__), \
+             mock.patch.dict(os.environ, {'PATH': tmp}):
+            del shutil.which
+            path = os.path.join(tmp, 'tool')
+            open(path, 'w').close()
+            self.assertIsNone(tools.which('tool'))
+            os.chmod(path, 0o755)
+            self.assertEqual(tools.which('tool'), path)
+            self.assertIsNone(tools.which('other'))
+
+    def test_aes(self):
+        # FIPS-197, appendix C
+        plain = bytes.fromhex('00112233445566778899aabbccddeeff')
+        for key, cipher in [('000102030405060708090a0b0c0d0e0f', '69c4e0d86a7b0430d8cdb78070b4c55a'),
+                            ('000102030405060708090a0b0c0d0e0f1011121314151617', 'dda97ca4864cdfe06eaf70a0ec0d7191'),
+                            ('000102030405060708090a0b0c0d0e0f101112131415161718191a1b1c1d1e1f', '8ea2b7ca516745bfeafc49904b496089')]:
+            dk = aes.decryption_key(bytes.fromhex(key))
+            self.assertEqual(aes.decrypt_cbc(dk, bytes(16), bytes.fromhex(cipher))[0], plain)
+
+        key = bytes(range(100, 116))
+        iv = bytes(range(16))
+        for size in (16, 17, 32, 100):
+            plain, cipher = encrypt_cbc(key, iv, bytes(range(size)))
+            self.assertEqual(plain[16:], bytes(range(16, size)))
+            for decryptor in (aes.Decryptor(key, iv), aes.decryptor(key, iv)):
+                pieces = [decryptor.update(cipher[i:i + 7]) for i in range(0, len(cipher), 7)]
+                self.assertEqual(b''.join(pieces) + decryptor.finalize(), plain)
+
+        decryptor = aes.Decryptor(key, iv)
+        decryptor.update(cipher[:-1])
+        self.assertRaises(ValueError, decryptor.finalize)
+        self.assertRaises(ValueError, aes.unpad, bytes(16))
+
+    def test_archive(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'archive.db')
+            archive = Archive(path)
+            archive.add('youtube', 'abc', 'Title')
+            archive.add('tudou', 123)
+            archive.add('youtube', 'abc', 'Title again')
+            archive.close()
+
+            archive = Archive(path)
+            self.assertIn(('youtube', 'abc'), archive)
+            self.assertIn(('tudou', '123'), archive)
+            self.assertNotIn(('tudou', 'abc'), archive)
+            archive.close()